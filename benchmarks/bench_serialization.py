@@ -0,0 +1,75 @@
+"""Benchmark encode and decode throughput of the cache serializers on
+ExportImage records.
+
+Usage: python benchmarks/bench_serialization.py [export file] [--repeat N]
+
+Records are taken from the images of an existing export file (by default
+bia-export.json), so they are representative of real cache entries."""
+
+import argparse
+import json
+import time
+from pathlib import Path
+
+from bia_export.models import ExportImage
+from bia_export.serialization import SERIALIZERS
+
+
+def load_images(fpath: Path) -> list[ExportImage]:
+    with open(fpath) as fh:
+        exports = json.load(fh)
+
+    return [ExportImage.parse_obj(image) for image in exports["images"].values()]
+
+
+def bench(serializer, images: list[ExportImage], repeat: int) -> dict:
+    encode_seconds = decode_seconds = 0.0
+    n_bytes = 0
+    for _ in range(repeat):
+        started_at = time.perf_counter()
+        encoded = [serializer.dumps(image) for image in images]
+        encode_seconds += time.perf_counter() - started_at
+
+        started_at = time.perf_counter()
+        for data in encoded:
+            serializer.loads(data, ExportImage)
+        decode_seconds += time.perf_counter() - started_at
+
+        n_bytes = sum(len(data) for data in encoded)
+
+    n_records = len(images) * repeat
+    return {
+        "bytes/record": n_bytes / len(images),
+        "encode records/s": n_records / encode_seconds,
+        "encode MB/s": n_bytes * repeat / encode_seconds / 1e6,
+        "decode records/s": n_records / decode_seconds,
+        "decode MB/s": n_bytes * repeat / decode_seconds / 1e6,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("export_fpath", nargs="?", default="bia-export.json")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    images = load_images(Path(args.export_fpath))
+    print(f"{len(images)} ExportImage records x {args.repeat} repeats\n")
+
+    columns = None
+    for name, serializer_cls in SERIALIZERS.items():
+        try:
+            serializer = serializer_cls()
+        except ImportError as e:
+            print(f"{name:<8} skipped: {e}")
+            continue
+
+        results = bench(serializer, images, args.repeat)
+        if columns is None:
+            columns = list(results)
+            print(f"{'':<8} " + " ".join(f"{column:>17}" for column in columns))
+        print(f"{name:<8} " + " ".join(f"{results[c]:>17.1f}" for c in columns))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,150 @@
+"""Dataset level aggregates over exported images, so that landing pages can
+show study facets without loading every image."""
+
+import math
+from collections import Counter, defaultdict
+from typing import Iterable
+
+import numpy as np
+
+from .models import ExportImage, ExportImageAggregates, ExportValueRange
+
+
+SIZE_FIELDS = ["sizeX", "sizeY", "sizeZ", "sizeC", "sizeT"]
+PHYSICAL_SIZE_FIELDS = ["PhysicalSizeX", "PhysicalSizeY", "PhysicalSizeZ"]
+
+
+def voxel_count_decade(voxel_count: int) -> str:
+    """Label of the order of magnitude of a voxel count, e.g. "1e6" for 1M-10M.
+    Counted in digits rather than by log10, which rounds up just below powers
+    of 10 for large counts."""
+
+    return f"1e{len(str(max(int(voxel_count), 1))) - 1}"
+
+
+def image_voxel_count(export_image: ExportImage) -> int:
+    return math.prod(getattr(export_image, field) for field in SIZE_FIELDS)
+
+
+class ImageAggregator:
+    """Collects the numeric fields of ExportImage records, grouped by study
+    accession ID, in a single pass. Aggregates are then computed per dataset
+    with vectorized reductions over the collected columns."""
+
+    def __init__(self):
+        self._sizes = defaultdict(list)
+        self._physical_sizes = defaultdict(list)
+
+    def add(self, export_image: ExportImage):
+        accession_id = export_image.study_accession_id
+        self._sizes[accession_id].append(
+            [getattr(export_image, field) for field in SIZE_FIELDS]
+        )
+        self._physical_sizes[accession_id].append(
+            [getattr(export_image, field) for field in PHYSICAL_SIZE_FIELDS]
+        )
+
+    def aggregates(self) -> dict[str, ExportImageAggregates]:
+        return {
+            accession_id: compute_image_aggregates(
+                np.array(sizes, dtype=np.int64),
+                np.array(self._physical_sizes[accession_id], dtype=np.float64),
+            )
+            for accession_id, sizes in self._sizes.items()
+        }
+
+
+def compute_image_aggregates(
+    sizes: np.ndarray, physical_sizes: np.ndarray
+) -> ExportImageAggregates:
+    """Compute aggregates from an (n_images, len(SIZE_FIELDS)) array of sizes and
+    an (n_images, len(PHYSICAL_SIZE_FIELDS)) array of physical sizes, in which
+    missing values are NaN."""
+
+    voxel_counts = sizes.prod(axis=1)
+
+    decade_counts = Counter(voxel_count_decade(count) for count in voxel_counts)
+    n_channels, channel_counts = np.unique(
+        sizes[:, SIZE_FIELDS.index("sizeC")], return_counts=True
+    )
+
+    size_mins, size_maxs = sizes.min(axis=0), sizes.max(axis=0)
+
+    physical_size_ranges = {}
+    known = ~np.isnan(physical_sizes)
+    for n, field in enumerate(PHYSICAL_SIZE_FIELDS):
+        if known[:, n].any():
+            values = physical_sizes[known[:, n], n]
+            physical_size_ranges[field] = ExportValueRange(
+                min=values.min(), max=values.max()
+            )
+
+    return ExportImageAggregates(
+        n_images=len(sizes),
+        total_voxels=int(voxel_counts.sum()),
+        voxel_count_distribution=dict(
+            sorted(decade_counts.items(), key=lambda item: int(item[0][2:]))
+        ),
+        channel_counts={
+            str(n): int(count) for n, count in zip(n_channels, channel_counts)
+        },
+        size_ranges={
+            field: ExportValueRange(min=size_mins[n], max=size_maxs[n])
+            for n, field in enumerate(SIZE_FIELDS)
+        },
+        physical_size_ranges=physical_size_ranges,
+    )
+
+
+def _combine_counts(a: dict[str, int], b: dict[str, int], key) -> dict[str, int]:
+    counts = Counter(a) + Counter(b)
+    return dict(sorted(counts.items(), key=lambda item: key(item[0])))
+
+
+def _combine_ranges(
+    a: dict[str, ExportValueRange], b: dict[str, ExportValueRange]
+) -> dict[str, ExportValueRange]:
+    ranges = dict(a)
+    for field, value_range in b.items():
+        if field in ranges:
+            value_range = ExportValueRange(
+                min=min(ranges[field].min, value_range.min),
+                max=max(ranges[field].max, value_range.max),
+            )
+        ranges[field] = value_range
+
+    return ranges
+
+
+def combine_image_aggregates(
+    a: ExportImageAggregates, b: ExportImageAggregates
+) -> ExportImageAggregates:
+    """Aggregates over two disjoint sets of images, from the aggregates over
+    each, e.g. over the parts of a study's images in different shards."""
+
+    return ExportImageAggregates(
+        n_images=a.n_images + b.n_images,
+        total_voxels=a.total_voxels + b.total_voxels,
+        voxel_count_distribution=_combine_counts(
+            a.voxel_count_distribution,
+            b.voxel_count_distribution,
+            key=lambda decade: int(decade[2:]),
+        ),
+        channel_counts=_combine_counts(a.channel_counts, b.channel_counts, key=int),
+        size_ranges=_combine_ranges(a.size_ranges, b.size_ranges),
+        physical_size_ranges=_combine_ranges(
+            a.physical_size_ranges, b.physical_size_ranges
+        ),
+    )
+
+
+def aggregate_images_by_dataset(
+    export_images: Iterable[ExportImage],
+) -> dict[str, ExportImageAggregates]:
+    """Aggregate export images by the accession ID of their study."""
+
+    aggregator = ImageAggregator()
+    for export_image in export_images:
+        aggregator.add(export_image)
+
+    return aggregator.aggregates()
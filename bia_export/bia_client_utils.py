@@ -5,16 +5,59 @@ import logging
 
 from bia_integrator_api.util import simple_client
 from bia_integrator_api import models as api_models, exceptions as api_exceptions
+from .concurrency import api_limiter
 from .config import settings
+from .singleflight import SingleFlight
 
 logger = logging.getLogger(__name__)
 
 
-rw_client = simple_client(
-    api_base_url=settings.bia_api_basepath,
-    username=settings.bia_username,
-    password=settings.bia_password,
-    disable_ssl_host_check=settings.disable_ssl_host_check,
+class CoalescingClient:
+    """Proxy for the API client which coalesces concurrent identical calls to
+    read methods, so that workers asking for the same object at the same time
+    share one request, and keeps those requests within the adaptive API
+    concurrency limit. Other attributes are passed through unchanged.
+
+    The underlying client can be replaced, e.g. by a snapshot backed client
+    for offline exports."""
+
+    COALESCED_METHODS = {
+        "get_object_info_by_accession",
+        "get_study",
+        "get_image",
+        "get_image_acquisition",
+        "get_specimen",
+        "get_biosample",
+        "get_study_images",
+        "get_study_file_references",
+        "search_studies",
+        "search_images_exact_match",
+    }
+
+    def __init__(self, client):
+        self.client = client
+        self.single_flight = SingleFlight()
+
+    def __getattr__(self, name):
+        attr = getattr(self.client, name)
+        if name not in self.COALESCED_METHODS:
+            return attr
+
+        def coalesced(*args, **kwargs):
+            # Arguments may be unhashable API models, so key on their repr
+            key = repr((name, args, sorted(kwargs.items())))
+            return self.single_flight.do(key, api_limiter.call, attr, *args, **kwargs)
+
+        return coalesced
+
+
+rw_client = CoalescingClient(
+    simple_client(
+        api_base_url=settings.bia_api_basepath,
+        username=settings.bia_username,
+        password=settings.bia_password,
+        disable_ssl_host_check=settings.disable_ssl_host_check,
+    )
 )
 
 
@@ -45,6 +88,13 @@ def get_images_with_a_rep_type(
     return images
 
 
+def get_study_ome_ngff_images(study_uuid: str) -> list[api_models.BIAImage]:
+    """The images of a study which are exported: those with an OME-NGFF
+    representation, up to 500 of them."""
+
+    return get_images_with_a_rep_type(study_uuid, "ome_ngff", limit=500)
+
+
 def get_image_by_accession_id_and_relpath(
     accession_id: str, relpath: str
 ) -> list[api_models.BIAImage]:
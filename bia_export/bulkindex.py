@@ -0,0 +1,176 @@
+"""Streaming of exports to a search engine's bulk API.
+
+Images and datasets are written as bulk API NDJSON (an action line naming
+the index and document ID, then the document) to numbered batch files of
+at most settings.bulk_index_batch_bytes and bulk_index_batch_docs each. The
+batches can also be posted to the _bulk endpoint of an Elasticsearch or
+OpenSearch compatible server as each is completed, several at once, so an
+export is indexed in one streamed pass without being loaded whole. Posts
+which fail with congestion or network errors are retried with backoff, and
+the documents of a batch which cannot be posted are counted as failed."""
+
+import json
+import logging
+from concurrent.futures import Future, ThreadPoolExecutor
+from pathlib import Path
+from typing import NamedTuple
+
+import requests
+
+from .concurrency import retry_transient
+from .config import settings
+from .jsonstream import iter_export_entries
+from .outputs import atomic_output
+
+logger = logging.getLogger(__name__)
+
+
+BATCH_FNAME_TEMPLATE = "batch-{:05d}.ndjson"
+
+INDEXED_SECTIONS = ["datasets", "images"]
+
+
+class PostResult(NamedTuple):
+    fpath: Path
+    n_documents: int
+    n_errors: int
+
+
+def _post(session: requests.Session, url: str, data: bytes) -> dict:
+    response = session.post(
+        url,
+        data=data,
+        headers={"Content-Type": "application/x-ndjson"},
+        timeout=settings.bulk_index_timeout,
+    )
+    response.raise_for_status()
+
+    return response.json()
+
+
+def post_batch(session: requests.Session, url: str, fpath: Path) -> PostResult:
+    """Post a batch file to the _bulk endpoint at url, returning how many of
+    its documents were rejected, or all of them if the batch could not be
+    posted."""
+
+    data = fpath.read_bytes()
+    try:
+        result = retry_transient(_post, session, url, data)
+    except requests.RequestException as e:
+        # Each document is an action line and a source line
+        n_documents = data.count(b"\n") // 2
+        logger.error(f"Could not post {fpath.name} ({n_documents} documents): {e}")
+        return PostResult(fpath, n_documents, n_documents)
+
+    items = result.get("items", [])
+    n_errors = 0
+    if result.get("errors"):
+        for item in items:
+            action_result = next(iter(item.values()))
+            if action_result.get("status", 200) >= 300:
+                n_errors += 1
+                logger.warning(
+                    f"Rejected {action_result.get('_id')}: "
+                    f"{action_result.get('error')}"
+                )
+
+    return PostResult(fpath, len(items), n_errors)
+
+
+class BulkIndexWriter:
+    """Writes documents to size-bounded batch files in dirpath, optionally
+    posting each to url as it is completed."""
+
+    def __init__(
+        self,
+        dirpath: Path,
+        index_prefix: str | None = None,
+        url: str | None = None,
+        workers: int | None = None,
+        max_batch_bytes: int | None = None,
+        max_batch_docs: int | None = None,
+    ):
+        self.dirpath = dirpath
+        self.index_prefix = index_prefix or settings.bulk_index_prefix
+        self.url = url
+        self.max_batch_bytes = max_batch_bytes or settings.bulk_index_batch_bytes
+        self.max_batch_docs = max_batch_docs or settings.bulk_index_batch_docs
+
+        self.batch_fpaths: list[Path] = []
+        self.n_documents = 0
+        self._lines: list[str] = []
+        self._batch_bytes = 0
+
+        self._executor = None
+        self._posts: list[Future] = []
+        self.post_results: list[PostResult] = []
+        if url:
+            self._session = requests.Session()
+            self._executor = ThreadPoolExecutor(
+                max_workers=workers or settings.bulk_index_workers
+            )
+
+    def add(self, kind: str, doc_id: str, document: dict):
+        action = {"index": {"_index": f"{self.index_prefix}-{kind}", "_id": doc_id}}
+        lines = json.dumps(action) + "\n" + json.dumps(document, sort_keys=True) + "\n"
+        size = len(lines.encode())
+
+        if self._lines and (
+            self._batch_bytes + size > self.max_batch_bytes
+            or len(self._lines) >= self.max_batch_docs
+        ):
+            self._flush()
+
+        self._lines.append(lines)
+        self._batch_bytes += size
+        self.n_documents += 1
+
+    def _flush(self):
+        fpath = self.dirpath / BATCH_FNAME_TEMPLATE.format(len(self.batch_fpaths))
+        with atomic_output(fpath) as fh:
+            for lines in self._lines:
+                fh.write(lines)
+        self.batch_fpaths.append(fpath)
+        self._lines = []
+        self._batch_bytes = 0
+
+        if self._executor:
+            self._posts.append(
+                self._executor.submit(post_batch, self._session, self.url, fpath)
+            )
+
+    def close(self) -> list[PostResult]:
+        """Write the last batch, remove batch files left by earlier, larger
+        runs, and wait for any posts. Returns their results."""
+
+        if self._lines:
+            self._flush()
+
+        for fpath in self.dirpath.glob("batch-*.ndjson"):
+            if fpath not in self.batch_fpaths:
+                fpath.unlink()
+
+        if not self._executor:
+            return []
+
+        with self._executor:
+            return [future.result() for future in self._posts]
+
+    def __enter__(self):
+        self.dirpath.mkdir(exist_ok=True, parents=True)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.post_results = self.close()
+        elif self._executor:
+            self._executor.shutdown(cancel_futures=True)
+
+
+def write_bulk_index(export_fpath: Path, writer: BulkIndexWriter):
+    """Stream the datasets and images of the export at export_fpath into
+    writer, one entry at a time."""
+
+    for section in INDEXED_SECTIONS:
+        for key, entry in iter_export_entries(export_fpath, section):
+            writer.add(section, key, entry)
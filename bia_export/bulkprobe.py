@@ -0,0 +1,248 @@
+"""Bulk probing of the OME-Zarr metadata of all of a study's images.
+
+A study's OME-Zarrs live under ACCESSION_ID/ in the bucket, so a paginated
+listing of that prefix shows which metadata documents exist. Only those are
+then fetched, in parallel: the root .zattrs (Zarr v2) or zarr.json (v3) of
+each image, then the metadata of its full resolution array. Per-image probes
+through zarr.open instead make several requests per image, some of which
+miss, one image at a time.
+
+The metadata read is primed into the probe layer, so image export then
+builds each OMEZarrImage without further requests. Listing a prefix also
+lists every chunk object under it, so studies with more than
+settings.bulk_probe_max_keys objects are left to per-image probing."""
+
+import json
+import logging
+import xml.etree.ElementTree as ET
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from typing import Iterator
+
+import numpy as np
+import requests
+
+from .concurrency import zarr_limiter
+from .config import settings
+from .omezarrmeta import ZMeta
+from .proxyimage import ngff_attrs_from_zarr_v3, zarr_v3_array_geometry
+from .singleflight import SingleFlight
+
+logger = logging.getLogger(__name__)
+
+
+S3_NAMESPACE = "{http://s3.amazonaws.com/doc/2006-03-01/}"
+
+METADATA_FNAMES = {".zattrs", ".zgroup", ".zarray", "zarr.json"}
+
+# Seconds to wait for the bucket to respond to each request
+REQUEST_TIMEOUT = 30
+
+
+def parse_list_objects(xml: bytes) -> tuple[list[str], str | None]:
+    """Keys, and the continuation token if truncated, of a ListObjectsV2
+    response."""
+
+    root = ET.fromstring(xml)
+    keys = [
+        element.findtext(f"{S3_NAMESPACE}Key")
+        for element in root.iter(f"{S3_NAMESPACE}Contents")
+    ]
+    token = None
+    if root.findtext(f"{S3_NAMESPACE}IsTruncated") == "true":
+        token = root.findtext(f"{S3_NAMESPACE}NextContinuationToken")
+
+    return keys, token
+
+
+class S3Bucket:
+    """Anonymous read access to an S3 bucket, by path-style requests."""
+
+    def __init__(self, endpoint_url: str, bucket_name: str):
+        self.base_uri = f"{endpoint_url.rstrip('/')}/{bucket_name}/"
+        self.session = requests.Session()
+
+    def list(self, prefix: str) -> Iterator[str]:
+        params = {"list-type": "2", "prefix": prefix}
+        while True:
+            response = self.session.get(
+                self.base_uri, params=params, timeout=REQUEST_TIMEOUT
+            )
+            response.raise_for_status()
+            keys, token = parse_list_objects(response.content)
+            yield from keys
+
+            if token is None:
+                return
+            params["continuation-token"] = token
+
+    def get(self, key: str) -> bytes:
+        response = self.session.get(self.base_uri + key, timeout=REQUEST_TIMEOUT)
+        if response.status_code == 404:
+            raise KeyError(key)
+        response.raise_for_status()
+
+        return response.content
+
+
+class FilesystemBucket:
+    """A bucket laid out as a directory of an fsspec filesystem, e.g. a local
+    copy of part of the archive."""
+
+    def __init__(self, fs, root: str):
+        self.fs = fs
+        self.root = root.rstrip("/")
+        self.base_uri = f"{self.root}/"
+
+    def list(self, prefix: str) -> Iterator[str]:
+        for path in self.fs.find(self.base_uri + prefix):
+            yield path.removeprefix(self.base_uri)
+
+    def get(self, key: str) -> bytes:
+        try:
+            return self.fs.cat_file(self.base_uri + key)
+        except FileNotFoundError:
+            raise KeyError(key)
+
+
+@lru_cache(maxsize=1)
+def default_bucket() -> S3Bucket:
+    return S3Bucket(settings.endpoint_url, settings.bucket_name)
+
+
+# Concurrent listings of the same study share one listing
+listing_single_flight = SingleFlight()
+
+
+def study_metadata_keys(bucket, accession_id: str) -> frozenset[str] | None:
+    """Keys of the Zarr metadata documents under a study's prefix, or None if
+    the study has too many objects to list. Cached, and coalesced while in
+    flight, as the work units of a study each probe its images."""
+
+    return listing_single_flight.do(
+        (bucket, accession_id), _study_metadata_keys, bucket, accession_id
+    )
+
+
+@lru_cache(maxsize=8)
+def _study_metadata_keys(bucket, accession_id: str) -> frozenset[str] | None:
+
+    keys = set()
+    for n, key in enumerate(bucket.list(f"{accession_id}/")):
+        if n >= settings.bulk_probe_max_keys:
+            logger.info(
+                f"{accession_id} has over {settings.bulk_probe_max_keys} objects, "
+                "probing images individually"
+            )
+            return None
+        if key.rsplit("/", 1)[-1] in METADATA_FNAMES:
+            keys.add(key)
+
+    return frozenset(keys)
+
+
+def zarr_v2_array_geometry(zarray: dict) -> dict:
+    return {
+        "shape": list(zarray["shape"]),
+        "chunks": list(zarray["chunks"]),
+        "dtype": str(np.dtype(zarray["dtype"])),
+    }
+
+
+def _fetch_all(bucket, keys: list[str]) -> dict[str, dict]:
+    """Fetch and parse the JSON documents at keys, in parallel, leaving out
+    any which fail. Their images are probed individually instead, which
+    reports the failure."""
+
+    def fetch(key):
+        try:
+            return json.loads(zarr_limiter.call(bucket.get, key))
+        except Exception as e:
+            logger.debug(f"Bulk probe of {key} failed: {e}")
+            return None
+
+    with ThreadPoolExecutor(max_workers=settings.zarr_concurrency_max) as executor:
+        docs = dict(zip(keys, executor.map(fetch, keys)))
+
+    return {key: doc for key, doc in docs.items() if doc is not None}
+
+
+def probe_study(bucket, accession_id: str, uris: list[str]) -> dict[str, dict]:
+    """Read the metadata of the OME-Zarrs at uris, all in the given study,
+    in the form returned by read_ome_zarr_metadata. URIs outside the bucket,
+    or whose metadata is not listed, are left out, as are all of them if the
+    study cannot be listed."""
+
+    store_keys = {
+        uri: uri.removeprefix(bucket.base_uri).rstrip("/")
+        for uri in uris
+        if uri.startswith(f"{bucket.base_uri}{accession_id}/")
+    }
+    if not store_keys:
+        return {}
+
+    # Bulk probing is only an optimisation, so if the bucket cannot be listed
+    # (e.g. it forbids ListObjectsV2) images are probed individually
+    try:
+        listed_keys = study_metadata_keys(bucket, accession_id)
+    except Exception as e:
+        logger.warning(
+            f"Listing {accession_id} failed, probing images individually: {e}"
+        )
+        return {}
+    if listed_keys is None:
+        return {}
+
+    root_keys = {}
+    for uri, store_key in store_keys.items():
+        for fname in ("zarr.json", ".zattrs"):
+            if f"{store_key}/{fname}" in listed_keys:
+                root_keys[uri] = f"{store_key}/{fname}"
+                break
+    root_docs = _fetch_all(bucket, list(root_keys.values()))
+
+    attrs_by_uri = {}
+    array_keys = {}
+    for uri, root_key in root_keys.items():
+        if root_key not in root_docs:
+            continue
+        zarr_format = 3 if root_key.endswith("zarr.json") else 2
+        attrs = root_docs[root_key]
+        try:
+            if zarr_format == 3:
+                attrs = ngff_attrs_from_zarr_v3(attrs.get("attributes", {}))
+            path = ZMeta.parse_obj(attrs).axis_index.paths[0]
+        except (KeyError, IndexError, ValueError):
+            continue
+        array_fname = "zarr.json" if zarr_format == 3 else ".zarray"
+        array_key = f"{store_keys[uri]}/{path}/{array_fname}"
+        if array_key in listed_keys:
+            attrs_by_uri[uri] = (zarr_format, attrs, path)
+            array_keys[uri] = array_key
+    array_docs = _fetch_all(bucket, list(array_keys.values()))
+
+    metadata_by_uri = {}
+    for uri, (zarr_format, attrs, path) in attrs_by_uri.items():
+        array_doc = array_docs.get(array_keys[uri])
+        if array_doc is None:
+            continue
+        try:
+            if zarr_format == 3:
+                geometry = zarr_v3_array_geometry(array_doc)
+            else:
+                geometry = zarr_v2_array_geometry(array_doc)
+        except (KeyError, TypeError, ValueError):
+            continue
+        metadata_by_uri[uri] = {
+            "zarr_format": zarr_format,
+            "attrs": attrs,
+            "arrays": {path: geometry},
+        }
+
+    logger.info(
+        f"Bulk probed {len(metadata_by_uri)} of {len(uris)} images of "
+        f"{accession_id} with {len(root_docs) + len(array_docs)} requests "
+        "after listing"
+    )
+
+    return metadata_by_uri
@@ -0,0 +1,195 @@
+"""Portable bundles of the export caches, for warming the cache of another
+machine.
+
+A bundle is a gzipped tar stream holding an index.json, which maps the path
+of each cache entry (relative to settings.cache_root_dirpath) to the SHA-256,
+size and modification time of its content, followed by one objects/<sha256>
+member per distinct content. Bundles of the same cache are identical, and
+unpacking reads the stream once, in order, verifying each object against its
+hash. Entries the destination already has, with the same content or a newer
+modification time, are left alone."""
+
+import gzip
+import hashlib
+import logging
+import os
+import tarfile
+from io import BytesIO
+from pathlib import Path, PurePosixPath
+from typing import Dict, NamedTuple
+
+from pydantic import BaseModel
+
+from .outputs import atomic_output_path, hash_file
+from .serialization import CACHE_SUFFIXES
+
+logger = logging.getLogger(__name__)
+
+
+BUNDLE_VERSION = 1
+
+INDEX_NAME = "index.json"
+
+OBJECTS_DIRNAME = "objects"
+
+# Directories of settings.cache_root_dirpath which are bundled
+CACHE_DIRNAMES = ["images", "datasets", "failures", "study_timings"]
+
+
+class BundleEntry(BaseModel):
+    sha256: str
+    size: int
+    mtime: float
+
+
+class BundleIndex(BaseModel):
+    version: int = BUNDLE_VERSION
+    entries: Dict[str, BundleEntry] = {}
+
+
+class UnpackResult(NamedTuple):
+    n_written: int
+    n_skipped: int
+    n_missing: int
+
+
+def iter_cache_fpaths(cache_dirpath: Path):
+    for dirname in CACHE_DIRNAMES:
+        dirpath = cache_dirpath / dirname
+        if not dirpath.is_dir():
+            continue
+        for fpath in sorted(dirpath.iterdir()):
+            # Dot files are temporary files of writes in progress
+            if fpath.is_file() and not fpath.name.startswith("."):
+                yield fpath
+
+
+def _add_member(tar: tarfile.TarFile, name: str, data: bytes):
+    # Members carry no times or owners, so that bundles are reproducible
+    info = tarfile.TarInfo(name)
+    info.size = len(data)
+    tar.addfile(info, BytesIO(data))
+
+
+def pack_cache(cache_dirpath: Path, bundle_fpath: Path) -> BundleIndex:
+    """Write the caches in cache_dirpath to a bundle at bundle_fpath."""
+
+    index = BundleIndex()
+    fpaths_by_sha256 = {}
+    for fpath in iter_cache_fpaths(cache_dirpath):
+        mtime = fpath.stat().st_mtime
+        sha256, size = hash_file(fpath)
+        name = fpath.relative_to(cache_dirpath).as_posix()
+        index.entries[name] = BundleEntry(sha256=sha256, size=size, mtime=mtime)
+        fpaths_by_sha256.setdefault(sha256, fpath)
+
+    with atomic_output_path(bundle_fpath) as tmp_fpath:
+        with open(tmp_fpath, "wb") as fh, gzip.GzipFile(
+            fileobj=fh, mode="wb", mtime=0
+        ) as gz, tarfile.open(fileobj=gz, mode="w|") as tar:
+            _add_member(tar, INDEX_NAME, index.json(sort_keys=True).encode())
+
+            for sha256, fpath in sorted(fpaths_by_sha256.items()):
+                data = fpath.read_bytes()
+                if hashlib.sha256(data).hexdigest() != sha256:
+                    # Unpacking reports the entries left without content
+                    logger.warning(f"{fpath} changed while packing, leaving it out")
+                    continue
+                _add_member(tar, f"{OBJECTS_DIRNAME}/{sha256}", data)
+
+    return index
+
+
+def entry_fpath(cache_dirpath: Path, name: str) -> Path:
+    """The path of the bundle entry name, checking that it is a cache entry,
+    so that bundles cannot write elsewhere."""
+
+    parts = PurePosixPath(name).parts
+    if len(parts) != 2 or parts[0] not in CACHE_DIRNAMES or parts[1].startswith("."):
+        raise ValueError(f"Invalid cache bundle entry {name!r}")
+
+    return cache_dirpath / parts[0] / parts[1]
+
+
+def _entry_variants(fpath: Path) -> list[Path]:
+    """fpath, and the paths of the same cache entry in other formats."""
+
+    if fpath.suffix not in CACHE_SUFFIXES:
+        return [fpath]
+
+    return [fpath] + [
+        fpath.with_suffix(suffix) for suffix in CACHE_SUFFIXES if suffix != fpath.suffix
+    ]
+
+
+def is_current(fpath: Path, entry: BundleEntry) -> bool:
+    """Whether the cache already has entry, or a newer version of it (in any
+    format)."""
+
+    for variant in _entry_variants(fpath):
+        if variant.exists() and variant.stat().st_mtime >= entry.mtime:
+            return True
+
+    if fpath.exists() and fpath.stat().st_size == entry.size:
+        return hash_file(fpath)[0] == entry.sha256
+
+    return False
+
+
+def write_entry(fpath: Path, data: bytes, mtime: float):
+    """Write an entry atomically, keeping its modification time, and remove
+    older versions of it in other formats."""
+
+    fpath.parent.mkdir(exist_ok=True, parents=True)
+    tmp_fpath = fpath.with_name(f".{fpath.name}.{os.getpid()}.tmp")
+    tmp_fpath.write_bytes(data)
+    os.utime(tmp_fpath, (mtime, mtime))
+    os.replace(tmp_fpath, fpath)
+
+    for variant in _entry_variants(fpath)[1:]:
+        variant.unlink(missing_ok=True)
+
+
+def unpack_cache(bundle_fpath: Path, cache_dirpath: Path) -> UnpackResult:
+    """Add the entries of the bundle at bundle_fpath to the caches in
+    cache_dirpath, skipping those which are already present or newer."""
+
+    n_written = n_skipped = 0
+    wanted = {}
+    try:
+        with tarfile.open(bundle_fpath, mode="r|gz") as tar:
+            member = tar.next()
+            if member is None or member.name != INDEX_NAME:
+                raise ValueError(f"{bundle_fpath} is not a cache bundle")
+            index = BundleIndex.parse_raw(tar.extractfile(member).read())
+            if index.version != BUNDLE_VERSION:
+                raise ValueError(
+                    f"{bundle_fpath} is a version {index.version} cache bundle, "
+                    f"expected version {BUNDLE_VERSION}"
+                )
+
+            for name, entry in index.entries.items():
+                fpath = entry_fpath(cache_dirpath, name)
+                if is_current(fpath, entry):
+                    n_skipped += 1
+                else:
+                    wanted.setdefault(entry.sha256, []).append((fpath, entry))
+
+            for member in tar:
+                sha256 = PurePosixPath(member.name).name
+                if sha256 not in wanted:
+                    continue
+                data = tar.extractfile(member).read()
+                if hashlib.sha256(data).hexdigest() != sha256:
+                    raise ValueError(f"{bundle_fpath} is corrupt: {member.name}")
+                for fpath, entry in wanted.pop(sha256):
+                    write_entry(fpath, data, entry.mtime)
+                    n_written += 1
+    except (tarfile.TarError, gzip.BadGzipFile, EOFError) as e:
+        raise ValueError(f"{bundle_fpath} is not a readable cache bundle: {e}")
+
+    n_missing = sum(len(entries) for entries in wanted.values())
+    if n_missing:
+        logger.warning(f"{n_missing} entries of {bundle_fpath} have no content")
+
+    return UnpackResult(n_written, n_skipped, n_missing)
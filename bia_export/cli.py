@@ -1,11 +1,18 @@
 from pathlib import Path
+from contextlib import ExitStack
+from functools import partial
+import json
+import os
+from typing import Callable, Iterable, List, Type
 import logging
 
 import rich
+import rich.table
 import typer
 from rich.logging import RichHandler
 
 from bia_integrator_api import models as api_models
+from pydantic import BaseModel
 
 from .data_mapping_utils import (
     transform_ai_study_dict,
@@ -13,12 +20,55 @@ from .data_mapping_utils import (
     transform_study_dict,
     create_export_image,
     get_ann_uuid_by_sourcename,
+    get_ome_zarr_uri,
+)
+from .intensity_stats import compute_channel_statistics_for_uris
+from .projection import ALL_SOURCES, parse_image_fields, required_sources
+from .proxyimage import primed_ome_zarr_metadata, probe_single_flight
+from .bulkprobe import default_bucket, probe_study
+from .failure_cache import (
+    clear_failure,
+    get_failure,
+    is_quarantined,
+    iter_failures,
+    record_failure,
+)
+from .aggregates import aggregate_images_by_dataset
+from .search_index import SearchIndexBuilder
+from .columnar import ParquetExportWriter
+from .outputs import atomic_output, write_manifest
+from .serialization import (
+    cache_entry_exists,
+    cache_stats,
+    read_cache_entry,
+    write_cache_entry,
+)
+from .sampling import parse_stratum, sample_images
+from .sharding import merge_shards, parse_shard
+from .verification import diff_exports, verify_export
+from .linkcheck import check_export_links
+from .bulkindex import BulkIndexWriter, write_bulk_index
+from .cachebundle import pack_cache, unpack_cache
+from .engine import ExportEngine
+from .concurrency import (
+    api_limiter,
+    is_transient,
+    limited_call_executor,
+    retry_transient,
+    zarr_limiter,
+)
+from .snapshot import take_snapshot, use_snapshot
+from .profiling import start_profiling, stop_profiling
+from .discovery import (
+    AI_DATASET_ATTRIBUTES,
+    SPATIAL_OMICS_ATTRIBUTES,
+    discover_accession_ids,
 )
 
 from .bia_client_utils import (
     rw_client,
     get_study_uuid_by_accession_id,
-    get_images_with_a_rep_type,
+    get_study_ome_ngff_images,
     get_file_references_by_study_uuid,
     get_annotation_file_uuids_by_study_uuid,
     get_annotation_files_by_study_uuid,
@@ -35,6 +85,7 @@ from .models import (
     Link,
     ExportSODataset,
     SOExports,
+    ExportShard,
 )
 
 
@@ -44,81 +95,140 @@ logging.basicConfig(
 logger = logging.getLogger()
 
 app = typer.Typer()
+cache_app = typer.Typer(help="Share the export caches between machines")
+app.add_typer(cache_app, name="cache")
+
+
+@app.callback()
+def main(
+    ctx: typer.Context,
+    snapshot: Path = typer.Option(
+        None,
+        help="Read upstream data from this snapshot, written by the snapshot "
+        "command, instead of the API and S3",
+    ),
+    profile: Path = typer.Option(
+        None,
+        help="Profile CPU use per study, writing collapsed stacks to this directory",
+    ),
+    profile_memory: bool = typer.Option(
+        False,
+        help="With --profile, also trace allocations and write an allocation "
+        "report, which slows the export",
+    ),
+):
+    if snapshot:
+        use_snapshot(snapshot)
+
+    if profile:
+        start_profiling(memory=profile_memory)
+        ctx.call_on_close(partial(stop_profiling, profile))
+
+
+def image_cache_dirpath() -> Path:
+    return settings.cache_root_dirpath / "images"
+
+
+def dataset_cache_dirpath() -> Path:
+    return settings.cache_root_dirpath / "datasets"
 
 
 def bia_image_to_export_image(
-    image: api_models.BIAImage, study: api_models.BIAStudy, use_cache=True
+    image: api_models.BIAImage,
+    study: api_models.BIAStudy,
+    use_cache=True,
+    sources: frozenset[str] = ALL_SOURCES,
 ) -> ExportImage:
+    """Export an image, fetching only the upstream sources given (see
+    projection). Images missing any source are not cached, but cached
+    images, which have them all, are used for any sources."""
 
-    output_dirpath = settings.cache_root_dirpath / "images"
-    output_dirpath.mkdir(exist_ok=True, parents=True)
-    output_fpath = output_dirpath / f"{image.uuid}.json"
-
-    if use_cache and output_fpath.exists():
-        return ExportImage.parse_file(output_fpath)
+    if use_cache:
+        cached_image = read_cache_entry(image_cache_dirpath(), image.uuid, ExportImage)
+        if cached_image:
+            return cached_image
 
     image_acquisitions = []
     specimens = []
     biosamples = []
 
     # image->image_acquisition is 1->many, though usually only 1 acquisition per image
-    image_acquisitions.extend(
-        [
-            rw_client.get_image_acquisition(image_acquisition_uuid)
-            for image_acquisition_uuid in image.image_acquisitions_uuid
-        ]
-    )
+    if "image_acquisitions" in sources:
+        image_acquisitions.extend(
+            [
+                rw_client.get_image_acquisition(image_acquisition_uuid)
+                for image_acquisition_uuid in image.image_acquisitions_uuid
+            ]
+        )
 
     # image->specimen should be 1->1, but have to assume 1->many because of 1->many image->image_acquisition link
-    for image_acquisition in image_acquisitions:
-        specimens.append(rw_client.get_specimen(image_acquisition.specimen_uuid))
+    if "specimens" in sources:
+        for image_acquisition in image_acquisitions:
+            specimens.append(rw_client.get_specimen(image_acquisition.specimen_uuid))
 
-    for specimen in specimens:
-        biosamples.append(rw_client.get_biosample(specimen.biosample_uuid))
+    if "biosamples" in sources:
+        for specimen in specimens:
+            biosamples.append(rw_client.get_biosample(specimen.biosample_uuid))
 
     converted_image = create_export_image(
-        image, study, image_acquisitions, specimens, biosamples
+        image, study, image_acquisitions, specimens, biosamples, sources=sources
     )
 
-    with open(output_fpath, "w") as fh:
-        fh.write(converted_image.json(indent=2))
+    if sources == ALL_SOURCES:
+        write_cache_entry(image_cache_dirpath(), image.uuid, converted_image)
 
     return converted_image
 
 
 def fileref_to_export_annotations(fileref: api_models.FileReference, use_cache=True):
 
-    output_dirpath = settings.cache_root_dirpath / "images"
-    output_dirpath.mkdir(exist_ok=True, parents=True)
-    output_fpath = output_dirpath / f"{fileref.uuid}.json"
-
-    if use_cache and output_fpath.exists():
-        return ExportImage.parse_file(output_fpath)
+    if use_cache:
+        cached_ann = read_cache_entry(image_cache_dirpath(), fileref.uuid, ExportImage)
+        if cached_ann:
+            return cached_ann
 
     # FIXME - Write the proper export_ann
     export_ann = None
 
     if export_ann:
-        with open(output_fpath, "w") as fh:
-            fh.write(export_ann.json(indent=2))
+        write_cache_entry(image_cache_dirpath(), fileref.uuid, export_ann)
 
     return export_ann
 
 
-# FIXME - we get images twice...
-def study_uuid_to_export_dataset(study_uuid) -> ExportDataset:
+def sample_study_image_uuids(images: list[api_models.BIAImage], n: int) -> list[str]:
+    """UUIDs of a representative sample of n of a study's OME-NGFF images,
+    from the listing of them which is exported. Quarantined images, which are
+    not exported, are left out."""
+
+    sample = sample_images(
+        [image for image in images if not is_quarantined(image)],
+        n,
+        seed=settings.dataset_sample_seed,
+        stratum=parse_stratum(settings.dataset_sample_stratify_by),
+    )
+
+    return [image.uuid for image in sample]
 
-    output_dirpath = settings.cache_root_dirpath / "datasets"
-    output_dirpath.mkdir(exist_ok=True, parents=True)
-    output_fpath = output_dirpath / f"{study_uuid}.json"
-    if output_fpath.exists():
-        return ExportDataset.parse_file(output_fpath)
 
-    bia_study = rw_client.get_study(study_uuid, apply_annotations=True)
+def study_uuid_to_export_dataset(
+    study_uuid: str,
+    study: api_models.BIAStudy | None = None,
+    images: list[api_models.BIAImage] | None = None,
+) -> ExportDataset:
+
+    cached_dataset = read_cache_entry(dataset_cache_dirpath(), study_uuid, ExportDataset)
+    if cached_dataset:
+        return cached_dataset
+
+    bia_study = study or rw_client.get_study(study_uuid, apply_annotations=True)
+    if images is None:
+        images = get_study_ome_ngff_images(study_uuid)
 
-    images = get_images_with_a_rep_type(study_uuid, "ome_ngff")
     transform_dict = transform_study_dict(bia_study)
-    transform_dict["image_uuids"] = [image.uuid for image in images]
+    transform_dict["image_uuids"] = sample_study_image_uuids(
+        images, settings.dataset_sample_images_count
+    )
     transform_dict["links"] = [
         Link(
             name="original_submission",
@@ -127,27 +237,31 @@ def study_uuid_to_export_dataset(study_uuid) -> ExportDataset:
         )
     ]
 
-    with open(output_fpath, "w") as fh:
-        fh.write(ExportDataset(**transform_dict).json(indent=2))
-        logger.info(f"Saved to {output_fpath}")
+    export_dataset = ExportDataset(**transform_dict)
+    output_fpath = write_cache_entry(dataset_cache_dirpath(), study_uuid, export_dataset)
+    logger.info(f"Saved to {output_fpath}")
 
-    return ExportDataset(**transform_dict)
+    return export_dataset
 
 
-# FIXME - we get images twice...
-def study_uuid_to_export_sodataset(study_uuid: str) -> ExportSODataset:
+def study_uuid_to_export_sodataset(
+    study_uuid: str,
+    study: api_models.BIAStudy | None = None,
+    images: list[api_models.BIAImage] | None = None,
+) -> ExportSODataset:
 
-    output_dirpath = settings.cache_root_dirpath / "datasets"
-    output_dirpath.mkdir(exist_ok=True, parents=True)
-    output_fpath = output_dirpath / f"{study_uuid}.json"
-    if output_fpath.exists():
-        return ExportSODataset.parse_file(output_fpath)
+    cached_dataset = read_cache_entry(dataset_cache_dirpath(), study_uuid, ExportSODataset)
+    if cached_dataset:
+        return cached_dataset
 
-    bia_study = rw_client.get_study(study_uuid, apply_annotations=True)
+    bia_study = study or rw_client.get_study(study_uuid, apply_annotations=True)
+    if images is None:
+        images = get_study_ome_ngff_images(study_uuid)
 
-    images = get_images_with_a_rep_type(study_uuid, "ome_ngff")
     transform_dict = transform_so_study_dict(bia_study)
-    transform_dict["image_uuids"] = [image.uuid for image in images]
+    transform_dict["image_uuids"] = sample_study_image_uuids(
+        images, settings.dataset_sample_images_count
+    )
     transform_dict["links"] = [
         Link(
             name="original_submission",
@@ -156,31 +270,36 @@ def study_uuid_to_export_sodataset(study_uuid: str) -> ExportSODataset:
         )
     ]
 
-    with open(output_fpath, "w") as fh:
-        fh.write(ExportSODataset(**transform_dict).json(indent=2))
+    export_dataset = ExportSODataset(**transform_dict)
+    write_cache_entry(dataset_cache_dirpath(), study_uuid, export_dataset)
 
-    return ExportSODataset(**transform_dict)
+    return export_dataset
 
 
 # FIXME - we get images twice...
-def study_uuid_to_export_ai_dataset(study_uuid: str) -> ExportAIDataset:
+def study_uuid_to_export_ai_dataset(
+    study_uuid: str,
+    study: api_models.BIAStudy | None = None,
+    images: list[api_models.BIAImage] | None = None,
+) -> ExportAIDataset:
 
-    output_dirpath = settings.cache_root_dirpath / "datasets"
-    output_dirpath.mkdir(exist_ok=True, parents=True)
-    output_fpath = output_dirpath / f"{study_uuid}.json"
-    if output_fpath.exists():
-        return ExportDataset.parse_file(output_fpath)
+    cached_dataset = read_cache_entry(dataset_cache_dirpath(), study_uuid, ExportAIDataset)
+    if cached_dataset:
+        return cached_dataset
 
-    bia_study = rw_client.get_study(study_uuid, apply_annotations=True)
+    bia_study = study or rw_client.get_study(study_uuid, apply_annotations=True)
+    if images is None:
+        images = get_study_ome_ngff_images(study_uuid)
 
-    # Get OME-NGFF images only
-    images = get_images_with_a_rep_type(study_uuid, "ome_ngff",limit=10)
     # Get all images
     n_images = bia_study.images_count
     study_images = get_images_by_study_uuid(study_uuid, limit=n_images)
 
     transform_dict = transform_ai_study_dict(bia_study)
-    transform_dict["image_uuids"] = [image.uuid for image in images]
+    # Sample of OME-NGFF images only
+    transform_dict["image_uuids"] = sample_study_image_uuids(
+        images, settings.ai_dataset_sample_images_count
+    )
     transform_dict["links"] = [
         Link(
             name="original_submission",
@@ -226,17 +345,139 @@ def study_uuid_to_export_ai_dataset(study_uuid: str) -> ExportAIDataset:
 
 
 
-    with open(output_fpath, "w") as fh:
-        fh.write(ExportAIDataset(**transform_dict).json(indent=2))
+    export_dataset = ExportAIDataset(**transform_dict)
+    write_cache_entry(dataset_cache_dirpath(), study_uuid, export_dataset)
 
-    return ExportAIDataset(**transform_dict)
+    return export_dataset
 
 
-def study_uuid_to_export_images(study_uuid: str) -> dict[str, ExportImage]:
-    study = rw_client.get_study(study_uuid)
-    images = get_images_with_a_rep_type(study_uuid, "ome_ngff", limit=500)
+def add_channel_statistics(
+    export_images: dict[str, ExportImage], images: list[api_models.BIAImage]
+):
+    """Compute channel statistics for those export images which do not yet have
+    them, in parallel, and update the image cache with the results."""
+
+    uris_by_uuid = {
+        image.uuid: get_ome_zarr_uri(image)
+        for image in images
+        if image.uuid in export_images
+        and export_images[image.uuid].channel_statistics is None
+    }
+
+    statistics_by_uuid = compute_channel_statistics_for_uris(uris_by_uuid)
+
+    for uuid, channel_statistics in statistics_by_uuid.items():
+        export_images[uuid].channel_statistics = channel_statistics
+        write_cache_entry(image_cache_dirpath(), uuid, export_images[uuid])
+
+
+def study_uuid_to_export_images(
+    study_uuid: str,
+    channel_stats=False,
+    image_filter: Callable[[str], bool] | None = None,
+    study: api_models.BIAStudy | None = None,
+    image_fields: frozenset[str] | None = None,
+    images: list[api_models.BIAImage] | None = None,
+) -> dict[str, ExportImage]:
+    """Export the images of a study, optionally only those passing
+    image_filter, and only as far as needed for image_fields if given. images
+    is the study's image listing, if already fetched."""
+
+    study = study or rw_client.get_study(study_uuid)
+    if images is None:
+        images = get_study_ome_ngff_images(study_uuid)
+    if image_filter:
+        images = [image for image in images if image_filter(image.uuid)]
+
+    sources = required_sources(image_fields)
+    primed = {}
+    if settings.bulk_probe and "ome_zarr" in sources:
+        uris = [
+            get_ome_zarr_uri(image)
+            for image in images
+            if not cache_entry_exists(image_cache_dirpath(), image.uuid)
+        ]
+        primed = probe_study(default_bucket(), study.accession_id, uris)
+
+    def export_image(image: api_models.BIAImage) -> ExportImage | None:
+        try:
+            return retry_transient(
+                bia_image_to_export_image, image, study, sources=sources
+            )
+        except Exception as e:
+            # Images are only quarantined for errors which would recur, a
+            # service which stays unavailable fails the export instead
+            if is_transient(e):
+                raise
+            failure = record_failure(image, study, e)
+            logger.warning(
+                f"Quarantined image {image.uuid} from {study.accession_id}: "
+                f"{failure.error_class}: {failure.message}"
+            )
+            return None
+
+    unquarantined_images = [image for image in images if not is_quarantined(image)]
+    n_quarantined = len(images) - len(unquarantined_images)
+
+    # Images are exported concurrently, as far as the adaptive limits allow
+    export_images = {}
+    with primed_ome_zarr_metadata(primed):
+        for image, export_image in zip(
+            unquarantined_images,
+            limited_call_executor().map(export_image, unquarantined_images),
+        ):
+            if export_image is not None:
+                export_images[image.uuid] = export_image
+
+    if n_quarantined:
+        logger.info(
+            f"Skipped {n_quarantined} quarantined images from {study.accession_id}"
+        )
+
+    if channel_stats:
+        add_channel_statistics(export_images, images)
+
+    return export_images
+
+
+def drop_failed_image_uuids(
+    export_datasets: dict, export_images: dict[str, ExportImage]
+):
+    """Remove images which failed to export from the samples of datasets.
+    Datasets are built alongside their images, and may be cached, so their
+    samples can include images which have failed since."""
+
+    for export_dataset in export_datasets.values():
+        export_dataset.image_uuids = [
+            uuid
+            for uuid in export_dataset.image_uuids
+            if uuid in export_images or get_failure(uuid) is None
+        ]
 
-    return {image.uuid: bia_image_to_export_image(image, study) for image in images}
+
+def add_image_aggregates(
+    export_datasets: dict, export_images: dict[str, ExportImage]
+):
+    """Attach aggregates over the exported images of each dataset, computed in a
+    single pass over export_images."""
+
+    aggregates_by_accession_id = aggregate_images_by_dataset(export_images.values())
+
+    for accession_id, export_dataset in export_datasets.items():
+        export_dataset.image_aggregates = aggregates_by_accession_id.get(accession_id)
+
+
+def write_search_index(
+    dirpath: Path, export_datasets: dict, export_images: dict[str, ExportImage]
+):
+    index_builder = SearchIndexBuilder()
+    for accession_id, export_dataset in export_datasets.items():
+        index_builder.add_dataset(accession_id, export_dataset)
+    for export_image in export_images.values():
+        index_builder.add_image(export_image)
+
+    index_builder.write(dirpath)
+    logger.info(f"Wrote search index to {dirpath}")
 
 
 @app.command()
@@ -276,8 +517,213 @@ def show_image_export(accession_id: str, image_uuid: str):
     rich.print(export_image)
 
 
+def shard_callback(value: str | None) -> ExportShard | None:
+    if value is None:
+        return None
+    try:
+        return parse_shard(value)
+    except ValueError as e:
+        raise typer.BadParameter(str(e))
+
+
+# Options shared by all export commands
+ChannelStatsOption = typer.Option(
+    False, help="Compute per-channel intensity statistics for each image"
+)
+SearchIndexOption = typer.Option(
+    None, help="Also write search index files to this directory"
+)
+ParquetOption = typer.Option(
+    None, help="Also write images and datasets as Parquet to this directory"
+)
+ShardOption = typer.Option(
+    None,
+    callback=shard_callback,
+    help="Export only shard i/N of the studies, e.g. 0/4",
+)
+DiscoverOption = typer.Option(
+    False,
+    help="Export every matching study in the archive instead of the default list",
+)
+WorkersOption = typer.Option(None, help="Number of studies to export concurrently")
+
+
+def image_fields_callback(value: str | None) -> frozenset[str] | None:
+    if value is None:
+        return None
+    try:
+        return parse_image_fields(value)
+    except ValueError as e:
+        raise typer.BadParameter(str(e))
+
+
+ImageFieldsOption = typer.Option(
+    None,
+    callback=image_fields_callback,
+    help="Export only these image fields, comma separated, or a profile "
+    "(light, listing), skipping the upstream reads of the others",
+)
+
+
+def unset_entry_fields(
+    entries: dict[str, BaseModel], names: list[str]
+) -> dict[str, set[str]]:
+    """The named fields which are unset (None), of each entry with any, in
+    the form pydantic takes to exclude them."""
+
+    unset_fields = {}
+    for key, entry in entries.items():
+        unset = {name for name in names if getattr(entry, name) is None}
+        if unset:
+            unset_fields[key] = unset
+
+    return unset_fields
+
+
+def export_studies(
+    accession_ids: Iterable[str],
+    exports_cls: Type[Exports | AIExports | SOExports],
+    output_filename: Path,
+    dataset_builder: Callable[..., BaseModel] | None = None,
+    channel_stats: bool = False,
+    search_index_dirpath: Path | None = None,
+    parquet_dirpath: Path | None = None,
+    shard: ExportShard | None = None,
+    workers: int | None = None,
+    image_fields: frozenset[str] | None = None,
+):
+    """Export the datasets (if dataset_builder is given) and images of the
+    given studies, writing them to output_filename and any optional outputs.
+
+    accession_ids may be a lazy iterator, in which case studies are exported
+    as they are produced. If shard is given, only that shard's part of the
+    export is produced. If image_fields is given, images have only those
+    fields."""
+
+    if image_fields and (channel_stats or search_index_dirpath or parquet_dirpath):
+        raise typer.BadParameter(
+            "--image-fields exports cannot have channel statistics, search "
+            "indexes or Parquet outputs, which need every image field"
+        )
+    if shard and (search_index_dirpath or parquet_dirpath):
+        raise typer.BadParameter(
+            "--shard exports cannot have search indexes or Parquet outputs, "
+            "which merge does not combine; write them from an unsharded run"
+        )
+
+    engine = ExportEngine(
+        partial(
+            study_uuid_to_export_images,
+            channel_stats=channel_stats,
+            image_fields=image_fields,
+        ),
+        dataset_builder=dataset_builder,
+        shard=shard,
+        workers=workers,
+        # Projected exports are quicker, so would skew later schedules
+        record_timings=not image_fields,
+        image_is_cached=lambda uuid: cache_entry_exists(image_cache_dirpath(), uuid),
+    )
+
+    export_datasets = {}
+    export_images = {}
+    with ExitStack() as stack:
+        # Images are written to Parquet study by study, and the file is only
+        # replaced once every study has been written
+        image_writer = None
+        if parquet_dirpath:
+            image_writer = stack.enter_context(
+                ParquetExportWriter(parquet_dirpath / "images.parquet", ExportImage)
+            )
+        for study_export in engine.run(accession_ids):
+            if study_export.dataset:
+                export_datasets[study_export.accession_id] = study_export.dataset
+            export_images.update(study_export.images)
+            if image_writer:
+                image_writer.add_all(
+                    export_image
+                    for _, export_image in sorted(study_export.images.items())
+                )
+
+    logger.info(
+        f"Coalesced {rw_client.single_flight.n_coalesced} duplicate API calls "
+        f"and {probe_single_flight.n_coalesced} duplicate OME-Zarr probes"
+    )
+    for limiter in (api_limiter, zarr_limiter):
+        logger.info(
+            f"{limiter.name}: {limiter.n_calls} calls, {limiter.n_errors} "
+            f"congestion errors, final concurrency limit {int(limiter.limit)}"
+        )
+    for line in cache_stats.summary():
+        logger.info(line)
+
+    drop_failed_image_uuids(export_datasets, export_images)
+
+    # Aggregates are over image sizes, which are only known if probed
+    if "ome_zarr" in required_sources(image_fields):
+        add_image_aggregates(export_datasets, export_images)
+
+    # Keys are written sorted so that shards can be stream-merged
+    exports = exports_cls(
+        datasets=dict(sorted(export_datasets.items())),
+        images=dict(sorted(export_images.items())),
+        shard=shard,
+        image_fields=sorted(image_fields) if image_fields else None,
+    )
+
+    # Optional values are only written when set, so that exports without
+    # them are unchanged
+    exclude = {
+        name: ... for name in ("shard", "image_fields") if not getattr(exports, name)
+    }
+    unset_image_fields = unset_entry_fields(export_images, ["channel_statistics"])
+    if unset_image_fields:
+        exclude["images"] = unset_image_fields
+    unset_dataset_fields = unset_entry_fields(export_datasets, ["image_aggregates"])
+    if unset_dataset_fields:
+        exclude["datasets"] = unset_dataset_fields
+    include = None
+    if image_fields:
+        include = {name: ... for name in exports_cls.__fields__}
+        # pydantic has no "__all__" for dict items, so each image is named
+        include["images"] = {uuid: set(image_fields) for uuid in export_images}
+
+    with atomic_output(output_filename) as fh:
+        fh.write(
+            exports.json(
+                indent=2,
+                sort_keys=True,
+                include=include,
+                exclude=exclude,
+            )
+        )
+
+    if search_index_dirpath:
+        write_search_index(search_index_dirpath, exports.datasets, exports.images)
+
+    if parquet_dirpath:
+        dataset_model = exports_cls.__fields__["datasets"].type_
+        with ParquetExportWriter(
+            parquet_dirpath / "datasets.parquet", dataset_model, key_column="key"
+        ) as dataset_writer:
+            for accession_id, export_dataset in exports.datasets.items():
+                dataset_writer.add(export_dataset, key=accession_id)
+
+    shard_spec = f"{shard.index}/{shard.count}" if shard else None
+    write_manifest(output_filename.parent, shard=shard_spec)
+
+
 @app.command()
-def export_all_images(output_filename: Path = Path("bia-images-export.json")):
+def export_all_images(
+    output_filename: Path = Path("bia-images-export.json"),
+    channel_stats: bool = ChannelStatsOption,
+    search_index_dirpath: Path = SearchIndexOption,
+    parquet_dirpath: Path = ParquetOption,
+    shard: str = ShardOption,
+    discover: bool = DiscoverOption,
+    workers: int = WorkersOption,
+    image_fields: str = ImageFieldsOption,
+):
 
     accession_ids = [
         "S-BSST223",
@@ -328,25 +774,33 @@ def export_all_images(output_filename: Path = Path("bia-images-export.json")):
         "S-BIAD493",
     ]
 
-    study_accession_ids_to_export = accession_ids
-    study_uuids_by_accession_id = {
-        accession_id: get_study_uuid_by_accession_id(accession_id)
-        for accession_id in study_accession_ids_to_export
-    }
-
-    export_images = {}
-    for study_uuid in study_uuids_by_accession_id.values():
-        new_export_images = study_uuid_to_export_images(study_uuid)
-        export_images.update(new_export_images)
-
-    exports = Exports(images=export_images)
-
-    with open(output_filename, "w") as fh:
-        fh.write(exports.json(indent=2))
+    if discover:
+        accession_ids = discover_accession_ids()
+
+    export_studies(
+        accession_ids,
+        Exports,
+        output_filename,
+        channel_stats=channel_stats,
+        search_index_dirpath=search_index_dirpath,
+        parquet_dirpath=parquet_dirpath,
+        shard=shard,
+        workers=workers,
+        image_fields=image_fields,
+    )
 
 
 @app.command()
-def export_defaults(output_filename: Path = Path("bia-export.json")):
+def export_defaults(
+    output_filename: Path = Path("bia-export.json"),
+    channel_stats: bool = ChannelStatsOption,
+    search_index_dirpath: Path = SearchIndexOption,
+    parquet_dirpath: Path = ParquetOption,
+    shard: str = ShardOption,
+    discover: bool = DiscoverOption,
+    workers: int = WorkersOption,
+    image_fields: str = ImageFieldsOption,
+):
 
     accession_ids = [
         "S-BSST223",
@@ -385,31 +839,34 @@ def export_defaults(output_filename: Path = Path("bia-export.json")):
         "S-BIAD1008",
     ]
 
-    study_accession_ids_to_export = accession_ids
-
-    study_uuids_by_accession_id = {
-        accession_id: get_study_uuid_by_accession_id(accession_id)
-        for accession_id in study_accession_ids_to_export
-    }
-
-    export_datasets = {
-        accession_id: study_uuid_to_export_dataset(uuid)
-        for accession_id, uuid in study_uuids_by_accession_id.items()
-    }
-
-    export_images = {}
-    for study_uuid in study_uuids_by_accession_id.values():
-        new_export_images = study_uuid_to_export_images(study_uuid)
-        export_images.update(new_export_images)
-
-    exports = Exports(datasets=export_datasets, images=export_images)
-
-    with open(output_filename, "w") as fh:
-        fh.write(exports.json(indent=2))
+    if discover:
+        accession_ids = discover_accession_ids()
+
+    export_studies(
+        accession_ids,
+        Exports,
+        output_filename,
+        dataset_builder=study_uuid_to_export_dataset,
+        channel_stats=channel_stats,
+        search_index_dirpath=search_index_dirpath,
+        parquet_dirpath=parquet_dirpath,
+        shard=shard,
+        workers=workers,
+        image_fields=image_fields,
+    )
 
 
 @app.command()
-def ai_datasets(output_filename: Path = Path("bia-ai-export.json")):
+def ai_datasets(
+    output_filename: Path = Path("bia-ai-export.json"),
+    channel_stats: bool = ChannelStatsOption,
+    search_index_dirpath: Path = SearchIndexOption,
+    parquet_dirpath: Path = ParquetOption,
+    shard: str = ShardOption,
+    discover: bool = DiscoverOption,
+    workers: int = WorkersOption,
+    image_fields: str = ImageFieldsOption,
+):
 
     accession_ids = [
         "S-BIAD531",
@@ -420,57 +877,347 @@ def ai_datasets(output_filename: Path = Path("bia-ai-export.json")):
         "S-BIAD493",
     ]
 
-    study_accession_ids_to_export = accession_ids
+    if discover:
+        accession_ids = discover_accession_ids(any_of_attributes=AI_DATASET_ATTRIBUTES)
+
+    export_studies(
+        accession_ids,
+        AIExports,
+        output_filename,
+        dataset_builder=study_uuid_to_export_ai_dataset,
+        channel_stats=channel_stats,
+        search_index_dirpath=search_index_dirpath,
+        parquet_dirpath=parquet_dirpath,
+        shard=shard,
+        workers=workers,
+        image_fields=image_fields,
+    )
 
-    study_uuids_by_accession_id = {
-        accession_id: get_study_uuid_by_accession_id(accession_id)
-        for accession_id in study_accession_ids_to_export
-    }
 
-    export_datasets = {
-        accession_id: study_uuid_to_export_ai_dataset(uuid)
-        for accession_id, uuid in study_uuids_by_accession_id.items()
-    }
+@app.command()
+def spatial_omics_datasets(
+    output_filename: Path = Path("bia-spatialomics-export.json"),
+    channel_stats: bool = ChannelStatsOption,
+    search_index_dirpath: Path = SearchIndexOption,
+    parquet_dirpath: Path = ParquetOption,
+    shard: str = ShardOption,
+    discover: bool = DiscoverOption,
+    workers: int = WorkersOption,
+    image_fields: str = ImageFieldsOption,
+):
 
-    export_images = {}
-    for study_uuid in study_uuids_by_accession_id.values():
-        new_export_images = study_uuid_to_export_images(study_uuid)
-        export_images.update(new_export_images)
+    accession_ids = ["S-BIAD570", "S-BIAD1009"]
 
-    exports = AIExports(datasets=export_datasets, images=export_images)
+    if discover:
+        accession_ids = discover_accession_ids(any_of_attributes=SPATIAL_OMICS_ATTRIBUTES)
+
+    export_studies(
+        accession_ids,
+        SOExports,
+        output_filename,
+        dataset_builder=study_uuid_to_export_sodataset,
+        channel_stats=channel_stats,
+        search_index_dirpath=search_index_dirpath,
+        parquet_dirpath=parquet_dirpath,
+        shard=shard,
+        workers=workers,
+        image_fields=image_fields,
+    )
 
-    with open(output_filename, "w") as fh:
-        fh.write(exports.json(indent=2))
+
+@app.command()
+def discover(
+    ai: bool = typer.Option(False, help="Only studies marked as AI datasets"),
+    spatial_omics: bool = typer.Option(
+        False, help="Only studies marked as spatial omics datasets"
+    ),
+):
+    """List the accession IDs of every study with OME-NGFF images."""
+
+    any_of_attributes = []
+    if ai:
+        any_of_attributes += AI_DATASET_ATTRIBUTES
+    if spatial_omics:
+        any_of_attributes += SPATIAL_OMICS_ATTRIBUTES
+
+    for accession_id in discover_accession_ids(any_of_attributes=any_of_attributes):
+        typer.echo(accession_id)
 
 
 @app.command()
-def spatial_omics_datasets(
-    output_filename: Path = Path("bia-spatialomics-export.json"),
+def merge(
+    output_filename: Path = typer.Argument(..., help="Merged export to write"),
+    shard_filenames: List[Path] = typer.Argument(
+        ..., help="Partial exports written with --shard"
+    ),
 ):
+    """Stream-merge partial exports from sharded runs into a single export."""
 
-    accession_ids = ["S-BIAD570", "S-BIAD1009"]
+    problems = merge_shards(shard_filenames, output_filename)
+    write_manifest(output_filename.parent)
+    for problem in problems:
+        logger.error(problem)
 
-    study_accession_ids_to_export = accession_ids
+    logger.info(f"Merged {len(shard_filenames)} shards into {output_filename}")
+    if problems:
+        raise typer.Exit(code=1)
 
-    study_uuids_by_accession_id = {
-        accession_id: get_study_uuid_by_accession_id(accession_id)
-        for accession_id in study_accession_ids_to_export
-    }
 
-    export_datasets = {
-        accession_id: study_uuid_to_export_sodataset(uuid)
-        for accession_id, uuid in study_uuids_by_accession_id.items()
-    }
+@app.command()
+def verify(
+    export_filename: Path = typer.Argument(..., help="Export to verify"),
+    ai: bool = typer.Option(False, help="Verify as an AI datasets export"),
+    spatial_omics: bool = typer.Option(
+        False, help="Verify as a spatial omics datasets export"
+    ),
+):
+    """Validate every entry of an export against its model, and check that
+    the images referenced by datasets are present, streaming the file."""
 
-    export_images = {}
-    for study_uuid in study_uuids_by_accession_id.values():
-        new_export_images = study_uuid_to_export_images(study_uuid)
-        export_images.update(new_export_images)
+    exports_cls = AIExports if ai else SOExports if spatial_omics else Exports
+    problems = verify_export(export_filename, exports_cls)
+    for problem in problems:
+        logger.error(problem)
 
-    exports = SOExports(datasets=export_datasets, images=export_images)
+    logger.info(f"Verified {export_filename}: {len(problems)} problems")
+    if problems:
+        raise typer.Exit(code=1)
 
-    with open(output_filename, "w") as fh:
-        fh.write(exports.json(indent=2))
+
+@app.command()
+def diff(
+    old_filename: Path = typer.Argument(..., help="Earlier export"),
+    new_filename: Path = typer.Argument(..., help="Later export"),
+    output_filename: Path = typer.Option(
+        None, help="Also write the differences as JSON lines to this file"
+    ),
+):
+    """List the entries added (+), removed (-) and changed (~) between two
+    exports, streaming both files."""
+
+    symbols = {"added": "+", "removed": "-", "changed": "~"}
+    counts = {change: 0 for change in symbols}
+    with ExitStack() as stack:
+        fh = None
+        if output_filename:
+            fh = stack.enter_context(atomic_output(output_filename))
+
+        for difference in diff_exports(old_filename, new_filename):
+            counts[difference.change] += 1
+            symbol = symbols[difference.change]
+            line = f"{symbol} {difference.section} {difference.key}"
+            if difference.fields:
+                line += f" ({', '.join(difference.fields)})"
+            typer.echo(line)
+            if fh:
+                fh.write(json.dumps(difference._asdict()) + "\n")
+
+    logger.info(", ".join(f"{n} {change}" for change, n in counts.items()))
+    if any(counts.values()):
+        raise typer.Exit(code=1)
+
+
+@app.command()
+def check_links(
+    export_filename: Path = typer.Argument(..., help="Export to check"),
+    output_filename: Path = typer.Option(
+        Path("bia-link-report.json"), help="Report of missing link targets"
+    ),
+):
+    """Check that the thumbnails, images, viewer sources and other URIs
+    referenced by an export exist, and report those which do not."""
+
+    n_references, missing_targets = check_export_links(export_filename)
+
+    with atomic_output(output_filename) as fh:
+        json.dump([target.dict() for target in missing_targets], fh, indent=2)
+
+    n_broken = sum(len(target.references) for target in missing_targets)
+    logger.info(
+        f"{len(missing_targets)} missing targets, referenced by {n_broken} of "
+        f"{n_references} links. Wrote report to {output_filename}"
+    )
+    if missing_targets:
+        raise typer.Exit(code=1)
+
+
+@app.command()
+def bulk_index(
+    export_filename: Path = typer.Argument(..., help="Export to index"),
+    dirpath: Path = typer.Argument(..., help="Directory for the batch files"),
+    url: str = typer.Option(
+        None, help="Also post the batches to this bulk API URL, e.g. "
+        "http://localhost:9200/_bulk"
+    ),
+    batch_bytes: int = typer.Option(
+        settings.bulk_index_batch_bytes, help="Maximum size of each batch"
+    ),
+    batch_docs: int = typer.Option(
+        settings.bulk_index_batch_docs, help="Maximum documents in each batch"
+    ),
+    workers: int = typer.Option(
+        settings.bulk_index_workers, help="Number of batches to post concurrently"
+    ),
+):
+    """Write the datasets and images of an export as search engine bulk API
+    batches, streaming the export, and optionally post them."""
+
+    with BulkIndexWriter(
+        dirpath,
+        url=url,
+        workers=workers,
+        max_batch_bytes=batch_bytes,
+        max_batch_docs=batch_docs,
+    ) as writer:
+        write_bulk_index(export_filename, writer)
+    write_manifest(dirpath)
+
+    logger.info(
+        f"Wrote {writer.n_documents} documents in {len(writer.batch_fpaths)} "
+        f"batches to {dirpath}"
+    )
+    if url:
+        n_errors = sum(result.n_errors for result in writer.post_results)
+        n_posted = sum(result.n_documents for result in writer.post_results)
+        logger.info(
+            f"Posted {n_posted} documents to {url}, {n_errors} rejected or not posted"
+        )
+        if n_errors:
+            raise typer.Exit(code=1)
+
+
+@app.command()
+def quarantine_report(
+    output_filename: Path = typer.Option(
+        None, help="Also write the report as JSON to this file"
+    ),
+    clear: bool = typer.Option(
+        False, help="Forget all quarantined images, so the next run retries them"
+    ),
+):
+    """List images whose export failed and which are skipped by export runs
+    until they change upstream."""
+
+    failures = list(iter_failures())
+
+    table = rich.table.Table("UUID", "Study", "Error", "Version", "Failed at")
+    for failure in failures:
+        table.add_row(
+            failure.uuid,
+            failure.study_accession_id,
+            f"{failure.error_class}: {failure.message}",
+            str(failure.upstream_version),
+            failure.failed_at,
+        )
+    rich.print(table)
+
+    if output_filename:
+        with atomic_output(output_filename) as fh:
+            json.dump([failure.dict() for failure in failures], fh, indent=2)
+
+    if clear:
+        for failure in failures:
+            clear_failure(failure.uuid)
+        logger.info(f"Cleared {len(failures)} quarantined images")
+
+
+@cache_app.command("pack")
+def cache_pack(
+    bundle_filename: Path = typer.Argument(
+        Path("bia-export-cache.tar.gz"), help="Cache bundle to write"
+    ),
+):
+    """Bundle the image, dataset, failure and study timing caches into one
+    compressed archive, for cache unpack on another machine."""
+
+    index = pack_cache(settings.cache_root_dirpath, bundle_filename)
+    n_objects = len({entry.sha256 for entry in index.entries.values()})
+    logger.info(
+        f"Packed {len(index.entries)} cache entries ({n_objects} distinct) "
+        f"into {bundle_filename}"
+    )
+
+
+@cache_app.command("unpack")
+def cache_unpack(
+    bundle_filename: Path = typer.Argument(..., help="Cache bundle to read"),
+):
+    """Add the entries of a cache bundle to the caches, skipping those which
+    are already present or newer here."""
+
+    try:
+        result = unpack_cache(bundle_filename, settings.cache_root_dirpath)
+    except ValueError as e:
+        raise typer.BadParameter(str(e))
+
+    logger.info(
+        f"Unpacked {result.n_written} cache entries, skipped {result.n_skipped} "
+        "already present or newer"
+    )
+
+
+@app.command()
+def prefetch(
+    accession_ids: List[str] = typer.Argument(None, help="Studies to prefetch"),
+    discover: bool = typer.Option(
+        False, help="Prefetch every study in the archive with OME-NGFF images"
+    ),
+    channel_stats: bool = ChannelStatsOption,
+    workers: int = typer.Option(1, help="Number of studies to prefetch concurrently"),
+    rate: float = typer.Option(
+        settings.prefetch_rate,
+        help="Maximum API calls, and OME-Zarr metadata reads, per second",
+    ),
+):
+    """Warm the image cache ahead of an export, by fetching API objects and
+    probing OME-Zarr metadata for each image at low priority, without writing
+    any output. The export run then reports its cache hit ratio."""
+
+    if discover:
+        accession_ids = discover_accession_ids()
+    elif not accession_ids:
+        raise typer.BadParameter("Give accession IDs, or --discover")
+
+    if hasattr(os, "nice"):
+        os.nice(10)
+    api_limiter.max_rate = rate
+    zarr_limiter.max_rate = rate
+
+    engine = ExportEngine(
+        partial(study_uuid_to_export_images, channel_stats=channel_stats),
+        workers=workers,
+        # Prefetches are rate limited, so would overstate export times
+        record_timings=False,
+    )
+    n_images = 0
+    for study_export in engine.run(accession_ids):
+        n_images += len(study_export.images)
+
+    logger.info(f"Prefetched {n_images} images with {api_limiter.n_calls} API calls")
+    for line in cache_stats.summary():
+        logger.info(line)
+
+
+@app.command()
+def snapshot(
+    output_filename: Path = typer.Argument(..., help="Snapshot database to write"),
+    accession_ids: List[str] = typer.Argument(None, help="Studies to snapshot"),
+    discover: bool = typer.Option(
+        False, help="Snapshot every study in the archive with OME-NGFF images"
+    ),
+    workers: int = WorkersOption,
+):
+    """Fetch everything the exporters read for the given studies into a local
+    snapshot, so that exports can be run offline with --snapshot. An existing
+    snapshot is updated in place."""
+
+    if discover:
+        accession_ids = discover_accession_ids()
+    elif not accession_ids:
+        raise typer.BadParameter("Give accession IDs, or --discover")
+
+    n_studies = take_snapshot(accession_ids, output_filename, workers=workers)
+    logger.info(f"Wrote {n_studies} studies to snapshot {output_filename}")
 
 
 @app.command()
@@ -0,0 +1,132 @@
+"""Columnar (Apache Parquet) output of export records, for analytical use.
+
+Requires the optional pyarrow dependency (poetry install -E parquet)."""
+
+import json
+import typing
+from contextlib import ExitStack
+from pathlib import Path
+from typing import Iterable, Type
+
+from pydantic import BaseModel
+
+from .outputs import atomic_output_path
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # pragma: no cover
+    pa = None
+
+
+DEFAULT_ROW_GROUP_SIZE = 10000
+
+
+def arrow_type_for_field(field) -> "pa.DataType":
+    """Arrow type for a pydantic field. Scalars map to their natural types,
+    lists of strings to list<string>, anything more deeply nested to a JSON
+    encoded string."""
+
+    outer_type = field.outer_type_
+    if outer_type is int:
+        return pa.int64()
+    if outer_type is float:
+        return pa.float64()
+    if outer_type is bool:
+        return pa.bool_()
+    if outer_type is str:
+        return pa.string()
+    if typing.get_origin(outer_type) in (list, typing.List) and field.type_ is str:
+        return pa.list_(pa.string())
+
+    return pa.string()
+
+
+def arrow_schema_for_model(model_cls: Type[BaseModel], key_column: str | None = None):
+    fields = [
+        pa.field(name, arrow_type_for_field(field))
+        for name, field in model_cls.__fields__.items()
+    ]
+    if key_column:
+        fields.insert(0, pa.field(key_column, pa.string()))
+
+    return pa.schema(fields)
+
+
+class ParquetExportWriter:
+    """Writes pydantic export records to a Parquet file, buffering rows and
+    flushing them as one row group per batch so that memory use is bounded by
+    the batch size rather than the number of records.
+
+    Records may optionally be keyed (e.g. datasets by accession ID), in which
+    case the key is written as the first column."""
+
+    def __init__(
+        self,
+        fpath: Path,
+        model_cls: Type[BaseModel],
+        key_column: str | None = None,
+        row_group_size: int = DEFAULT_ROW_GROUP_SIZE,
+    ):
+        if pa is None:
+            raise ImportError(
+                "Parquet output needs pyarrow, install with: poetry install -E parquet"
+            )
+
+        self.model_cls = model_cls
+        self.key_column = key_column
+        self.row_group_size = row_group_size
+        self.schema = arrow_schema_for_model(model_cls, key_column)
+        self._json_columns = {
+            field.name
+            for field in self.schema
+            if field.type == pa.string()
+            and field.name != key_column
+            and self.model_cls.__fields__[field.name].outer_type_ is not str
+        }
+        self._rows = []
+
+        # The file is only replaced when closed, and if its content changed
+        self._exit_stack = ExitStack()
+        tmp_fpath = self._exit_stack.enter_context(atomic_output_path(fpath))
+        self._writer = pq.ParquetWriter(tmp_fpath, self.schema)
+
+    def _to_row(self, record: BaseModel, key: str | None) -> dict:
+        row = record.dict()
+        for name in self._json_columns:
+            if row[name] is not None:
+                row[name] = json.dumps(row[name])
+        if self.key_column:
+            row[self.key_column] = key
+
+        return row
+
+    def add(self, record: BaseModel, key: str | None = None):
+        self._rows.append(self._to_row(record, key))
+        if len(self._rows) >= self.row_group_size:
+            self.flush()
+
+    def add_all(self, records: Iterable[BaseModel]):
+        for record in records:
+            self.add(record)
+
+    def flush(self):
+        if self._rows:
+            table = pa.Table.from_pylist(self._rows, schema=self.schema)
+            self._writer.write_table(table, row_group_size=self.row_group_size)
+            self._rows = []
+
+    def close(self):
+        self.flush()
+        self._writer.close()
+        self._exit_stack.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        if exc_info[0] is None:
+            self.close()
+        else:
+            self._writer.close()
+            self._exit_stack.__exit__(*exc_info)
@@ -0,0 +1,242 @@
+"""Adaptive limits on the number of concurrent calls to upstream services.
+
+Each AdaptiveLimiter adjusts its limit by additive increase, multiplicative
+decrease (AIMD): the limit grows by one for every limit's worth of healthy
+calls, and is cut by settings.adaptive_backoff when calls fail or their
+latency rises well above the best recently seen for the same kind of call
+(e.g. a 500 image search, or a single get), so throughput tracks what the
+service can sustain. A limiter can also cap the rate at which calls
+start, for low priority work such as prefetching.
+
+A limiter can only hold back calls which are made, so the images of each
+study are exported on limited_call_executor, which has enough threads for
+either limiter to reach its maximum."""
+
+import logging
+import threading
+import time
+from collections import defaultdict, deque
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from typing import Callable
+
+import aiohttp
+import requests
+import urllib3
+from bia_integrator_api import exceptions as api_exceptions
+
+from .config import settings
+
+logger = logging.getLogger(__name__)
+
+
+def call_name(fn: Callable, args: tuple, kwargs: dict) -> str:
+    return getattr(fn, "__name__", "")
+
+
+class AdaptiveLimiter:
+    def __init__(
+        self,
+        name: str,
+        min_limit: int,
+        max_limit: int,
+        is_congestion: Callable[[Exception], bool] = lambda e: True,
+        call_kind: Callable[[Callable, tuple, dict], str] = call_name,
+    ):
+        self.name = name
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.is_congestion = is_congestion
+        self.call_kind = call_kind
+        self.limit = float(min(max(settings.export_workers, min_limit), max_limit))
+        # Maximum calls started per second, if set
+        self.max_rate: float | None = None
+
+        self.n_calls = 0
+        self.n_errors = 0
+        self.in_flight = 0
+        self._condition = threading.Condition()
+        # Latencies by kind of call, since e.g. searches are slower than gets
+        self._latencies = defaultdict(
+            lambda: deque(maxlen=settings.adaptive_baseline_window)
+        )
+        self._ewma_latencies: dict[str, float] = {}
+        # Completions to wait after a decrease before decreasing again, so a
+        # burst of slow calls only counts once
+        self._cooldown = 0
+        self._next_start_at = 0.0
+
+    def acquire(self):
+        with self._condition:
+            while self.in_flight >= int(self.limit):
+                self._condition.wait()
+            self.in_flight += 1
+
+            delay = 0.0
+            if self.max_rate:
+                now = time.monotonic()
+                start_at = max(now, self._next_start_at)
+                self._next_start_at = start_at + 1 / self.max_rate
+                delay = start_at - now
+
+        if delay > 0:
+            time.sleep(delay)
+
+    def release(self, latency: float, congested: bool, kind: str = ""):
+        with self._condition:
+            self.in_flight -= 1
+            self.n_calls += 1
+            self.n_errors += congested
+
+            latencies = self._latencies[kind]
+            if not congested:
+                latencies.append(latency)
+                ewma_latency = self._ewma_latencies.get(kind, latency)
+                self._ewma_latencies[kind] = ewma_latency + 0.1 * (
+                    latency - ewma_latency
+                )
+
+            baseline = min(latencies) if latencies else None
+            slow = (
+                baseline is not None
+                and self._ewma_latencies[kind]
+                > settings.adaptive_latency_tolerance * baseline
+            )
+
+            old_limit = int(self.limit)
+            if self._cooldown:
+                self._cooldown -= 1
+            elif congested or slow:
+                self.limit = max(self.min_limit, self.limit * settings.adaptive_backoff)
+                self._cooldown = old_limit
+                # Let the latency average recover from the congested calls
+                if baseline is not None:
+                    self._ewma_latencies[kind] = baseline
+            else:
+                self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+
+            if int(self.limit) != old_limit:
+                reason = "errors" if congested else "latency" if slow else "healthy"
+                logger.info(
+                    f"{self.name} concurrency {old_limit} -> {int(self.limit)} "
+                    f"({reason}, {kind or 'call'} latency {latency:.3f}s, "
+                    f"baseline {baseline or 0:.3f}s)"
+                )
+
+            self._condition.notify_all()
+
+    def call(self, fn: Callable, *args, **kwargs):
+        """Call fn within the limit, feeding back its latency and outcome."""
+
+        kind = self.call_kind(fn, args, kwargs)
+        self.acquire()
+        started_at = time.perf_counter()
+        congested = False
+        try:
+            return fn(*args, **kwargs)
+        except Exception as e:
+            congested = self.is_congestion(e)
+            raise
+        finally:
+            self.release(time.perf_counter() - started_at, congested, kind)
+
+
+def api_congestion(e: Exception) -> bool:
+    """Whether an API client error signals an overloaded service, rather than
+    e.g. a missing object."""
+
+    if isinstance(e, api_exceptions.ApiException):
+        status = e.status or 0
+        return status == 429 or status >= 500
+
+    # Other errors, e.g. invalid responses, say nothing about load
+    return is_transient(e)
+
+
+# Network failures, which may not recur when the call is retried
+NETWORK_ERRORS = (
+    TimeoutError,
+    ConnectionError,
+    urllib3.exceptions.TimeoutError,
+    urllib3.exceptions.ProtocolError,
+    urllib3.exceptions.MaxRetryError,
+    requests.ConnectionError,
+    requests.Timeout,
+    aiohttp.ClientConnectionError,
+)
+
+
+def is_transient(e: Exception) -> bool:
+    """Whether e is a congestion or network error, rather than one which
+    will recur each time, such as a missing object or malformed metadata."""
+
+    if isinstance(e, api_exceptions.ApiException):
+        return api_congestion(e)
+    if isinstance(e, requests.HTTPError) and e.response is not None:
+        return e.response.status_code == 429 or e.response.status_code >= 500
+    # As raised by fsspec, e.g. when S3 throttles OME-Zarr reads
+    if isinstance(e, aiohttp.ClientResponseError):
+        return e.status == 429 or e.status >= 500
+
+    return isinstance(e, NETWORK_ERRORS)
+
+
+def retry_transient(fn: Callable, *args, **kwargs):
+    """Call fn, retrying it up to settings.transient_retries times, with
+    exponential backoff, while it fails with transient errors."""
+
+    for attempt in range(settings.transient_retries + 1):
+        try:
+            return fn(*args, **kwargs)
+        except Exception as e:
+            if not is_transient(e) or attempt == settings.transient_retries:
+                raise
+            delay = settings.retry_backoff_seconds * 2**attempt
+            logger.info(f"Retrying in {delay:.1f}s after {type(e).__name__}: {e}")
+            time.sleep(delay)
+
+
+def api_call_kind(fn: Callable, args: tuple, kwargs: dict) -> str:
+    """The API method called, and the page size of listings and searches."""
+
+    kind = call_name(fn, args, kwargs)
+    limit = kwargs.get("limit")
+    for arg in args:
+        # Searches take their page size in the filter
+        limit = limit or getattr(arg, "limit", None)
+    if limit is not None:
+        kind = f"{kind}[{limit}]"
+
+    return kind
+
+
+def zarr_congestion(e: Exception) -> bool:
+    # Missing or malformed OME Zarrs fail quickly and say nothing about load
+    return not isinstance(e, (KeyError, FileNotFoundError, ValueError))
+
+
+api_limiter = AdaptiveLimiter(
+    "API",
+    settings.api_concurrency_min,
+    settings.api_concurrency_max,
+    is_congestion=api_congestion,
+    call_kind=api_call_kind,
+)
+zarr_limiter = AdaptiveLimiter(
+    "OME-Zarr",
+    settings.zarr_concurrency_min,
+    settings.zarr_concurrency_max,
+    is_congestion=zarr_congestion,
+)
+
+
+@lru_cache(maxsize=1)
+def limited_call_executor() -> ThreadPoolExecutor:
+    """Threads for work whose calls are gated by api_limiter and
+    zarr_limiter, shared by all studies, so that the limiters rather than the
+    number of threads bound concurrent calls."""
+
+    return ThreadPoolExecutor(
+        max_workers=max(settings.api_concurrency_max, settings.zarr_concurrency_max),
+        thread_name_prefix="limited",
+    )
@@ -17,6 +17,96 @@ class Settings(BaseSettings):
     bia_password: str = None
     disable_ssl_host_check: bool = True
 
+    export_workers: int = 4
+
+    # Maximum API calls, and separately OME-Zarr metadata reads, per second
+    # while prefetching
+    prefetch_rate: float = 5.0
+
+    # Format of image and dataset cache entries: json, orjson or msgpack
+    cache_serializer: str = "json"
+
+    # Studies are exported most expensive first, among the next
+    # schedule_lookahead. Without a timing from an earlier run, a study's
+    # cost in seconds is estimated from its numbers of images and file
+    # references. Studies are split into work units of about
+    # schedule_unit_images_count images
+    schedule_lookahead: int = 64
+    schedule_study_seconds: float = 2.0
+    schedule_image_seconds: float = 0.5
+    schedule_file_reference_seconds: float = 0.01
+    schedule_unit_images_count: int = 100
+
+    # Bounds for the adaptive limits on concurrent calls to the API and reads
+    # of OME-Zarr metadata. Limits are cut by adaptive_backoff when calls fail
+    # or their average latency exceeds adaptive_latency_tolerance times the
+    # best of the last adaptive_baseline_window calls. Images are exported on
+    # as many threads as the larger maximum
+    api_concurrency_min: int = 1
+    api_concurrency_max: int = 16
+    zarr_concurrency_min: int = 1
+    zarr_concurrency_max: int = 32
+    adaptive_backoff: float = 0.7
+    adaptive_latency_tolerance: float = 2.0
+    adaptive_baseline_window: int = 200
+
+    # Calls failing with congestion or network errors are retried up to
+    # transient_retries times, after retry_backoff_seconds, doubling each time
+    transient_retries: int = 3
+    retry_backoff_seconds: float = 1.0
+
+    # Datasets list a sample of dataset_sample_images_count of their
+    # OME-NGFF images (ai_dataset_sample_images_count for AI datasets),
+    # chosen by dataset_sample_seed, and stratified by
+    # dataset_sample_stratify_by ("size" or "attribute:<name>") if set
+    dataset_sample_images_count: int = 8
+    ai_dataset_sample_images_count: int = 10
+    dataset_sample_seed: int = 0
+    dataset_sample_stratify_by: str = ""
+
+    # Probe the OME-Zarr metadata of each study's images in bulk, from a
+    # listing of the study's prefix in bucket_name at endpoint_url, unless
+    # the prefix has more than bulk_probe_max_keys objects
+    bulk_probe: bool = False
+    bulk_probe_max_keys: int = 100_000
+
+    # check-links requests up to link_check_workers URIs at once, except that
+    # study prefixes of bucket_name with link_check_list_min_uris or more
+    # targets are listed instead, unless over link_check_max_keys objects
+    link_check_workers: int = 32
+    link_check_list_min_uris: int = 20
+    link_check_max_keys: int = 100_000
+
+    # bulk-index writes batches of at most bulk_index_batch_bytes and
+    # bulk_index_batch_docs documents to indexes named
+    # <bulk_index_prefix>-images and -datasets, posting up to
+    # bulk_index_workers at once, each within bulk_index_timeout seconds
+    bulk_index_batch_bytes: int = 10 * 2**20
+    bulk_index_batch_docs: int = 5000
+    bulk_index_prefix: str = "bia"
+    bulk_index_workers: int = 4
+    bulk_index_timeout: float = 120.0
+
+    # Channel statistics are computed channel_stats_workers images at a time
+    # across the process, each with a chunk cache of channel_stats_cache_bytes,
+    # from the lowest resolution with planes of channel_stats_min_plane_pixels
+    # and chunks of at most channel_stats_max_chunk_bytes
+    channel_stats_workers: int = 4
+    channel_stats_cache_bytes: int = 64 * 2**20
+    channel_stats_min_plane_pixels: int = 256 * 256
+    channel_stats_max_chunk_bytes: int = 256 * 2**20
+
+    # Studies with more images than this have their images split across
+    # shards, rather than being exported whole by one shard
+    shard_split_images_count: int = 200
+
+    # Sampling interval in seconds, and length of allocation reports, for
+    # --profile. With --profile-memory, allocation growth is reported for
+    # every profile_memory_study_interval-th study exported
+    profile_sample_interval: float = 0.005
+    profile_top_n: int = 25
+    profile_memory_study_interval: int = 10
+
     class Config:
         env_file = f"{Path(__file__).parent.parent / '.env'}"
 
@@ -5,6 +5,7 @@
 from pathlib import Path
 from bia_integrator_api import models as api_models
 from .models import ExportImage
+from .projection import ALL_SOURCES
 from .proxyimage import ome_zarr_image_from_ome_zarr_uri
 
 
@@ -23,6 +24,14 @@ def filter_image_attributes(image: api_models.BIAImage) -> dict[str, str]:
     return {key: value for key, value in image.attributes.items() if filter_func(key)}
 
 
+def get_ome_zarr_uri(image: api_models.BIAImage) -> str:
+    """Return the URI of the first OME-NGFF representation of a BIA Image."""
+
+    reps_by_type = {rep.type: rep for rep in image.representations}
+
+    return reps_by_type["ome_ngff"].uri[0]
+
+
 def transform_study_dict(bia_study: api_models.BIAStudy) -> dict:
     keys = [
         "accession_id",
@@ -99,11 +108,15 @@ def create_export_image(
     image_acquisitions: list[api_models.ImageAcquisition],
     specimens: list[api_models.Specimen],
     biosamples: list[api_models.Biosample],
+    sources: frozenset[str] = ALL_SOURCES,
 ) -> ExportImage:
+    """Map an image and its related objects to an ExportImage. If sources
+    (see projection) does not include ome_zarr, the image is not probed, and
+    its size fields are left unset."""
+
     reps_by_type = {rep.type: rep for rep in image.representations}
 
-    ome_zarr_uri = reps_by_type["ome_ngff"].uri[0]
-    im = ome_zarr_image_from_ome_zarr_uri(ome_zarr_uri)
+    ome_zarr_uri = get_ome_zarr_uri(image)
 
     try:
         thumbnail_uri = reps_by_type["thumbnail"].uri[0]
@@ -121,7 +134,7 @@ def create_export_image(
         "https://uk1s3.embassy.ebi.ac.uk/bia-zarr-test/vizarr/index.html?source="
     )
 
-    export_im = ExportImage(
+    values = dict(
         uuid=image.uuid,
         name=Path(image.name).name,
         alias="IM1",
@@ -130,22 +143,31 @@ def create_export_image(
         study_accession_id=study.accession_id,
         study_title=study.title,
         release_date=study.release_date,
-        itk_uri=itk_base + reps_by_type["ome_ngff"].uri[0],
-        vizarr_uri=vizarr_base + reps_by_type["ome_ngff"].uri[0],
-        sizeX=im.sizeX,
-        sizeY=im.sizeY,
-        sizeZ=im.sizeZ,
-        sizeT=im.sizeT,
-        sizeC=im.sizeC,
-        PhysicalSizeX=im.PhysicalSizeX,
-        PhysicalSizeY=im.PhysicalSizeY,
-        PhysicalSizeZ=im.PhysicalSizeZ,
+        itk_uri=itk_base + ome_zarr_uri,
+        vizarr_uri=vizarr_base + ome_zarr_uri,
         source_image_uuid=source_image_uuid,
         source_image_thumbnail_uri=source_image_thumbnail_uri,
         overlay_image_uri=overlay_image_uri,
         attributes=filter_image_attributes(image),
     )
 
+    if "ome_zarr" in sources:
+        im = ome_zarr_image_from_ome_zarr_uri(ome_zarr_uri)
+        values.update(
+            sizeX=im.sizeX,
+            sizeY=im.sizeY,
+            sizeZ=im.sizeZ,
+            sizeT=im.sizeT,
+            sizeC=im.sizeC,
+            PhysicalSizeX=im.PhysicalSizeX,
+            PhysicalSizeY=im.PhysicalSizeY,
+            PhysicalSizeZ=im.PhysicalSizeZ,
+        )
+        export_im = ExportImage(**values)
+    else:
+        # Without sizes the image is incomplete, so it is not validated
+        export_im = ExportImage.construct(**values)
+
     if len(image_acquisitions) > 0:
         export_im.image_acquisition_title = image_acquisitions[0].title
         export_im.image_acquisition_imaging_instrument = image_acquisitions[
@@ -0,0 +1,73 @@
+"""Discovery of exportable studies across the whole archive, as an
+alternative to hand-maintained lists of accession IDs."""
+
+import logging
+from typing import Iterator
+
+from bia_integrator_api import models as api_models
+
+from .bia_client_utils import get_images_with_a_rep_type, rw_client
+
+logger = logging.getLogger(__name__)
+
+
+# Study attributes which mark AI-ready and spatial omics datasets. A study
+# matches a filter if it has any of the listed attributes.
+AI_DATASET_ATTRIBUTES = [
+    "annotation_type",
+    "annotation_method",
+    "example_annotation_uri",
+    "models_uri",
+]
+SPATIAL_OMICS_ATTRIBUTES = ["scseq_desc", "scseq_link"]
+
+
+def iter_studies(page_size: int = 100) -> Iterator[api_models.BIAStudy]:
+    """Page through every study in the archive, in UUID order."""
+
+    start_uuid = None
+    while True:
+        studies = rw_client.search_studies(start_uuid=start_uuid, limit=page_size)
+        yield from studies
+
+        if len(studies) < page_size:
+            return
+        start_uuid = studies[-1].uuid
+
+
+def study_has_rep_type(study_uuid: str, rep_type: str) -> bool:
+    return len(get_images_with_a_rep_type(study_uuid, rep_type, limit=1)) > 0
+
+
+def discover_accession_ids(
+    rep_type: str = "ome_ngff",
+    any_of_attributes: list[str] | None = None,
+    page_size: int = 100,
+) -> Iterator[str]:
+    """Yield the accession IDs of studies which have images with a
+    representation of rep_type and, if given, any of any_of_attributes.
+
+    This is a generator over paginated API results, so studies can be
+    exported while discovery is still running."""
+
+    n_studies = 0
+    n_discovered = 0
+    for study in iter_studies(page_size):
+        n_studies += 1
+        if not study.images_count:
+            continue
+
+        if any_of_attributes:
+            annotated_study = rw_client.get_study(study.uuid, apply_annotations=True)
+            if not any(
+                annotated_study.attributes.get(key) for key in any_of_attributes
+            ):
+                continue
+
+        if not study_has_rep_type(study.uuid, rep_type):
+            continue
+
+        n_discovered += 1
+        yield study.accession_id
+
+    logger.info(f"Discovered {n_discovered} of {n_studies} studies")
@@ -0,0 +1,274 @@
+"""Concurrent export of studies.
+
+The engine consumes accession IDs lazily, so they can come from a slow
+source such as archive-wide discovery, and yields each study's export as
+soon as it is ready.
+
+Each study's export is a small graph of tasks. Planning resolves its UUID
+and fetches the study, once, and estimates its cost. The study is then
+passed to its work units, which depend on nothing else: one building its
+dataset, and one or more (for studies with many images) each exporting a
+part of its images. So a study's dataset and images are exported
+concurrently with each other, and with other studies' units. Planning also
+lists the study's images, once, for all its image units.
+
+Studies are planned ahead of being exported, and whenever a worker is idle
+the most expensive planned work is dispatched to it, so that the run does
+not end waiting on one large study."""
+
+import heapq
+import itertools
+import logging
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from functools import partial
+from typing import Callable, Iterable, Iterator, NamedTuple
+
+from bia_integrator_api import models as api_models
+from pydantic import BaseModel
+
+from .bia_client_utils import (
+    get_study_ome_ngff_images,
+    get_study_uuid_by_accession_id,
+    rw_client,
+)
+from .config import settings
+from .models import ExportImage, ExportShard
+from .profiling import profile_study
+from .scheduling import (
+    estimate_dataset_cost,
+    estimate_study_cost,
+    record_study_timing,
+    study_work_unit_count,
+    work_unit_owns_image,
+)
+from .sharding import shard_owns_image, shard_owns_study, study_is_split
+
+logger = logging.getLogger(__name__)
+
+
+class StudyExport(NamedTuple):
+    accession_id: str
+    dataset: BaseModel | None
+    images: dict[str, ExportImage]
+
+
+class WorkUnit(NamedTuple):
+    accession_id: str
+    study_uuid: str
+    study: api_models.BIAStudy
+    images: list[api_models.BIAImage]
+    images_count: int
+    cost: float
+    part: int
+    n_parts: int
+    export_dataset: bool
+    export_images: bool
+    shard_image_filter: Callable[[str], bool] | None
+    # Whether the study's export time is recorded once all its units are done
+    timed: bool = True
+
+
+class ExportEngine:
+    """Exports the dataset and images of each study in a thread pool.
+
+    images_exporter is called as images_exporter(study_uuid, image_filter,
+    study, images), where image_filter is None or a predicate on image UUIDs,
+    and dataset_builder (if given) as dataset_builder(study_uuid, study,
+    images), where study is the study fetched (with annotations applied) when
+    planning and images is its listing of OME-NGFF images, so that datasets
+    sample the images which are exported. A
+    study's export is yielded in several parts: one with its dataset, and one
+    or more with some of its images. Each study's export time is recorded
+    for scheduling later runs, if record_timings, unless image_is_cached
+    (a predicate on image UUIDs) says some of the images it exports were
+    already cached when it was planned."""
+
+    def __init__(
+        self,
+        images_exporter: Callable[..., dict[str, ExportImage]],
+        dataset_builder: Callable[[str], BaseModel] | None = None,
+        shard: ExportShard | None = None,
+        workers: int | None = None,
+        record_timings: bool = True,
+        image_is_cached: Callable[[str], bool] | None = None,
+    ):
+        self.images_exporter = images_exporter
+        self.dataset_builder = dataset_builder
+        self.shard = shard
+        self.workers = workers or settings.export_workers
+        self.record_timings = record_timings
+        self.image_is_cached = image_is_cached
+
+    def plan_study(self, accession_id: str) -> list[WorkUnit]:
+        study_uuid = get_study_uuid_by_accession_id(accession_id)
+        study = rw_client.get_study(study_uuid, apply_annotations=True)
+        images_count = study.images_count or 0
+
+        owns_study = self.shard is None or shard_owns_study(self.shard, accession_id)
+        export_images = owns_study
+        shard_image_filter = None
+        if self.shard and study_is_split(images_count):
+            export_images = True
+            shard_image_filter = partial(shard_owns_image, self.shard)
+
+        export_dataset = self.dataset_builder is not None and owns_study
+        if not (export_dataset or export_images):
+            return []
+
+        file_references_count = study.file_references_count or 0
+        cost = estimate_study_cost(accession_id, images_count, file_references_count)
+        dataset_cost = 0.0
+        if export_dataset:
+            dataset_cost = min(cost, estimate_dataset_cost(file_references_count))
+        n_parts = study_work_unit_count(images_count)
+
+        images = get_study_ome_ngff_images(study_uuid)
+        timed = self.record_timings
+        if timed and export_images and self.image_is_cached:
+            # Exports served from the cache would understate a cold export
+            timed = not any(
+                self.image_is_cached(image.uuid)
+                for image in images
+                if shard_image_filter is None or shard_image_filter(image.uuid)
+            )
+
+        unit = partial(WorkUnit, accession_id, study_uuid, study, images, images_count)
+        units = []
+        if export_dataset:
+            units.append(unit(dataset_cost, 0, 1, True, False, None, timed))
+        if export_images:
+            units.extend(
+                unit(
+                    (cost - dataset_cost) / n_parts,
+                    part,
+                    n_parts,
+                    False,
+                    True,
+                    shard_image_filter,
+                    timed,
+                )
+                for part in range(n_parts)
+            )
+
+        return units
+
+    def export_unit(self, unit: WorkUnit) -> tuple[StudyExport, float]:
+        """Export a work unit, returning its export and how long it took."""
+
+        started_at = time.perf_counter()
+        with profile_study(unit.accession_id):
+            dataset = None
+            if unit.export_dataset:
+                dataset = self.dataset_builder(
+                    unit.study_uuid, study=unit.study, images=unit.images
+                )
+
+            images = {}
+            if unit.export_images:
+                images = self.images_exporter(
+                    unit.study_uuid,
+                    image_filter=self._image_filter(unit),
+                    study=unit.study,
+                    images=unit.images,
+                )
+        seconds = time.perf_counter() - started_at
+
+        if unit.export_dataset:
+            logger.info(f"Built dataset for {unit.accession_id}")
+        if unit.export_images:
+            part = f" part {unit.part + 1}/{unit.n_parts}" if unit.n_parts > 1 else ""
+            logger.info(f"Exported {unit.accession_id}{part}: {len(images)} images")
+
+        return StudyExport(unit.accession_id, dataset, images), seconds
+
+    def _image_filter(self, unit: WorkUnit) -> Callable[[str], bool] | None:
+        filters = []
+        if unit.shard_image_filter:
+            filters.append(unit.shard_image_filter)
+        if unit.n_parts > 1:
+            filters.append(partial(work_unit_owns_image, unit.part, unit.n_parts))
+
+        if not filters:
+            return None
+
+        return lambda image_uuid: all(f(image_uuid) for f in filters)
+
+    def run(self, accession_ids: Iterable[str]) -> Iterator[StudyExport]:
+        """Export the given studies, yielding results in completion order.
+
+        Up to settings.schedule_lookahead studies are planned ahead of being
+        exported, and work is dispatched as soon as a worker is idle, largest
+        planned work first. accession_ids is consumed in a thread of its own,
+        so exporting starts with the first study planned even if the next ID
+        is slow to come, and only as fast as studies are exported."""
+
+        lookahead = settings.schedule_lookahead
+        ids = iter(accession_ids)
+        ids_exhausted = False
+        # Future of the next accession ID, None once they are exhausted
+        pulling = None
+        # Heap of work units, most expensive first, then in planning order
+        queue = []
+        order = itertools.count()
+        planning = set()
+        exporting = {}
+        # Units left and seconds taken so far for each study being exported
+        progress = {}
+
+        puller = ThreadPoolExecutor(max_workers=1)
+        planner = ThreadPoolExecutor(max_workers=self.workers)
+        with puller, planner, ThreadPoolExecutor(max_workers=self.workers) as executor:
+            while True:
+                if (
+                    pulling is None
+                    and not ids_exhausted
+                    and len(planning) + len(queue) < lookahead
+                ):
+                    pulling = puller.submit(next, ids, None)
+
+                while queue and len(exporting) < self.workers:
+                    unit = heapq.heappop(queue)[-1]
+                    exporting[executor.submit(self.export_unit, unit)] = unit
+
+                pending = planning | exporting.keys()
+                if pulling is not None:
+                    pending.add(pulling)
+                if not pending:
+                    return
+
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    if future is pulling:
+                        pulling = None
+                        accession_id = future.result()
+                        if accession_id is None:
+                            ids_exhausted = True
+                        else:
+                            planning.add(planner.submit(self.plan_study, accession_id))
+                        continue
+
+                    if future in planning:
+                        planning.remove(future)
+                        units = future.result()
+                        for unit in units:
+                            heapq.heappush(queue, (-unit.cost, next(order), unit))
+                        if units:
+                            progress[units[0].accession_id] = [len(units), 0.0]
+                        continue
+
+                    unit = exporting.pop(future)
+                    study_export, seconds = future.result()
+                    study_progress = progress[unit.accession_id]
+                    study_progress[0] -= 1
+                    study_progress[1] += seconds
+                    if not study_progress[0]:
+                        del progress[unit.accession_id]
+                        if unit.timed:
+                            record_study_timing(
+                                unit.accession_id,
+                                unit.images_count,
+                                study_progress[1],
+                            )
+
+                    yield study_export
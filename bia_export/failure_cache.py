@@ -0,0 +1,85 @@
+"""Persistent negative cache of images whose export failed.
+
+Failed images are quarantined: later runs skip them without refetching,
+until the image's version in the API changes."""
+
+import logging
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Iterator, Optional
+
+from bia_integrator_api import models as api_models
+from pydantic import BaseModel
+
+from .config import settings
+
+logger = logging.getLogger(__name__)
+
+
+class ImageFailure(BaseModel):
+    uuid: str
+    study_accession_id: Optional[str] = None
+    error_class: str
+    message: str
+    upstream_version: int
+    failed_at: str
+
+
+def failures_dirpath() -> Path:
+    dirpath = settings.cache_root_dirpath / "failures"
+    dirpath.mkdir(exist_ok=True, parents=True)
+
+    return dirpath
+
+
+def failure_fpath(uuid: str) -> Path:
+    return failures_dirpath() / f"{uuid}.json"
+
+
+def get_failure(uuid: str) -> ImageFailure | None:
+    fpath = failure_fpath(uuid)
+    if fpath.exists():
+        return ImageFailure.parse_file(fpath)
+
+    return None
+
+
+def record_failure(
+    image: api_models.BIAImage, study: api_models.BIAStudy, error: Exception
+) -> ImageFailure:
+    failure = ImageFailure(
+        uuid=image.uuid,
+        study_accession_id=study.accession_id,
+        error_class=type(error).__name__,
+        message=str(error),
+        upstream_version=image.version,
+        failed_at=datetime.now(timezone.utc).isoformat(),
+    )
+    with open(failure_fpath(image.uuid), "w") as fh:
+        fh.write(failure.json(indent=2))
+
+    return failure
+
+
+def clear_failure(uuid: str):
+    failure_fpath(uuid).unlink(missing_ok=True)
+
+
+def is_quarantined(image: api_models.BIAImage) -> bool:
+    """Whether image failed to export at its current upstream version."""
+
+    failure = get_failure(image.uuid)
+    if failure is None:
+        return False
+
+    if failure.upstream_version != image.version:
+        logger.info(f"Image {image.uuid} changed upstream, retrying it")
+        clear_failure(image.uuid)
+        return False
+
+    return True
+
+
+def iter_failures() -> Iterator[ImageFailure]:
+    for fpath in sorted(failures_dirpath().glob("*.json")):
+        yield ImageFailure.parse_file(fpath)
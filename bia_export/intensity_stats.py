@@ -0,0 +1,271 @@
+"""Per-channel intensity statistics for OME-Zarr images, computed out-of-core.
+
+Statistics are accumulated chunk by chunk over a single pyramid level, so the
+memory used for one image is bounded by the chunk cache plus a single chunk
+and a copy of one of its channels, regardless of the size of the image. Levels whose chunks are larger than
+settings.channel_stats_max_chunk_bytes are skipped. All computations share
+one process-wide pool, however many studies are exported at once."""
+
+import itertools
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import zarr
+
+from .config import settings
+from .models import ExportChannelStatistics
+from .omezarrmeta import ZMeta
+
+logger = logging.getLogger(__name__)
+
+
+PERCENTILES = [0.1, 1.0, 5.0, 50.0, 95.0, 99.0, 99.9]
+
+# Number of histogram bins used to estimate percentiles for dtypes we cannot
+# bin exactly (floats and integers wider than 16 bits)
+N_APPROXIMATE_BINS = 4096
+
+# Values histogrammed exactly at a time, as np.bincount widens its input
+BINCOUNT_BATCH_VALUES = 2**20
+
+
+def open_cached_zarr_group(uri: str, cache_bytes: int) -> zarr.Group:
+    """Open the Zarr group at uri read-only, behind an LRU cache holding at most
+    cache_bytes of chunk data."""
+
+    store = zarr.storage.FSStore(uri, mode="r")
+    return zarr.open_group(zarr.LRUStoreCache(store, max_size=cache_bytes), mode="r")
+
+
+def chunk_nbytes(zarray: zarr.Array) -> int:
+    return int(np.prod(zarray.chunks)) * zarray.dtype.itemsize
+
+
+def select_statistics_level(
+    zgroup: zarr.Group,
+    ngff_metadata: ZMeta,
+    min_plane_pixels: int,
+    max_chunk_bytes: int | None = None,
+) -> str:
+    """Return the path of the lowest resolution pyramid level whose planes still
+    have at least min_plane_pixels pixels, falling back to the highest usable
+    resolution. Levels with chunks over max_chunk_bytes are not usable."""
+
+    axis_index = ngff_metadata.axis_index
+    usable = [
+        path
+        for path in axis_index.paths
+        if max_chunk_bytes is None or chunk_nbytes(zgroup[path]) <= max_chunk_bytes
+    ]
+    if not usable:
+        raise ValueError(f"Every pyramid level has chunks over {max_chunk_bytes} bytes")
+
+    for path in reversed(usable):
+        shape = zgroup[path].shape
+        plane_pixels = axis_index.size("y", shape) * axis_index.size("x", shape)
+        if plane_pixels >= min_plane_pixels:
+            return path
+
+    return usable[0]
+
+
+def iter_chunk_slices(shape, chunks):
+    """Yield tuples of slices covering an array of the given shape, one per chunk."""
+
+    starts = [range(0, dim, chunk) for dim, chunk in zip(shape, chunks)]
+    for start in itertools.product(*starts):
+        yield tuple(
+            slice(s, min(s + chunk, dim)) for s, chunk, dim in zip(start, chunks, shape)
+        )
+
+
+def iter_channel_blocks(zarray: zarr.Array, c_axis: int | None):
+    """Read zarray one chunk at a time, yielding (channel, values) pairs where
+    values is a flat array of the pixels of that channel within the chunk.
+    Arrays without a channel axis (c_axis None) are treated as one channel."""
+
+    for slices in iter_chunk_slices(zarray.shape, zarray.chunks):
+        block = np.asarray(zarray[slices])
+        if c_axis is None:
+            rows = [(0, block.reshape(-1))]
+        else:
+            # One channel is copied out at a time, rather than the whole block
+            rows = (
+                (slices[c_axis].start + offset, np.take(block, offset, c_axis).ravel())
+                for offset in range(block.shape[c_axis])
+            )
+        for channel, row in rows:
+            if row.dtype.kind == "f":
+                finite = np.isfinite(row)
+                if not finite.all():
+                    row = row[finite]
+            if row.size:
+                yield channel, row
+
+
+def exact_histogram(values: np.ndarray, n_bins: int) -> np.ndarray:
+    """Histogram of integer values of 16 bits or less, with a bin for each
+    value of their dtype, from its minimum. Values are counted a batch at a
+    time, and signed values are offset by flipping their sign bit, so only a
+    batch is ever copied or widened."""
+
+    histogram = np.zeros(n_bins, dtype=np.int64)
+    for start in range(0, values.size, BINCOUNT_BATCH_VALUES):
+        batch = values[start : start + BINCOUNT_BATCH_VALUES]
+        if batch.dtype.kind == "i":
+            unsigned = batch.dtype.str.replace("i", "u")
+            batch = batch.view(unsigned) ^ np.array(n_bins // 2, dtype=unsigned)
+        histogram += np.bincount(batch, minlength=n_bins)
+
+    return histogram
+
+
+def percentiles_from_histogram(
+    counts: np.ndarray, bin_edges: np.ndarray, percentiles: list[float]
+) -> list[float]:
+    """Estimate percentiles from a histogram, interpolating linearly within bins.
+    bin_edges has one more entry than counts."""
+
+    cumulative = np.cumsum(counts)
+    targets = np.asarray(percentiles) / 100 * cumulative[-1]
+    idx = np.clip(np.searchsorted(cumulative, targets), 0, len(counts) - 1)
+    below = np.where(idx > 0, cumulative[idx - 1], 0)
+    fraction = (targets - below) / np.maximum(counts[idx], 1)
+    widths = bin_edges[idx + 1] - bin_edges[idx]
+
+    return list(bin_edges[idx] + np.clip(fraction, 0, 1) * widths)
+
+
+def compute_channel_statistics(
+    uri: str,
+    cache_bytes: int | None = None,
+    min_plane_pixels: int | None = None,
+    max_chunk_bytes: int | None = None,
+) -> list[ExportChannelStatistics]:
+    """Compute min, max, mean and percentiles for each channel of the OME-Zarr
+    image at uri, streaming over the lowest usable pyramid level.
+
+    Integer data of 16 bits or less is histogrammed exactly in a single pass.
+    Anything else needs a second pass to histogram between the observed min and
+    max, which is mostly served from the chunk cache for small levels."""
+
+    cache_bytes = cache_bytes or settings.channel_stats_cache_bytes
+    min_plane_pixels = min_plane_pixels or settings.channel_stats_min_plane_pixels
+    max_chunk_bytes = max_chunk_bytes or settings.channel_stats_max_chunk_bytes
+
+    zgroup = open_cached_zarr_group(uri, cache_bytes)
+    ngff_metadata = ZMeta.parse_obj(zgroup.attrs.asdict())
+    level = select_statistics_level(
+        zgroup, ngff_metadata, min_plane_pixels, max_chunk_bytes
+    )
+    zarray = zgroup[level]
+
+    c_axis = ngff_metadata.axis_index.position("c")
+    n_channels = ngff_metadata.axis_index.size("c", zarray.shape)
+
+    mins = np.full(n_channels, np.inf)
+    maxs = np.full(n_channels, -np.inf)
+    sums = np.zeros(n_channels)
+    counts = np.zeros(n_channels, dtype=np.int64)
+
+    exact = zarray.dtype.kind in "iu" and zarray.dtype.itemsize <= 2
+    if exact:
+        dtype_info = np.iinfo(zarray.dtype)
+        bin_edges = np.arange(dtype_info.min, dtype_info.max + 2, dtype=np.float64)
+        histograms = np.zeros((n_channels, len(bin_edges) - 1), dtype=np.int64)
+
+    for channel, values in iter_channel_blocks(zarray, c_axis):
+        mins[channel] = min(mins[channel], values.min())
+        maxs[channel] = max(maxs[channel], values.max())
+        sums[channel] += values.sum(dtype=np.float64)
+        counts[channel] += values.size
+        if exact:
+            histograms[channel] += exact_histogram(values, histograms.shape[1])
+
+    if not exact:
+        histograms = np.zeros((n_channels, N_APPROXIMATE_BINS), dtype=np.int64)
+        for channel, values in iter_channel_blocks(zarray, c_axis):
+            histograms[channel] += np.histogram(
+                values, bins=N_APPROXIMATE_BINS, range=(mins[channel], maxs[channel])
+            )[0]
+
+    labels = {}
+    if ngff_metadata.omero:
+        labels = dict(enumerate(c.label for c in ngff_metadata.omero.channels))
+
+    channel_statistics = []
+    for channel in range(n_channels):
+        if not counts[channel]:
+            continue
+        if not exact:
+            bin_edges = np.linspace(mins[channel], maxs[channel], N_APPROXIMATE_BINS + 1)
+        channel_percentiles = percentiles_from_histogram(
+            histograms[channel], bin_edges, PERCENTILES
+        )
+        if exact:
+            # Bins are single integer values, so report the value itself
+            channel_percentiles = [np.floor(p) for p in channel_percentiles]
+        channel_statistics.append(
+            ExportChannelStatistics(
+                channel=channel,
+                label=labels.get(channel),
+                min=mins[channel],
+                max=maxs[channel],
+                mean=sums[channel] / counts[channel],
+                percentiles={
+                    f"p{p:g}": float(value)
+                    for p, value in zip(PERCENTILES, channel_percentiles)
+                },
+            )
+        )
+
+    return channel_statistics
+
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def channel_stats_executor() -> ThreadPoolExecutor:
+    """The pool shared by every computation in the process, of
+    settings.channel_stats_workers threads."""
+
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=settings.channel_stats_workers,
+                thread_name_prefix="channel-stats",
+            )
+
+    return _executor
+
+
+def compute_channel_statistics_for_uris(
+    uris_by_uuid: dict[str, str]
+) -> dict[str, list[ExportChannelStatistics]]:
+    """Compute channel statistics for many images in parallel. Images for which
+    the computation fails are logged and left out of the result.
+
+    Computations run in the process-wide pool, whichever export worker asks
+    for them, and each holds its own chunk cache, so peak memory is roughly
+    settings.channel_stats_workers * (channel_stats_cache_bytes +
+    2 * channel_stats_max_chunk_bytes), for a chunk and a copy of one of its
+    channels."""
+
+    executor = channel_stats_executor()
+    futures = {
+        uuid: executor.submit(compute_channel_statistics, uri)
+        for uuid, uri in uris_by_uuid.items()
+    }
+
+    statistics_by_uuid = {}
+    for uuid, future in futures.items():
+        try:
+            statistics_by_uuid[uuid] = future.result()
+        except Exception as e:
+            logger.warning(f"Failed to compute channel statistics for {uuid}: {e}")
+
+    return statistics_by_uuid
@@ -0,0 +1,176 @@
+"""Streaming reading and writing of export files, one entry at a time.
+
+Export files are JSON objects whose top level values (collections, images,
+datasets) are themselves objects keyed by ID. Reading them with
+iter_export_entries holds only the current entry in memory, and
+ExportFileWriter writes the same layout as json.dumps(..., indent=2)
+incrementally, with keys sorted."""
+
+import json
+from pathlib import Path
+from types import GeneratorType
+from typing import IO, Iterator
+
+READ_SIZE = 2**20
+
+WHITESPACE = " \t\n\r"
+
+
+class ExportFileFormatError(Exception):
+    pass
+
+
+class _StreamingJSONReader:
+    """Minimal pull parser over the outer two levels of a JSON object, decoding
+    values at the second level with the standard library decoder."""
+
+    def __init__(self, fh: IO[str]):
+        self.fh = fh
+        self.buffer = ""
+        self.pos = 0
+        self.eof = False
+        self.decoder = json.JSONDecoder()
+
+    def _fill(self, size: int | None = None) -> bool:
+        if self.eof:
+            return False
+        data = self.fh.read(size or READ_SIZE)
+        if not data:
+            self.eof = True
+            return False
+        self.buffer = self.buffer[self.pos :] + data
+        self.pos = 0
+        return True
+
+    def peek(self) -> str:
+        while True:
+            while self.pos < len(self.buffer) and self.buffer[self.pos] in WHITESPACE:
+                self.pos += 1
+            if self.pos < len(self.buffer):
+                return self.buffer[self.pos]
+            if not self._fill():
+                raise ExportFileFormatError("Unexpected end of file")
+
+    def expect(self, char: str):
+        if self.peek() != char:
+            raise ExportFileFormatError(
+                f"Expected {char!r}, found {self.buffer[self.pos]!r}"
+            )
+        self.pos += 1
+
+    def read_value(self):
+        self.peek()
+        read_size = READ_SIZE
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buffer, self.pos)
+                # A value ending exactly at the end of the buffer may have
+                # been truncated (e.g. a number), so only accept it at EOF
+                if end < len(self.buffer) or self.eof:
+                    self.pos = end
+                    return value
+            except json.JSONDecodeError as e:
+                if self.eof:
+                    raise ExportFileFormatError(str(e)) from e
+            self._fill(read_size)
+            read_size *= 2
+
+    def iter_object(self) -> Iterator[str]:
+        """Yield the keys of the object at the current position. The caller
+        must consume each value before asking for the next key."""
+
+        self.expect("{")
+        if self.peek() == "}":
+            self.pos += 1
+            return
+        while True:
+            key = self.read_value()
+            if not isinstance(key, str):
+                raise ExportFileFormatError(f"Expected a string key, found {key!r}")
+            self.expect(":")
+            yield key
+            if self.peek() == ",":
+                self.pos += 1
+            else:
+                self.expect("}")
+                return
+
+
+def iter_export_sections(fpath: Path) -> Iterator[tuple[str, object]]:
+    """Yield (section, value) pairs for the top level of an export file, where
+    value is an iterator of (key, entry) pairs for object valued sections, and
+    the decoded value otherwise. Each iterator must be consumed in order."""
+
+    with open(fpath) as fh:
+        reader = _StreamingJSONReader(fh)
+        for section in reader.iter_object():
+            if reader.peek() == "{":
+                entries = ((key, reader.read_value()) for key in reader.iter_object())
+                yield section, entries
+                # Drain anything the caller did not consume
+                for _ in entries:
+                    pass
+            else:
+                yield section, reader.read_value()
+
+
+def iter_export_entries(
+    fpath: Path, section: str
+) -> Iterator[tuple[str, dict]]:
+    """Yield (key, entry) pairs from one object valued section of an export
+    file, e.g. iter_export_entries(fpath, "images")."""
+
+    for name, entries in iter_export_sections(fpath):
+        if name == section:
+            yield from entries
+            return
+
+
+def read_export_value(fpath: Path, section: str):
+    """Read the whole value of a small top level key, e.g. "shard", skipping
+    over the sections in between. Returns None if the key is not present."""
+
+    for name, value in iter_export_sections(fpath):
+        if name == section:
+            return dict(value) if isinstance(value, GeneratorType) else value
+
+    return None
+
+
+class ExportFileWriter:
+    """Writes an export file section by section, entry by entry, in the same
+    layout as json.dumps(exports, indent=2, sort_keys=True). Sections and
+    entries must be written in key order."""
+
+    def __init__(self, fh: IO[str]):
+        self.fh = fh
+        self._n_sections = 0
+        self._n_entries = 0
+
+    def _begin_key(self, name: str):
+        self.fh.write(",\n" if self._n_sections else "{\n")
+        self.fh.write(f"  {json.dumps(name)}: ")
+        self._n_sections += 1
+
+    def begin_section(self, name: str):
+        self._begin_key(name)
+        self.fh.write("{")
+        self._n_entries = 0
+
+    def write_entry(self, key: str, entry):
+        self.fh.write(",\n" if self._n_entries else "\n")
+        value = json.dumps(entry, indent=2, sort_keys=True).replace("\n", "\n    ")
+        self.fh.write(f"    {json.dumps(key)}: {value}")
+        self._n_entries += 1
+
+    def end_section(self):
+        self.fh.write("\n  }" if self._n_entries else "}")
+
+    def write_value(self, name: str, value):
+        self._begin_key(name)
+        self.fh.write(
+            json.dumps(value, indent=2, sort_keys=True).replace("\n", "\n  ")
+        )
+
+    def close(self):
+        self.fh.write("\n}" if self._n_sections else "{}")
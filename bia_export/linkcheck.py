@@ -0,0 +1,232 @@
+"""Checking that the URIs referenced by an export exist.
+
+URIs are collected from an export file in one streaming pass and
+deduplicated. Viewer links (vizarr, itk-vtk-viewer) are checked by the
+OME-Zarr they load. Targets in settings.bucket_name are grouped by study
+prefix, and a prefix with many targets is listed once, rather than each of
+its targets requested. Everything else is checked by HEAD requests over a
+pool of connections, many at once, so that exports with hundreds of
+thousands of links are checked in minutes."""
+
+import bisect
+import logging
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from pathlib import Path
+from typing import Iterator, NamedTuple
+from urllib.parse import parse_qs, urlsplit
+
+import requests
+from pydantic import BaseModel
+
+from .bulkprobe import S3Bucket, default_bucket
+from .config import settings
+from .jsonstream import iter_export_entries
+
+logger = logging.getLogger(__name__)
+
+
+URI_FIELDS = {
+    "images": [
+        "thumbnail_uri",
+        "vizarr_uri",
+        "itk_uri",
+        "overlay_image_uri",
+        "source_image_thumbnail_uri",
+    ],
+    "datasets": ["example_image_uri", "example_annotation_uri", "models_uri"],
+}
+
+# Query parameters with which viewers are given the image to load
+VIEWER_SOURCE_PARAMS = ["source", "fileToLoad"]
+
+
+class Reference(NamedTuple):
+    section: str
+    key: str
+    field: str
+    uri: str
+
+
+class MissingTarget(BaseModel):
+    target: str
+    status: str
+    references: list[str]
+
+
+def iter_references(fpath: Path) -> Iterator[Reference]:
+    for section, fields in URI_FIELDS.items():
+        for key, entry in iter_export_entries(fpath, section):
+            for field in fields:
+                if entry.get(field):
+                    yield Reference(section, key, field, entry[field])
+            for link in entry.get("links") or []:
+                yield Reference(section, key, f"links.{link['name']}", link["url"])
+
+
+def link_target(uri: str) -> str:
+    """The URI whose existence a link depends on: for viewer links, the
+    image they load, otherwise the URI itself."""
+
+    query = parse_qs(urlsplit(uri).query)
+    for param in VIEWER_SOURCE_PARAMS:
+        if query.get(param):
+            return query[param][0]
+
+    return uri
+
+
+def is_zarr(uri: str) -> bool:
+    """Whether uri is (in) an OME-Zarr, a prefix of objects rather than an
+    object."""
+
+    return ".zarr" in uri
+
+
+class Listing:
+    """Sorted keys under a prefix, for existence checks of objects and of
+    prefixes."""
+
+    def __init__(self, keys: list[str]):
+        self.keys = sorted(keys)
+
+    def __contains__(self, key: str) -> bool:
+        i = bisect.bisect_left(self.keys, key)
+        return i < len(self.keys) and self.keys[i] == key
+
+    def has_prefix(self, prefix: str) -> bool:
+        i = bisect.bisect_left(self.keys, prefix)
+        return i < len(self.keys) and self.keys[i].startswith(prefix)
+
+
+def list_prefix(bucket: S3Bucket, prefix: str) -> Listing | None:
+    keys = []
+    for key in bucket.list(prefix):
+        if len(keys) >= settings.link_check_max_keys:
+            logger.info(f"{prefix} has too many objects to list, requesting each")
+            return None
+        keys.append(key)
+
+    return Listing(keys)
+
+
+def exists_in_listing(listing: Listing, key: str, zarr: bool) -> bool:
+    if zarr:
+        return listing.has_prefix(key.rstrip("/") + "/")
+
+    return key in listing
+
+
+def head_status(session: requests.Session, uri: str) -> str | None:
+    """None if uri exists, otherwise why not."""
+
+    try:
+        response = session.head(uri, allow_redirects=True, timeout=30)
+        if response.status_code in (403, 405, 501):
+            # Some servers refuse HEAD, so ask for the start of the body
+            response = session.get(uri, stream=True, timeout=30)
+            response.close()
+    except requests.RequestException as e:
+        return type(e).__name__
+
+    if response.status_code >= 400:
+        return str(response.status_code)
+
+    return None
+
+
+def check_uri(session: requests.Session, uri: str) -> str | None:
+    if is_zarr(uri):
+        # An OME-Zarr exists if its root metadata does, in either format
+        uri = uri.rstrip("/")
+        status = head_status(session, f"{uri}/.zattrs")
+        if status is not None and head_status(session, f"{uri}/zarr.json") is None:
+            return None
+        return status
+
+    return head_status(session, uri)
+
+
+def _new_session(pool_size: int) -> requests.Session:
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(
+        pool_connections=pool_size, pool_maxsize=pool_size
+    )
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+
+    return session
+
+
+def check_targets(
+    targets: set[str], bucket: S3Bucket | None = None
+) -> dict[str, str]:
+    """Check that targets exist. Returns a status for each missing target."""
+
+    bucket = bucket or default_bucket()
+    by_prefix = defaultdict(list)
+    to_request = []
+    for target in targets:
+        if target.startswith(bucket.base_uri):
+            key = target.removeprefix(bucket.base_uri)
+            by_prefix[key.split("/", 1)[0] + "/"].append((target, key))
+        else:
+            to_request.append(target)
+
+    missing = {}
+    for prefix, prefix_targets in sorted(by_prefix.items()):
+        if len(prefix_targets) < settings.link_check_list_min_uris:
+            to_request.extend(target for target, _ in prefix_targets)
+            continue
+
+        try:
+            listing = list_prefix(bucket, prefix)
+        except requests.RequestException as e:
+            logger.warning(f"Could not list {prefix}, requesting each: {e}")
+            listing = None
+        if listing is None:
+            to_request.extend(target for target, _ in prefix_targets)
+            continue
+
+        for target, key in prefix_targets:
+            if not exists_in_listing(listing, key, is_zarr(key)):
+                missing[target] = "not listed"
+
+    workers = settings.link_check_workers
+    session = _new_session(workers)
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        statuses = executor.map(partial(check_uri, session), to_request)
+        for target, status in zip(to_request, statuses):
+            if status is not None:
+                missing[target] = status
+
+    return missing
+
+
+def check_export_links(
+    fpath: Path, bucket: S3Bucket | None = None
+) -> tuple[int, list[MissingTarget]]:
+    """Check the targets of every URI referenced by the export at fpath.
+    Returns the number of references checked, and the missing targets with
+    the references to each."""
+
+    references_by_target = defaultdict(list)
+    n_references = 0
+    for reference in iter_references(fpath):
+        n_references += 1
+        references_by_target[link_target(reference.uri)].append(
+            f"{reference.section}/{reference.key}/{reference.field}"
+        )
+    logger.info(
+        f"Checking {len(references_by_target)} targets of {n_references} links"
+    )
+
+    missing = check_targets(set(references_by_target), bucket)
+
+    return n_references, [
+        MissingTarget(
+            target=target, status=status, references=references_by_target[target]
+        )
+        for target, status in sorted(missing.items())
+    ]
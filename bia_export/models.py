@@ -11,6 +11,15 @@ class ExportCollection(BaseModel):
     study_uuids: List[str]
 
 
+class ExportChannelStatistics(BaseModel):
+    channel: int
+    label: Optional[str] = None
+    min: float
+    max: float
+    mean: float
+    percentiles: Dict[str, float] = {}
+
+
 class ExportImage(BaseModel):
     uuid: str
     name: str
@@ -60,6 +69,8 @@ class ExportImage(BaseModel):
 
     attributes: Dict[str, str | None]
 
+    channel_statistics: Optional[List[ExportChannelStatistics]] = None
+
 
 class Link(BaseModel):
     name: str
@@ -67,6 +78,23 @@ class Link(BaseModel):
     url: str
 
 
+class ExportValueRange(BaseModel):
+    min: float
+    max: float
+
+
+class ExportImageAggregates(BaseModel):
+    n_images: int
+    total_voxels: int
+    # Number of images by order of magnitude of their voxel count, keyed by
+    # the lower bound of the decade, e.g. "1e6" for 1M-10M voxels
+    voxel_count_distribution: Dict[str, int] = {}
+    # Number of images by number of channels
+    channel_counts: Dict[str, int] = {}
+    size_ranges: Dict[str, ExportValueRange] = {}
+    physical_size_ranges: Dict[str, ExportValueRange] = {}
+
+
 class ExportDataset(BaseModel):
     accession_id: str
     title: str
@@ -77,6 +105,7 @@ class ExportDataset(BaseModel):
     n_images: int
     image_uuids: List[str]
     links: List[Link] = []
+    image_aggregates: Optional[ExportImageAggregates] = None
 
 
 class ExportAIDataset(BaseModel):
@@ -94,6 +123,7 @@ class ExportAIDataset(BaseModel):
     n_images: int
     image_uuids: List[str]
     links: List[Link] = []
+    image_aggregates: Optional[ExportImageAggregates] = None
     annfile_uuids: List[str]
     annotation_images: Dict[str, str | None] = {}
     corresponding_source_im_ann_uuids: Dict[str, str | None] = {}
@@ -119,21 +149,36 @@ class ExportSODataset(BaseModel):
     models_uri: Optional[str] = None
     image_uuids: List[str]
     links: List[Link] = []
+    image_aggregates: Optional[ExportImageAggregates] = None
+
+
+class ExportShard(BaseModel):
+    index: int
+    count: int
 
 
 class Exports(BaseModel):
     collections: Dict[str, ExportCollection] = {}
     images: Dict[str, ExportImage]
     datasets: Dict[str, ExportDataset] = {}
+    shard: Optional[ExportShard] = None
+    # Fields images were limited to by --image-fields, if they were
+    image_fields: Optional[List[str]] = None
 
 
 class AIExports(BaseModel):
     collections: Dict[str, ExportCollection] = {}
     images: Dict[str, ExportImage]
     datasets: Dict[str, ExportAIDataset]
+    shard: Optional[ExportShard] = None
+    # Fields images were limited to by --image-fields, if they were
+    image_fields: Optional[List[str]] = None
 
 
 class SOExports(BaseModel):
     collections: Dict[str, ExportCollection] = {}
     images: Dict[str, ExportImage]
     datasets: Dict[str, ExportSODataset]
+    shard: Optional[ExportShard] = None
+    # Fields images were limited to by --image-fields, if they were
+    image_fields: Optional[List[str]] = None
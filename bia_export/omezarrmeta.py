@@ -1,6 +1,6 @@
-from typing import List, Optional
+from typing import Dict, List, Optional
 
-from pydantic import BaseModel
+from pydantic import BaseModel, PrivateAttr
 
 
 class RDefs(BaseModel):
@@ -54,7 +54,7 @@ class Axis(BaseModel):
 
 class MultiScaleImage(BaseModel):
     datasets: List[DataSet]
-    metadata: MSMetadata
+    metadata: Optional[MSMetadata]
     axes: Optional[List[Axis]]
     version: str
 
@@ -62,3 +62,85 @@ class MultiScaleImage(BaseModel):
 class ZMeta(BaseModel):
     omero: Optional[Omero]
     multiscales: List[MultiScaleImage]
+
+    _axis_index: Optional["AxisIndex"] = PrivateAttr(None)
+
+    @property
+    def axis_index(self) -> "AxisIndex":
+        """Axis index of the first multiscale image, built on first access."""
+
+        if self._axis_index is None:
+            self._axis_index = AxisIndex(self.multiscales[0])
+
+        return self._axis_index
+
+
+# Axis names in the order used by NGFF versions which did not record axes
+DEFAULT_AXIS_NAMES = "tczyx"
+DEFAULT_AXIS_TYPES = {"t": "time", "c": "channel", "z": "space", "y": "space", "x": "space"}
+
+
+class AxisIndex:
+    """Precomputed lookup of the axes of a multiscale image, mapping each axis
+    name to its position, unit and type, together with the scale vector of
+    every pyramid level. Supports any axis order and dimensionality."""
+
+    def __init__(self, multiscale: MultiScaleImage):
+        self.paths: List[str] = [ds.path for ds in multiscale.datasets]
+        self.level_scales: List[List[float]] = [
+            next(
+                (
+                    ct.scale
+                    for ct in ds.coordinateTransformations or []
+                    if ct.type == "scale"
+                ),
+                None,
+            )
+            for ds in multiscale.datasets
+        ]
+
+        if multiscale.axes:
+            axes = multiscale.axes
+        else:
+            ndim = len(self.level_scales[0] or DEFAULT_AXIS_NAMES)
+            axes = [
+                Axis(name=name, type=DEFAULT_AXIS_TYPES[name])
+                for name in DEFAULT_AXIS_NAMES[-ndim:]
+            ]
+
+        self.axes: Dict[str, Axis] = {axis.name: axis for axis in axes}
+        self.positions: Dict[str, int] = {
+            axis.name: n for n, axis in enumerate(axes)
+        }
+        self.ndim = len(axes)
+        self.level_scales = [
+            scale if scale is not None else [1.0] * self.ndim
+            for scale in self.level_scales
+        ]
+
+    @property
+    def n_levels(self) -> int:
+        return len(self.paths)
+
+    def position(self, name: str) -> Optional[int]:
+        return self.positions.get(name)
+
+    def scale(self, name: str, level: int = 0) -> float:
+        """Scale of the named axis at the given pyramid level, 1.0 if the image
+        does not have that axis."""
+
+        position = self.positions.get(name)
+        if position is None:
+            return 1.0
+
+        return self.level_scales[level][position]
+
+    def size(self, name: str, shape) -> int:
+        """Size of the named axis in an array of the given shape, 1 if the image
+        does not have that axis."""
+
+        position = self.positions.get(name)
+        if position is None:
+            return 1
+
+        return shape[position]
@@ -0,0 +1,139 @@
+"""Atomic, content-hashed writing of output files.
+
+Outputs are written to a temporary file next to their destination while
+their SHA-256 is computed, then renamed over the destination, unless the
+destination already has the same content, in which case it is left
+untouched (keeping its modification time, so CDNs and downstream builds see
+no change). Each output written is recorded, and write_manifest lists the
+hashes and sizes of the outputs of a run in a manifest.json."""
+
+import hashlib
+import logging
+import os
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, Iterator, Optional
+
+from pydantic import BaseModel
+
+logger = logging.getLogger(__name__)
+
+
+MANIFEST_FNAME = "manifest.json"
+
+HASH_READ_SIZE = 2**20
+
+
+class OutputRecord(BaseModel):
+    sha256: str
+    size: int
+    shard: Optional[str] = None
+
+
+class OutputManifest(BaseModel):
+    outputs: Dict[str, OutputRecord] = {}
+
+
+# Outputs written by this process since the last manifest was written
+recorded_outputs: dict[Path, OutputRecord] = {}
+
+
+class HashingWriter:
+    """Text file wrapper which encodes what is written as UTF-8, keeping a
+    running SHA-256 and size of the bytes written."""
+
+    def __init__(self, fh):
+        self.fh = fh
+        self.sha256 = hashlib.sha256()
+        self.size = 0
+
+    def write(self, text: str):
+        data = text.encode()
+        self.sha256.update(data)
+        self.size += len(data)
+        self.fh.write(data)
+
+
+def hash_file(fpath: Path) -> tuple[str, int]:
+    sha256 = hashlib.sha256()
+    size = 0
+    with open(fpath, "rb") as fh:
+        while data := fh.read(HASH_READ_SIZE):
+            sha256.update(data)
+            size += len(data)
+
+    return sha256.hexdigest(), size
+
+
+def _tmp_fpath(fpath: Path) -> Path:
+    return fpath.with_name(f".{fpath.name}.{os.getpid()}.tmp")
+
+
+def _commit(tmp_fpath: Path, fpath: Path, sha256: str, size: int) -> bool:
+    """Move tmp_fpath to fpath unless fpath already has this content. Returns
+    whether fpath was replaced."""
+
+    recorded_outputs[fpath] = OutputRecord(sha256=sha256, size=size)
+
+    if fpath.exists() and fpath.stat().st_size == size:
+        if hash_file(fpath)[0] == sha256:
+            logger.info(f"{fpath} is unchanged")
+            return False
+
+    os.replace(tmp_fpath, fpath)
+
+    return True
+
+
+@contextmanager
+def atomic_output(fpath: Path) -> Iterator[HashingWriter]:
+    """Open fpath for writing text, atomically and only if changed."""
+
+    fpath.parent.mkdir(exist_ok=True, parents=True)
+    tmp_fpath = _tmp_fpath(fpath)
+    try:
+        with open(tmp_fpath, "wb") as fh:
+            writer = HashingWriter(fh)
+            yield writer
+        _commit(tmp_fpath, fpath, writer.sha256.hexdigest(), writer.size)
+    finally:
+        tmp_fpath.unlink(missing_ok=True)
+
+
+@contextmanager
+def atomic_output_path(fpath: Path) -> Iterator[Path]:
+    """Like atomic_output, for libraries which write to a path themselves.
+    Yields the temporary path to write to."""
+
+    fpath.parent.mkdir(exist_ok=True, parents=True)
+    tmp_fpath = _tmp_fpath(fpath)
+    try:
+        yield tmp_fpath
+        _commit(tmp_fpath, fpath, *hash_file(tmp_fpath))
+    finally:
+        tmp_fpath.unlink(missing_ok=True)
+
+
+def write_manifest(dirpath: Path, shard: str | None = None) -> Path:
+    """Add the outputs recorded since the last call to the manifest in
+    dirpath, keyed by path relative to dirpath, with shard (e.g. "0/4") if
+    they are the outputs of a sharded run."""
+
+    manifest_fpath = dirpath / MANIFEST_FNAME
+    manifest = OutputManifest()
+    if manifest_fpath.exists():
+        manifest = OutputManifest.parse_file(manifest_fpath)
+
+    for fpath, record in recorded_outputs.items():
+        if fpath.resolve() == manifest_fpath.resolve():
+            continue
+        record.shard = shard
+        manifest.outputs[os.path.relpath(fpath, dirpath)] = record
+    recorded_outputs.clear()
+
+    manifest.outputs = dict(sorted(manifest.outputs.items()))
+    with atomic_output(manifest_fpath) as fh:
+        fh.write(manifest.json(indent=2, sort_keys=True))
+    recorded_outputs.pop(manifest_fpath, None)
+
+    return manifest_fpath
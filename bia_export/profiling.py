@@ -0,0 +1,180 @@
+"""Built-in CPU and memory profiling of export runs.
+
+A sampling profiler records the stack of every thread at a fixed interval,
+attributing each sample to the study the thread is exporting, and writes
+collapsed stacks which flamegraph.pl, speedscope or inferno can render.
+On request, tracemalloc records allocations too, reported as the top
+allocation sites overall and the top growth in allocations while every
+settings.profile_memory_study_interval-th study was exported. Tracing
+allocations slows every allocation, so timings are only representative
+without it."""
+
+import linecache
+import logging
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter
+from itertools import count
+from contextlib import contextmanager, nullcontext
+from pathlib import Path
+
+from .config import settings
+
+logger = logging.getLogger(__name__)
+
+
+# Allocations made by the profiler, tracemalloc or the import system are noise
+TRACEMALLOC_FILTERS = [
+    tracemalloc.Filter(False, __file__),
+    tracemalloc.Filter(False, tracemalloc.__file__),
+    tracemalloc.Filter(False, linecache.__file__),
+    tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+    tracemalloc.Filter(False, "<frozen importlib._bootstrap_external>"),
+]
+
+
+def collapse_stack(frame) -> str:
+    """Format a frame's stack, outermost first, as module:function names
+    joined by semicolons."""
+
+    names = []
+    while frame is not None:
+        module = frame.f_globals.get("__name__", "?")
+        names.append(f"{module}:{frame.f_code.co_name}")
+        frame = frame.f_back
+
+    return ";".join(reversed(names))
+
+
+class Profiler:
+    def __init__(
+        self,
+        interval: float | None = None,
+        top_n: int | None = None,
+        memory: bool = False,
+        memory_study_interval: int | None = None,
+    ):
+        self.interval = interval or settings.profile_sample_interval
+        self.top_n = top_n or settings.profile_top_n
+        self.memory = memory
+        self.memory_study_interval = (
+            memory_study_interval or settings.profile_memory_study_interval
+        )
+        self.stacks = Counter()
+        self.study_allocations: dict[str, list[str]] = {}
+        self._labels: dict[int, str] = {}
+        self._stop = threading.Event()
+        self._thread = None
+        self._started_at = None
+        self._study_counter = count()
+
+    def start(self):
+        if self.memory:
+            tracemalloc.start()
+        self._started_at = time.perf_counter()
+        self._thread = threading.Thread(target=self._sample, name="profiler", daemon=True)
+        self._thread.start()
+
+    def _sample(self):
+        own_ident = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            for ident, frame in sys._current_frames().items():
+                if ident == own_ident:
+                    continue
+                label = self._labels.get(ident, "main")
+                self.stacks[f"{label};{collapse_stack(frame)}"] += 1
+
+    def _snapshot(self) -> tracemalloc.Snapshot:
+        return tracemalloc.take_snapshot().filter_traces(TRACEMALLOC_FILTERS)
+
+    @contextmanager
+    def study(self, accession_id: str):
+        """Attribute samples from the calling thread, and when profiling memory
+        and the study is sampled, the allocations made while the block runs,
+        to accession_id. With more than one worker, allocations by
+        concurrently exported studies are included too."""
+
+        ident = threading.get_ident()
+        self._labels[ident] = accession_id
+        before = None
+        if self.memory and next(self._study_counter) % self.memory_study_interval == 0:
+            before = self._snapshot()
+        try:
+            yield
+        finally:
+            if before is not None:
+                after = self._snapshot()
+                self.study_allocations[accession_id] = [
+                    str(stat)
+                    for stat in after.compare_to(before, "lineno")[: self.top_n]
+                    if stat.size_diff > 0
+                ]
+            del self._labels[ident]
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def write(self, dirpath: Path):
+        """Write stacks.collapsed, and when profiling memory allocations.txt,
+        to dirpath."""
+
+        dirpath.mkdir(exist_ok=True, parents=True)
+
+        with open(dirpath / "stacks.collapsed", "w") as fh:
+            for stack, n_samples in sorted(self.stacks.items()):
+                fh.write(f"{stack} {n_samples}\n")
+
+        logger.info(f"Wrote {sum(self.stacks.values())} stack samples to {dirpath}")
+        if self.memory:
+            self._write_allocations(dirpath)
+
+    def _write_allocations(self, dirpath: Path):
+        current, peak = tracemalloc.get_traced_memory()
+        top_stats = self._snapshot().statistics("lineno")[: self.top_n]
+        elapsed = time.perf_counter() - self._started_at
+
+        with open(dirpath / "allocations.txt", "w") as fh:
+            fh.write(f"Profiled for {elapsed:.1f}s\n")
+            fh.write(f"Traced memory: {current} bytes, peak {peak} bytes\n\n")
+            fh.write(f"Top {self.top_n} allocation sites at exit\n")
+            for stat in top_stats:
+                fh.write(f"  {stat}\n")
+            for accession_id, stats in sorted(self.study_allocations.items()):
+                fh.write(f"\nTop allocation growth while exporting {accession_id}\n")
+                for stat in stats:
+                    fh.write(f"  {stat}\n")
+
+        tracemalloc.stop()
+        logger.info(f"Wrote allocation report to {dirpath}")
+
+
+# The profiler of this run, if profiling was requested
+active_profiler: Profiler | None = None
+
+
+def start_profiling(memory: bool = False) -> Profiler:
+    global active_profiler
+    active_profiler = Profiler(memory=memory)
+    active_profiler.start()
+
+    return active_profiler
+
+
+def stop_profiling(dirpath: Path):
+    global active_profiler
+    active_profiler.stop()
+    active_profiler.write(dirpath)
+    active_profiler = None
+
+
+def profile_study(accession_id: str):
+    """Context manager attributing profiling data to a study, which does
+    nothing when not profiling."""
+
+    if active_profiler is None:
+        return nullcontext()
+
+    return active_profiler.study(accession_id)
@@ -0,0 +1,129 @@
+"""Projection of image exports onto a subset of ExportImage fields.
+
+Most ExportImage fields come from the image and its study, which are
+fetched anyway. The rest need further upstream reads per image: the image
+acquisition, specimen and biosample from the API, and the OME-Zarr probe
+for sizes. An export which only asks for some fields makes only the reads
+those fields need.
+
+The fields are recorded in the export's image_fields, so that verification
+checks projected images against a model of those fields alone, and diffs
+compare only the fields both exports have."""
+
+from functools import lru_cache
+from typing import Type
+
+from pydantic import BaseModel, create_model
+
+from .models import ExportImage
+
+# Named sets of fields, for --image-fields
+IMAGE_FIELD_PROFILES = {
+    "light": [
+        "uuid",
+        "name",
+        "study_accession_id",
+        "thumbnail_uri",
+        "sizeX",
+        "sizeY",
+        "sizeZ",
+        "sizeC",
+        "sizeT",
+    ],
+    "listing": ["uuid", "name", "study_accession_id", "thumbnail_uri", "vizarr_uri"],
+}
+
+# Upstream sources of fields beyond the image and study, by field prefix
+SOURCE_FIELD_PREFIXES = {
+    "image_acquisitions": "image_acquisition_",
+    "specimens": "specimen_",
+    "biosamples": "biosample_",
+}
+OME_ZARR_FIELDS = [
+    "sizeX",
+    "sizeY",
+    "sizeZ",
+    "sizeC",
+    "sizeT",
+    "PhysicalSizeX",
+    "PhysicalSizeY",
+    "PhysicalSizeZ",
+]
+ALL_SOURCES = frozenset([*SOURCE_FIELD_PREFIXES, "ome_zarr"])
+
+# Sources which are only reached through others
+SOURCE_DEPENDENCIES = {
+    "specimens": ["image_acquisitions"],
+    "biosamples": ["specimens"],
+}
+
+
+def parse_image_fields(spec: str) -> frozenset[str]:
+    """Parse a profile name, or a comma separated list of ExportImage fields."""
+
+    if spec in IMAGE_FIELD_PROFILES:
+        return frozenset(IMAGE_FIELD_PROFILES[spec])
+
+    fields = frozenset(field.strip() for field in spec.split(",") if field.strip())
+    unknown = fields - ExportImage.__fields__.keys()
+    if unknown or not fields:
+        raise ValueError(
+            f"Unknown image fields {', '.join(sorted(unknown)) or spec!r}; give "
+            f"fields of ExportImage or one of {', '.join(IMAGE_FIELD_PROFILES)}"
+        )
+
+    return fields
+
+
+def required_sources(fields: frozenset[str] | None) -> frozenset[str]:
+    """The upstream sources needed for fields, all of them if fields is
+    None."""
+
+    if fields is None:
+        return ALL_SOURCES
+
+    sources = {
+        source
+        for source, prefix in SOURCE_FIELD_PREFIXES.items()
+        if any(field.startswith(prefix) for field in fields)
+    }
+    if fields & set(OME_ZARR_FIELDS):
+        sources.add("ome_zarr")
+
+    for source in list(sources):
+        stack = [source]
+        while stack:
+            for dependency in SOURCE_DEPENDENCIES.get(stack.pop(), []):
+                sources.add(dependency)
+                stack.append(dependency)
+
+    return frozenset(sources)
+
+
+@lru_cache(maxsize=None)
+def projected_image_model(fields: frozenset[str]) -> Type[BaseModel]:
+    """A model of images projected onto fields, with the types and defaults
+    ExportImage has for them."""
+
+    return create_model(
+        "ProjectedExportImage",
+        **{
+            name: (field.annotation, field.field_info)
+            for name, field in ExportImage.__fields__.items()
+            if name in fields
+        },
+    )
+
+
+def common_image_fields(
+    old_fields: list[str] | None, new_fields: list[str] | None
+) -> frozenset[str] | None:
+    """The image fields which two exports both have, given their
+    image_fields, or None if neither is projected."""
+
+    if old_fields is None and new_fields is None:
+        return None
+    if old_fields is None or new_fields is None:
+        return frozenset(old_fields or new_fields)
+
+    return frozenset(old_fields) & frozenset(new_fields)
@@ -1,12 +1,17 @@
 """BIA Proxy image classes + functionality to enable determination of
 image properties."""
 
-from typing import Optional, List
+import json
+from contextlib import contextmanager
+from typing import Callable, Optional, List
 
+import fsspec
 import zarr
 from pydantic import BaseModel
 
 from .omezarrmeta import ZMeta, DataSet, CoordinateTransformation
+from .concurrency import zarr_limiter
+from .singleflight import SingleFlight
 
 
 class OMEZarrImage(BaseModel):
@@ -22,6 +27,12 @@ class OMEZarrImage(BaseModel):
     z_scaling: float = 1.0
     path_keys: List[str] = []
 
+    # Storage geometry of the full resolution array. For sharded (Zarr v3)
+    # arrays, chunks are the inner chunks, read individually from shards
+    zarr_format: int = 2
+    chunk_shape: List[int] = []
+    shard_shape: Optional[List[int]] = None
+
     PhysicalSizeX: Optional[float] = None
     PhysicalSizeY: Optional[float] = None
     PhysicalSizeZ: Optional[float] = None
@@ -75,54 +86,190 @@ AXIS_NAME_LOOKUP = {"x": "PhysicalSizeX", "y": "PhysicalSizeY", "z": "PhysicalSi
 
 def calculate_voxel_to_physical_factors(ngff_metadata, ignore_unit_errors=False):
     """Given ngff_metadata, calculate the voxel to physical space scale factors
-    in m for each spatial dimension.
-
-    NOTE: Makes a lot of assumptions about ordering of multiscales, datasets and transforms.
-    """
+    in m for each spatial dimension present in the image, at full resolution."""
 
-    scale_transformations = [
-        ct
-        for ct in ngff_metadata.multiscales[0].datasets[0].coordinateTransformations
-        if ct.type == "scale"
-    ]
+    axis_index = ngff_metadata.axis_index
 
     factors = {}
 
-    for scale, axis in zip(
-        scale_transformations[0].scale, ngff_metadata.multiscales[0].axes
-    ):
-        if axis.type == "space":
-            attribute_name = AXIS_NAME_LOOKUP[axis.name]
-            unit_multiplier = UNIT_LOOKUP.get(axis.unit, None)
-            if unit_multiplier is not None:
-                attribute_value = scale * unit_multiplier
-                factors[attribute_name] = attribute_value
-            else:
-                if not ignore_unit_errors:
-                    raise Exception(f"Don't know unit {axis.unit}")
+    for axis_name, attribute_name in AXIS_NAME_LOOKUP.items():
+        axis = axis_index.axes.get(axis_name)
+        if axis is None or axis.type != "space":
+            continue
+
+        unit_multiplier = UNIT_LOOKUP.get(axis.unit, None)
+        if unit_multiplier is not None:
+            factors[attribute_name] = axis_index.scale(axis_name) * unit_multiplier
+        else:
+            if not ignore_unit_errors:
+                raise Exception(f"Don't know unit {axis.unit}")
 
     return factors
 
 
+def read_ome_zarr_metadata(uri: str) -> dict:
+    """Read the metadata needed to describe an OME Zarr image: the attributes
+    of its root group, and the geometry of its full resolution array.
+
+    Zarr v3 stores (OME-Zarr 0.5) are read from the zarr.json documents of
+    the root group and the array, two requests in all. Otherwise the store
+    is read as Zarr v2 (OME-Zarr 0.4 and earlier)."""
+
+    store = fsspec.get_mapper(uri)
+    try:
+        root = json.loads(store["zarr.json"])
+    except (KeyError, FileNotFoundError, PermissionError):
+        # S3 answers for a missing key with 403 rather than 404 when the
+        # reader may not list the bucket
+        return read_zarr_v2_metadata(uri)
+
+    return read_zarr_v3_metadata(store, root)
+
+
+def read_zarr_v2_metadata(uri: str) -> dict:
+    zgroup = zarr.open(uri)
+    attrs = zgroup.attrs.asdict()
+    path = ZMeta.parse_obj(attrs).axis_index.paths[0]
+    zarray = zgroup[path]
+
+    return {
+        "zarr_format": 2,
+        "attrs": attrs,
+        "arrays": {
+            path: {
+                "shape": list(zarray.shape),
+                "chunks": list(zarray.chunks),
+                "dtype": str(zarray.dtype),
+            }
+        },
+    }
+
+
+def ngff_attrs_from_zarr_v3(attributes: dict) -> dict:
+    """OME-Zarr 0.5 keeps its metadata under an "ome" key, with the version
+    there rather than in each multiscale. Rearrange it into the 0.4 layout
+    modelled by ZMeta."""
+
+    ome = dict(attributes.get("ome", attributes))
+    version = ome.pop("version", None)
+    ome["multiscales"] = [
+        {"version": version, **multiscale} for multiscale in ome["multiscales"]
+    ]
+
+    return ome
+
+
+def zarr_v3_array_geometry(array_meta: dict) -> dict:
+    """Shape, chunk and shard shapes, and dtype of a Zarr v3 array, from its
+    zarr.json alone. Sharded arrays have a grid of shards, each holding a
+    grid of inner chunks declared by the sharding codec, so no shard index
+    needs to be read."""
+
+    chunks = array_meta["chunk_grid"]["configuration"]["chunk_shape"]
+    shards = None
+    for codec in array_meta.get("codecs", []):
+        if codec["name"] == "sharding_indexed":
+            shards = chunks
+            chunks = codec["configuration"]["chunk_shape"]
+
+    return {
+        "shape": list(array_meta["shape"]),
+        "chunks": list(chunks),
+        "shards": list(shards) if shards else None,
+        "dtype": array_meta["data_type"],
+    }
+
+
+def read_zarr_v3_metadata(store, root: dict) -> dict:
+    if root.get("node_type") != "group":
+        raise ValueError("OME Zarr root is not a group")
+
+    attrs = ngff_attrs_from_zarr_v3(root.get("attributes", {}))
+    path = ZMeta.parse_obj(attrs).axis_index.paths[0]
+    array_meta = json.loads(store[f"{path}/zarr.json"])
+
+    return {
+        "zarr_format": 3,
+        "attrs": attrs,
+        "arrays": {path: zarr_v3_array_geometry(array_meta)},
+    }
+
+
+# Source of OME Zarr metadata for probes, replaced when exporting offline from
+# a snapshot
+ome_zarr_metadata_reader: Callable[[str], dict] = read_ome_zarr_metadata
+
+
+def set_ome_zarr_metadata_reader(reader: Callable[[str], dict]):
+    global ome_zarr_metadata_reader
+    ome_zarr_metadata_reader = reader
+
+
+# Metadata read ahead of probes, e.g. by bulk probing of a study, each used
+# by the next probe of its URI in place of a read
+primed_metadata: dict[str, dict] = {}
+
+
+@contextmanager
+def primed_ome_zarr_metadata(metadata_by_uri: dict[str, dict]):
+    """Prime probes with metadata_by_uri while the block runs. Entries left
+    unused, e.g. those of images which failed before being probed, are then
+    dropped."""
+
+    primed_metadata.update(metadata_by_uri)
+    try:
+        yield
+    finally:
+        for uri in metadata_by_uri:
+            primed_metadata.pop(uri, None)
+
+
+# Concurrent probes of the same URI share one read
+probe_single_flight = SingleFlight()
+
+
 def ome_zarr_image_from_ome_zarr_uri(uri, ignore_unit_errors=False):
     """Generate a OME Zarr image object by reading an OME Zarr and
-    parsing the NGFF metadata for properties. Makes many assumptions
-    about ordering of multiscales data."""
+    parsing the NGFF metadata for properties. Uses the first multiscale
+    image, with any axis order and dimensionality."""
+
+    return probe_single_flight.do(
+        (uri, ignore_unit_errors),
+        _ome_zarr_image_from_ome_zarr_uri,
+        uri,
+        ignore_unit_errors,
+    )
 
-    zgroup = zarr.open(uri)
-    ngff_metadata = ZMeta.parse_obj(zgroup.attrs.asdict())
 
-    path_key = ngff_metadata.multiscales[0].datasets[0].path
-    zarray = zgroup[path_key]
-    tdim, cdim, zdim, ydim, xdim = zarray.shape
+def _ome_zarr_image_from_ome_zarr_uri(uri, ignore_unit_errors):
+    metadata = primed_metadata.pop(uri, None)
+    if metadata is None:
+        metadata = zarr_limiter.call(ome_zarr_metadata_reader, uri)
+
+    return ome_zarr_image_from_metadata(metadata, ignore_unit_errors)
+
+
+def ome_zarr_image_from_metadata(metadata: dict, ignore_unit_errors=False):
+    """Generate a OME Zarr image object from metadata in the form returned by
+    read_ome_zarr_metadata."""
+
+    ngff_metadata = ZMeta.parse_obj(metadata["attrs"])
+    axis_index = ngff_metadata.axis_index
+
+    array = metadata["arrays"][axis_index.paths[0]]
+    shape = array["shape"]
 
     ome_zarr_image = OMEZarrImage(
-        sizeX=xdim,
-        sizeY=ydim,
-        sizeZ=zdim,
-        sizeC=cdim,
-        sizeT=tdim,
-        path_keys=[ds.path for ds in ngff_metadata.multiscales[0].datasets],
+        sizeX=axis_index.size("x", shape),
+        sizeY=axis_index.size("y", shape),
+        sizeZ=axis_index.size("z", shape),
+        sizeC=axis_index.size("c", shape),
+        sizeT=axis_index.size("t", shape),
+        path_keys=axis_index.paths,
+        # Metadata read before Zarr v3 support, e.g. in snapshots, is v2
+        zarr_format=metadata.get("zarr_format", 2),
+        chunk_shape=array.get("chunks", []),
+        shard_shape=array.get("shards"),
     )
 
     scale_factors = scales_from_ngff_metadata(ngff_metadata)
@@ -140,24 +287,19 @@ def scales_from_ngff_metadata(ngff_metadata):
     """Derive numbers of multiscales and xy/z scaling factors from NGFF metadata.
     Assumes all scaling factors are equal."""
 
-    n_scales = len(ngff_metadata.multiscales[0].datasets)
+    axis_index = ngff_metadata.axis_index
+
+    n_scales = axis_index.n_levels
 
     scale_factors = {"n_scales": n_scales}
 
     if n_scales > 1:
-        _, _, zscale0, yscale0, xscale0 = (
-            ngff_metadata.multiscales[0].datasets[0].coordinateTransformations[0].scale
-        )
-        _, _, zscale1, yscale1, xscale1 = (
-            ngff_metadata.multiscales[0].datasets[1].coordinateTransformations[0].scale
-        )
-
-        yscaling = yscale1 / yscale0
-        xscaling = xscale1 / xscale0
+        yscaling = axis_index.scale("y", 1) / axis_index.scale("y", 0)
+        xscaling = axis_index.scale("x", 1) / axis_index.scale("x", 0)
         assert xscaling == yscaling, "Different X and Y scaling is not well handled"
 
         scale_factors["xy_scaling"] = xscaling
-        scale_factors["z_scaling"] = zscale1 / zscale0
+        scale_factors["z_scaling"] = axis_index.scale("z", 1) / axis_index.scale("z", 0)
 
     return scale_factors
 
@@ -167,15 +309,18 @@ def bia_raster_image_from_ome_zarr_uri(uri):
     parsing the NGFF metadata for properties. Makes many assumptions
     about ordering of multiscales data."""
 
-    zgroup = zarr.open(uri)
-    ngff_metadata = ZMeta.parse_obj(zgroup.attrs.asdict())
+    metadata = ome_zarr_metadata_reader(uri)
+    ngff_metadata = ZMeta.parse_obj(metadata["attrs"])
+    axis_index = ngff_metadata.axis_index
 
-    path_key = ngff_metadata.multiscales[0].datasets[0].path
-    zarray = zgroup[path_key]
-    tdim, cdim, zdim, ydim, xdim = zarray.shape
+    shape = metadata["arrays"][axis_index.paths[0]]["shape"]
 
     bia_raster_image = BIARasterImage(
-        sizeX=xdim, sizeY=ydim, sizeZ=zdim, sizeC=cdim, sizeT=tdim
+        sizeX=axis_index.size("x", shape),
+        sizeY=axis_index.size("y", shape),
+        sizeZ=axis_index.size("z", shape),
+        sizeC=axis_index.size("c", shape),
+        sizeT=axis_index.size("t", shape),
     )
 
     factors = calculate_voxel_to_physical_factors(ngff_metadata)
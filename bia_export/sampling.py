@@ -0,0 +1,152 @@
+"""Deterministic sampling of representative images from paginated listings.
+
+Each image is given a priority from a hash of the seed and its UUID, and a
+sample is the images with the lowest priorities. This is a reservoir sample
+which needs one pass over the listing and memory for only the sample, and
+which depends only on the seed and the set of images, not the order they are
+listed in, so adding images to a study only changes its sample if a new image
+displaces one.
+
+Samples can also be stratified, by the size of the images or the value of an
+attribute, so that each stratum is represented roughly in proportion to its
+number of images, and at least once while the sample size allows."""
+
+import hashlib
+import heapq
+import math
+from typing import Callable, Hashable, Iterable
+
+from bia_integrator_api import models as api_models
+
+Stratum = Callable[[api_models.BIAImage], Hashable]
+
+
+def image_priority(seed: int, image_uuid: str) -> int:
+    digest = hashlib.sha1(f"{seed}:{image_uuid}".encode()).digest()
+    return int.from_bytes(digest[:8], "big")
+
+
+class ReservoirSampler:
+    """Keeps the n images with the lowest priorities of those offered."""
+
+    def __init__(self, n: int, seed: int = 0):
+        self.n = n
+        self.seed = seed
+        self.n_offered = 0
+        # Max-heap on priority, by negation, so the worst kept image is first
+        self._heap: list[tuple[int, str, api_models.BIAImage]] = []
+
+    def offer(self, image: api_models.BIAImage):
+        self.n_offered += 1
+        if self.n <= 0:
+            return
+
+        entry = (-image_priority(self.seed, image.uuid), image.uuid, image)
+        if len(self._heap) < self.n:
+            heapq.heappush(self._heap, entry)
+        elif entry[:2] > self._heap[0][:2]:
+            heapq.heapreplace(self._heap, entry)
+
+    def sample(self, n: int | None = None) -> list[api_models.BIAImage]:
+        """The sampled images, lowest priority first, optionally only the
+        first n."""
+
+        ranked = sorted(self._heap, key=lambda entry: entry[:2], reverse=True)
+        return [image for _, _, image in ranked[:n]]
+
+
+def allocate(n: int, counts: dict[Hashable, int]) -> dict[Hashable, int]:
+    """Split a sample of n between strata with the given numbers of images:
+    one each, largest strata first, then in proportion to their numbers of
+    images by highest averages, never more than a stratum has."""
+
+    strata = sorted(counts, key=lambda stratum: (-counts[stratum], str(stratum)))
+    allocation = {stratum: 0 for stratum in strata}
+    for stratum in strata[:n]:
+        allocation[stratum] = 1
+
+    for _ in range(n - sum(allocation.values())):
+        open_strata = [s for s in strata if allocation[s] < counts[s]]
+        if not open_strata:
+            break
+        best = max(open_strata, key=lambda s: counts[s] / (allocation[s] + 1))
+        allocation[best] += 1
+
+    return allocation
+
+
+class StratifiedSampler:
+    """Reservoir samples per stratum, combined by allocate. Memory is bounded
+    by n times the number of strata."""
+
+    def __init__(self, n: int, stratum: Stratum, seed: int = 0):
+        self.n = n
+        self.stratum = stratum
+        self.seed = seed
+        self.samplers: dict[Hashable, ReservoirSampler] = {}
+
+    def offer(self, image: api_models.BIAImage):
+        key = self.stratum(image)
+        if key not in self.samplers:
+            self.samplers[key] = ReservoirSampler(self.n, self.seed)
+        self.samplers[key].offer(image)
+
+    def sample(self) -> list[api_models.BIAImage]:
+        counts = {key: sampler.n_offered for key, sampler in self.samplers.items()}
+        allocation = allocate(self.n, counts)
+
+        return [
+            image
+            for key, n in allocation.items()
+            for image in self.samplers[key].sample(n)
+        ]
+
+
+def size_stratum(image: api_models.BIAImage) -> Hashable:
+    """Order of magnitude (in powers of 4) of the size of the largest
+    representation of an image, or None if no size is known."""
+
+    size = max((rep.size or 0 for rep in image.representations), default=0)
+    return int(math.log(size, 4)) if size > 0 else None
+
+
+def attribute_stratum(name: str) -> Stratum:
+    def stratum(image: api_models.BIAImage) -> Hashable:
+        return str((image.attributes or {}).get(name))
+
+    return stratum
+
+
+def parse_stratum(spec: str) -> Stratum | None:
+    """Parse a stratification: "" for none, "size", or "attribute:<name>"."""
+
+    if not spec:
+        return None
+    if spec == "size":
+        return size_stratum
+    if spec.startswith("attribute:") and spec.removeprefix("attribute:"):
+        return attribute_stratum(spec.removeprefix("attribute:"))
+
+    raise ValueError(
+        f"Invalid stratification {spec!r}, expected size or attribute:<name>"
+    )
+
+
+def sample_images(
+    images: Iterable[api_models.BIAImage],
+    n: int,
+    seed: int = 0,
+    stratum: Stratum | None = None,
+) -> list[api_models.BIAImage]:
+    """Sample n images in one pass over images, which may be a generator over
+    paginated results. Returns them in UUID order."""
+
+    if stratum is None:
+        sampler = ReservoirSampler(n, seed)
+    else:
+        sampler = StratifiedSampler(n, stratum, seed)
+
+    for image in images:
+        sampler.offer(image)
+
+    return sorted(sampler.sample(), key=lambda image: image.uuid)
@@ -0,0 +1,85 @@
+"""Cost estimates for scheduling studies largest first.
+
+A study's cost is its export time on an earlier run, if one was recorded,
+and otherwise an estimate from its numbers of images and file references.
+Timings are kept per study in the cache, like exported images, and are only
+recorded for runs which converted the study's images rather than reading
+them from the cache, so they estimate the cost of a cold export."""
+
+import logging
+import math
+from datetime import datetime, timezone
+from pathlib import Path
+
+from pydantic import BaseModel
+
+from .config import settings
+from .serialization import read_cache_entry, write_cache_entry
+from .sharding import shard_index_for
+
+logger = logging.getLogger(__name__)
+
+
+class StudyTiming(BaseModel):
+    accession_id: str
+    images_count: int
+    seconds: float
+    recorded_at: str
+
+
+def timings_dirpath() -> Path:
+    return settings.cache_root_dirpath / "study_timings"
+
+
+def get_study_timing(accession_id: str) -> StudyTiming | None:
+    return read_cache_entry(timings_dirpath(), accession_id, StudyTiming)
+
+
+def record_study_timing(accession_id: str, images_count: int, seconds: float):
+    timing = StudyTiming(
+        accession_id=accession_id,
+        images_count=images_count,
+        seconds=seconds,
+        recorded_at=datetime.now(timezone.utc).isoformat(),
+    )
+    write_cache_entry(timings_dirpath(), accession_id, timing)
+
+
+def estimate_study_cost(
+    accession_id: str, images_count: int, file_references_count: int
+) -> float:
+    """Expected export time of a study in seconds."""
+
+    timing = get_study_timing(accession_id)
+    if timing is not None and timing.images_count:
+        # Scale in case the study has gained or lost images since
+        return timing.seconds * images_count / timing.images_count
+
+    return (
+        settings.schedule_study_seconds
+        + images_count * settings.schedule_image_seconds
+        + file_references_count * settings.schedule_file_reference_seconds
+    )
+
+
+def estimate_dataset_cost(file_references_count: int) -> float:
+    """Expected time in seconds to build a study's dataset, the part of its
+    export which does not depend on its images."""
+
+    return (
+        settings.schedule_study_seconds
+        + file_references_count * settings.schedule_file_reference_seconds
+    )
+
+
+def study_work_unit_count(images_count: int) -> int:
+    """Number of work units to split a study's images across, so that no one
+    unit dominates the run."""
+
+    return max(1, math.ceil(images_count / settings.schedule_unit_images_count))
+
+
+def work_unit_owns_image(part: int, n_parts: int, image_uuid: str) -> bool:
+    # Salted, so that units are independent of shard assignment by the same
+    # hash
+    return shard_index_for(f"unit:{image_uuid}", n_parts) == part
@@ -0,0 +1,143 @@
+"""Precomputed search indexes for the static export, so that browser side
+search becomes a lookup rather than a scan over every image.
+
+Three files are written to the index directory:
+
+* facets.json - for images and datasets, facet name -> facet value -> IDs
+* tokens.json - the document table of [kind, ID] pairs, plus token ->
+  postings, where postings are indexes into the document table
+* prefixes.json - prefix -> tokens starting with that prefix
+"""
+
+import json
+import re
+from collections import defaultdict
+from pathlib import Path
+
+from .aggregates import image_voxel_count, voxel_count_decade
+from .models import ExportImage
+from .outputs import atomic_output
+
+
+IMAGE_FACET_FIELDS = {
+    "organism": "biosample_organism_scientific_name",
+    "imaging_method": "image_acquisition_imaging_method",
+    "biological_entity": "biosample_biological_entity",
+    "study": "study_accession_id",
+}
+
+DATASET_FACET_FIELDS = {
+    "organism": "organism",
+    "imaging_type": "imaging_type",
+}
+
+IMAGE_TEXT_FIELDS = [
+    "name",
+    "study_title",
+    "biosample_title",
+    "biosample_description",
+    "specimen_title",
+    "image_acquisition_title",
+]
+
+DATASET_TEXT_FIELDS = ["title", "accession_id"]
+
+PREFIX_LENGTH = 3
+
+STOPWORDS = {
+    "an",
+    "and",
+    "by",
+    "for",
+    "from",
+    "in",
+    "of",
+    "on",
+    "or",
+    "the",
+    "to",
+    "with",
+}
+
+TOKEN_RE = re.compile(r"[a-z0-9]+")
+
+
+def tokenize(text: str | None) -> set[str]:
+    if not text:
+        return set()
+
+    return {
+        token
+        for token in TOKEN_RE.findall(text.lower())
+        if len(token) > 1 and token not in STOPWORDS
+    }
+
+
+class SearchIndexBuilder:
+    """Builds facet and token indexes incrementally from export records."""
+
+    def __init__(self):
+        self.image_facets = defaultdict(lambda: defaultdict(list))
+        self.dataset_facets = defaultdict(lambda: defaultdict(list))
+        self.documents = []
+        self.postings = defaultdict(list)
+
+    def _add_document(self, kind: str, doc_id: str, texts: list[str | None]):
+        doc_number = len(self.documents)
+        self.documents.append([kind, doc_id])
+
+        for token in set().union(*(tokenize(text) for text in texts)):
+            self.postings[token].append(doc_number)
+
+    def add_image(self, export_image: ExportImage):
+        for facet, field in IMAGE_FACET_FIELDS.items():
+            value = getattr(export_image, field)
+            if value:
+                self.image_facets[facet][value].append(export_image.uuid)
+
+        size_bucket = voxel_count_decade(image_voxel_count(export_image))
+        self.image_facets["size"][size_bucket].append(export_image.uuid)
+
+        self._add_document(
+            "image",
+            export_image.uuid,
+            [getattr(export_image, field) for field in IMAGE_TEXT_FIELDS],
+        )
+
+    def add_dataset(self, accession_id: str, export_dataset):
+        for facet, field in DATASET_FACET_FIELDS.items():
+            value = getattr(export_dataset, field)
+            if value:
+                self.dataset_facets[facet][value].append(accession_id)
+
+        self._add_document(
+            "dataset",
+            accession_id,
+            [getattr(export_dataset, field) for field in DATASET_TEXT_FIELDS],
+        )
+
+    def prefixes(self) -> dict[str, list[str]]:
+        prefixes = defaultdict(list)
+        for token in sorted(self.postings):
+            prefixes[token[:PREFIX_LENGTH]].append(token)
+
+        return prefixes
+
+    def write(self, dirpath: Path):
+        dirpath.mkdir(exist_ok=True, parents=True)
+
+        index_files = {
+            "facets.json": {
+                "images": self.image_facets,
+                "datasets": self.dataset_facets,
+            },
+            "tokens.json": {
+                "documents": self.documents,
+                "postings": dict(sorted(self.postings.items())),
+            },
+            "prefixes.json": self.prefixes(),
+        }
+
+        for fname, index in index_files.items():
+            with atomic_output(dirpath / fname) as fh:
+                json.dump(index, fh, separators=(",", ":"), sort_keys=True)
@@ -0,0 +1,199 @@
+"""Serialization of cache entries, with pluggable backends.
+
+The backend is chosen by settings.cache_serializer:
+
+* json: pydantic's standard library JSON, indented (the default)
+* orjson: compact JSON via orjson (poetry install -E orjson)
+* msgpack: binary MessagePack (poetry install -E msgpack)
+
+Each entry's file suffix marks its format. Entries written by another
+backend are still read, by whichever backend handles their suffix, so the
+setting can be changed without clearing the cache."""
+
+import os
+import threading
+from abc import ABC, abstractmethod
+from collections import Counter
+from pathlib import Path
+from typing import Type, TypeVar
+
+from pydantic import BaseModel
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:  # pragma: no cover
+    msgpack = None
+
+from .config import settings
+
+Model = TypeVar("Model", bound=BaseModel)
+
+
+class Serializer(ABC):
+    name: str
+    suffix: str
+
+    @abstractmethod
+    def dumps(self, obj: BaseModel) -> bytes:
+        pass
+
+    @abstractmethod
+    def loads(self, data: bytes, model_cls: Type[Model]) -> Model:
+        pass
+
+
+class JSONSerializer(Serializer):
+    name = "json"
+    suffix = ".json"
+
+    def dumps(self, obj: BaseModel) -> bytes:
+        return obj.json(indent=2).encode()
+
+    def loads(self, data: bytes, model_cls: Type[Model]) -> Model:
+        return model_cls.parse_raw(data)
+
+
+class OrjsonSerializer(Serializer):
+    name = "orjson"
+    suffix = ".json"
+
+    def __init__(self):
+        if orjson is None:
+            raise ImportError("orjson is not installed: poetry install -E orjson")
+
+    def dumps(self, obj: BaseModel) -> bytes:
+        return orjson.dumps(obj.dict())
+
+    def loads(self, data: bytes, model_cls: Type[Model]) -> Model:
+        return model_cls.parse_obj(orjson.loads(data))
+
+
+class MsgpackSerializer(Serializer):
+    name = "msgpack"
+    suffix = ".msgpack"
+
+    def __init__(self):
+        if msgpack is None:
+            raise ImportError("msgpack is not installed: poetry install -E msgpack")
+
+    def dumps(self, obj: BaseModel) -> bytes:
+        return msgpack.packb(obj.dict())
+
+    def loads(self, data: bytes, model_cls: Type[Model]) -> Model:
+        return model_cls.parse_obj(msgpack.unpackb(data))
+
+
+SERIALIZERS = {
+    cls.name: cls for cls in (JSONSerializer, OrjsonSerializer, MsgpackSerializer)
+}
+
+
+def get_serializer(name: str | None = None) -> Serializer:
+    name = name or settings.cache_serializer
+    try:
+        return SERIALIZERS[name]()
+    except KeyError:
+        raise ValueError(
+            f"Unknown serializer {name!r}, expected one of {', '.join(SERIALIZERS)}"
+        )
+
+
+def reader_for_suffix(suffix: str) -> Serializer:
+    """The serializer to read entries with the given suffix, preferring the
+    configured one."""
+
+    serializer = get_serializer()
+    if serializer.suffix == suffix:
+        return serializer
+
+    for cls in SERIALIZERS.values():
+        if cls.suffix == suffix:
+            try:
+                return cls()
+            except ImportError:
+                continue
+
+    raise ImportError(f"No serializer available to read {suffix} cache entries")
+
+
+CACHE_SUFFIXES = sorted({cls.suffix for cls in SERIALIZERS.values()})
+
+
+class CacheStats:
+    """Counts of cache hits and misses by cache (directory) name."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.hits = Counter()
+        self.misses = Counter()
+
+    def record(self, cache: str, hit: bool):
+        with self._lock:
+            (self.hits if hit else self.misses)[cache] += 1
+
+    def summary(self) -> list[str]:
+        lines = []
+        for cache in sorted(self.hits.keys() | self.misses.keys()):
+            hits, misses = self.hits[cache], self.misses[cache]
+            lines.append(
+                f"{cache} cache: {hits} hits, {misses} misses "
+                f"({hits / (hits + misses):.0%} hit ratio)"
+            )
+        return lines
+
+
+cache_stats = CacheStats()
+
+
+def read_cache_entry(
+    dirpath: Path, key: str, model_cls: Type[Model]
+) -> Model | None:
+    """Read the cache entry for key from dirpath, in whichever format it was
+    written. Returns None if there is no entry."""
+
+    preferred_suffix = get_serializer().suffix
+    for suffix in [preferred_suffix] + CACHE_SUFFIXES:
+        fpath = dirpath / f"{key}{suffix}"
+        if fpath.exists():
+            cache_stats.record(dirpath.name, hit=True)
+            return reader_for_suffix(suffix).loads(fpath.read_bytes(), model_cls)
+
+    cache_stats.record(dirpath.name, hit=False)
+    return None
+
+
+def cache_entry_exists(dirpath: Path, key: str) -> bool:
+    """Whether there is a cache entry for key in dirpath, in any format,
+    without counting towards cache_stats."""
+
+    return any((dirpath / f"{key}{suffix}").exists() for suffix in CACHE_SUFFIXES)
+
+
+def write_cache_entry(dirpath: Path, key: str, obj: BaseModel) -> Path:
+    """Write obj as the cache entry for key in dirpath with the configured
+    serializer, removing any entry for key in another format. The entry is
+    written to a temporary file and renamed into place, so that readers never
+    see a partial entry."""
+
+    serializer = get_serializer()
+    dirpath.mkdir(exist_ok=True, parents=True)
+
+    fpath = dirpath / f"{key}{serializer.suffix}"
+    # Workers may write the same entry at once, so each has its own file
+    tmp_fpath = dirpath / f".{fpath.name}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        tmp_fpath.write_bytes(serializer.dumps(obj))
+        os.replace(tmp_fpath, fpath)
+    finally:
+        tmp_fpath.unlink(missing_ok=True)
+
+    for suffix in CACHE_SUFFIXES:
+        if suffix != serializer.suffix:
+            (dirpath / f"{key}{suffix}").unlink(missing_ok=True)
+
+    return fpath
@@ -0,0 +1,200 @@
+"""Deterministic partitioning of export runs across nodes, and merging of
+the partial exports they produce.
+
+Studies are assigned to shards by a hash of their accession ID. The images
+of very large studies are instead spread across all shards by a hash of
+their UUID, while the dataset stays with the study's shard. Shard outputs are
+written with keys sorted, so merging is a k-way merge holding one entry per
+shard in memory.
+
+A dataset's image aggregates in a shard cover only that shard's images, so
+merging recomputes them over the images of every shard."""
+
+import hashlib
+import heapq
+import json
+import logging
+from operator import itemgetter
+from pathlib import Path
+
+from .aggregates import SIZE_FIELDS, ImageAggregator, combine_image_aggregates
+from .config import settings
+from .jsonstream import ExportFileWriter, iter_export_entries, read_export_value
+from .models import ExportImage, ExportImageAggregates, ExportShard
+from .outputs import atomic_output
+
+logger = logging.getLogger(__name__)
+
+
+# Sections of the export models, in the order they are written
+EXPORT_SECTIONS = ["collections", "datasets", "images"]
+
+# Images are aggregated this many at a time when merging
+AGGREGATE_BATCH_IMAGES = 10000
+
+
+class ShardMergeError(Exception):
+    pass
+
+
+def parse_shard(spec: str) -> ExportShard:
+    """Parse a shard specification of the form "i/N", with 0 <= i < N."""
+
+    try:
+        index, count = (int(part) for part in spec.split("/"))
+    except ValueError:
+        raise ValueError(f"Shard must be given as i/N, got {spec!r}")
+
+    if not 0 <= index < count:
+        raise ValueError(f"Shard index must be in the range 0 to {count - 1}")
+
+    return ExportShard(index=index, count=count)
+
+
+def shard_index_for(key: str, count: int) -> int:
+    digest = hashlib.sha1(key.encode()).digest()
+    return int.from_bytes(digest[:8], "big") % count
+
+
+def shard_owns_study(shard: ExportShard, accession_id: str) -> bool:
+    return shard_index_for(accession_id, shard.count) == shard.index
+
+
+def shard_owns_image(shard: ExportShard, image_uuid: str) -> bool:
+    return shard_index_for(image_uuid, shard.count) == shard.index
+
+
+def study_is_split(n_images: int) -> bool:
+    return n_images > settings.shard_split_images_count
+
+
+def _iter_sorted_entries(fpath: Path, section: str):
+    previous_key = None
+    for key, entry in iter_export_entries(fpath, section):
+        if previous_key is not None and key <= previous_key:
+            raise ShardMergeError(
+                f"{fpath}: {section} are not sorted by key, was it written "
+                "by an export run with --shard?"
+            )
+        previous_key = key
+        yield key, entry
+
+
+def check_shard_coverage(shard_fpaths: list[Path]) -> list[str]:
+    """Check that the shard files cover every shard exactly once. Returns a
+    list of problems found."""
+
+    shards = [read_export_value(fpath, "shard") for fpath in shard_fpaths]
+    if any(shard is None for shard in shards):
+        return ["Some inputs were not written by a sharded export run"]
+
+    counts = {shard["count"] for shard in shards}
+    if len(counts) > 1:
+        return [f"Shards come from runs with different shard counts: {counts}"]
+
+    problems = []
+    indexes = sorted(shard["index"] for shard in shards)
+    for index in range(counts.pop()):
+        if indexes.count(index) == 0:
+            problems.append(f"Shard {index} is missing")
+        elif indexes.count(index) > 1:
+            problems.append(f"Shard {index} was given more than once")
+
+    return problems
+
+
+def aggregate_shard_images(
+    shard_fpaths: list[Path],
+) -> dict[str, ExportImageAggregates]:
+    """Aggregates over the images of every shard, by study accession ID, in
+    one streaming pass, combining the aggregates of batches of images. Images
+    without sizes (from --image-fields runs) are not aggregated, as in
+    unsharded runs."""
+
+    aggregates_by_accession_id = {}
+
+    def add_batch(aggregator: ImageAggregator):
+        for accession_id, aggregates in aggregator.aggregates().items():
+            if accession_id in aggregates_by_accession_id:
+                aggregates = combine_image_aggregates(
+                    aggregates_by_accession_id[accession_id], aggregates
+                )
+            aggregates_by_accession_id[accession_id] = aggregates
+
+    for fpath in shard_fpaths:
+        aggregator = ImageAggregator()
+        n_images = 0
+        for _, entry in iter_export_entries(fpath, "images"):
+            if any(entry.get(field) is None for field in SIZE_FIELDS):
+                continue
+            aggregator.add(ExportImage.construct(**entry))
+            n_images += 1
+            if n_images % AGGREGATE_BATCH_IMAGES == 0:
+                add_batch(aggregator)
+                aggregator = ImageAggregator()
+        add_batch(aggregator)
+
+    return aggregates_by_accession_id
+
+
+def merge_shards(shard_fpaths: list[Path], output_fpath: Path) -> list[str]:
+    """Stream-merge partial exports into output_fpath. Returns a list of
+    problems found: missing shards, UUIDs present in more than one shard
+    (the first is kept), and image UUIDs referenced by datasets but not
+    present in any shard, or shards projected to different image fields."""
+
+    problems = check_shard_coverage(shard_fpaths)
+    image_fields_by_shard = {
+        fpath: read_export_value(fpath, "image_fields") for fpath in shard_fpaths
+    }
+    image_fields = next(iter(image_fields_by_shard.values()), None)
+    for fpath, shard_image_fields in image_fields_by_shard.items():
+        if shard_image_fields != image_fields:
+            problems.append(
+                f"{fpath} has image fields {shard_image_fields}, "
+                f"expected {image_fields}"
+            )
+    aggregates_by_accession_id = aggregate_shard_images(shard_fpaths)
+
+    # Datasets only reference a small sample of their images, so this stays
+    # small relative to the number of images
+    referenced_image_uuids = set()
+    for fpath in shard_fpaths:
+        for _, dataset in iter_export_entries(fpath, "datasets"):
+            referenced_image_uuids.update(dataset.get("image_uuids", []))
+
+    with atomic_output(output_fpath) as fh:
+        writer = ExportFileWriter(fh)
+        for section in EXPORT_SECTIONS:
+            # Keys are written in sorted order, as in unsharded exports
+            if section == "images" and image_fields:
+                writer.write_value("image_fields", image_fields)
+            writer.begin_section(section)
+            merged_entries = heapq.merge(
+                *(_iter_sorted_entries(fpath, section) for fpath in shard_fpaths),
+                key=itemgetter(0),
+            )
+            previous_key = None
+            for key, entry in merged_entries:
+                if key == previous_key:
+                    problems.append(f"Duplicate {section} entry {key}")
+                    continue
+                if section == "images":
+                    referenced_image_uuids.discard(key)
+                if section == "datasets":
+                    # As in unsharded exports, unset aggregates are left out
+                    aggregates = aggregates_by_accession_id.get(key)
+                    entry.pop("image_aggregates", None)
+                    if aggregates:
+                        entry["image_aggregates"] = json.loads(aggregates.json())
+                writer.write_entry(key, entry)
+                previous_key = key
+            writer.end_section()
+        writer.close()
+
+    problems.extend(
+        f"Image {uuid} is referenced by a dataset but missing"
+        for uuid in sorted(referenced_image_uuids)
+    )
+
+    return problems
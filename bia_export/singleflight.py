@@ -0,0 +1,47 @@
+"""Coalescing of duplicate in-flight calls."""
+
+import threading
+from concurrent.futures import Future
+from typing import Callable, Hashable
+
+
+class SingleFlight:
+    """Ensures that concurrent calls made with the same key share a single
+    execution. The first caller for a key (the leader) runs the function;
+    callers arriving while it is in flight wait for and receive its result,
+    or its exception. Once the call completes the key is forgotten, so this is
+    not a cache.
+
+    Callers share the returned object, so must not mutate it."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._in_flight: dict[Hashable, Future] = {}
+        self.n_calls = 0
+        self.n_coalesced = 0
+
+    def do(self, key: Hashable, fn: Callable, *args, **kwargs):
+        with self._lock:
+            future = self._in_flight.get(key)
+            is_leader = future is None
+            if is_leader:
+                future = Future()
+                self._in_flight[key] = future
+                self.n_calls += 1
+            else:
+                self.n_coalesced += 1
+
+        if not is_leader:
+            return future.result()
+
+        try:
+            result = fn(*args, **kwargs)
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            with self._lock:
+                del self._in_flight[key]
@@ -0,0 +1,420 @@
+"""Offline snapshots of the upstream data needed for exports.
+
+A snapshot is a SQLite database holding the API objects (studies, images,
+acquisitions, specimens, biosamples and file references) and OME Zarr
+metadata for a set of studies, each stored as compressed JSON. Exports can
+then be run against the snapshot instead of the API and S3, via
+SnapshotClient and use_snapshot."""
+
+import json
+import logging
+import sqlite3
+import threading
+import zlib
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Callable, Iterable, Iterator, Type
+
+from bia_integrator_api import models as api_models, exceptions as api_exceptions
+from pydantic import BaseModel
+
+from .bia_client_utils import rw_client
+from .concurrency import zarr_limiter
+from .config import settings
+from .proxyimage import read_ome_zarr_metadata, set_ome_zarr_metadata_reader
+
+logger = logging.getLogger(__name__)
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS snapshot_info (key TEXT PRIMARY KEY, value TEXT);
+CREATE TABLE IF NOT EXISTS object_infos (accession_id TEXT PRIMARY KEY, data BLOB);
+CREATE TABLE IF NOT EXISTS studies (uuid TEXT PRIMARY KEY, data BLOB);
+CREATE TABLE IF NOT EXISTS images (uuid TEXT PRIMARY KEY, study_uuid TEXT, data BLOB);
+CREATE INDEX IF NOT EXISTS images_study_uuid ON images (study_uuid, uuid);
+CREATE TABLE IF NOT EXISTS file_references (
+    uuid TEXT PRIMARY KEY, study_uuid TEXT, data BLOB
+);
+CREATE INDEX IF NOT EXISTS file_references_study_uuid
+    ON file_references (study_uuid, uuid);
+CREATE TABLE IF NOT EXISTS image_acquisitions (uuid TEXT PRIMARY KEY, data BLOB);
+CREATE TABLE IF NOT EXISTS specimens (uuid TEXT PRIMARY KEY, data BLOB);
+CREATE TABLE IF NOT EXISTS biosamples (uuid TEXT PRIMARY KEY, data BLOB);
+CREATE TABLE IF NOT EXISTS ome_zarr_metadata (uri TEXT PRIMARY KEY, data BLOB);
+"""
+
+# Page size for listing a study's images and file references
+PAGE_SIZE = 500
+
+
+def encode(obj: BaseModel | dict) -> bytes:
+    if isinstance(obj, BaseModel):
+        data = obj.json(by_alias=True, exclude_none=True)
+    else:
+        data = json.dumps(obj, separators=(",", ":"))
+    return zlib.compress(data.encode())
+
+
+def decode(blob: bytes, model_cls: Type[BaseModel] | None = None):
+    data = zlib.decompress(blob)
+    if model_cls is None:
+        return json.loads(data)
+    return model_cls.parse_raw(data)
+
+
+class SnapshotMissError(LookupError):
+    pass
+
+
+class Snapshot:
+    """A snapshot database. Connections are per thread, so one Snapshot can
+    be read from many export workers."""
+
+    def __init__(self, fpath: Path, readonly=True):
+        self.fpath = Path(fpath)
+        self.readonly = readonly
+        if readonly and not self.fpath.exists():
+            raise FileNotFoundError(f"No snapshot at {self.fpath}")
+        self._local = threading.local()
+        if not readonly:
+            self.connection.executescript(SCHEMA)
+
+    @property
+    def connection(self) -> sqlite3.Connection:
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            if self.readonly:
+                uri = f"{self.fpath.resolve().as_uri()}?mode=ro"
+                connection = sqlite3.connect(uri, uri=True)
+            else:
+                connection = sqlite3.connect(self.fpath)
+            self._local.connection = connection
+        return connection
+
+    def close(self):
+        connection = getattr(self._local, "connection", None)
+        if connection is not None:
+            connection.close()
+            self._local.connection = None
+
+    def _fetch_one(self, sql: str, key: str, what: str) -> bytes:
+        row = self.connection.execute(sql, (key,)).fetchone()
+        if row is None:
+            raise SnapshotMissError(f"{what} {key} is not in snapshot {self.fpath}")
+        return row[0]
+
+    def get_object(self, table: str, uuid: str, model_cls: Type[BaseModel]):
+        blob = self._fetch_one(
+            f"SELECT data FROM {table} WHERE uuid = ?", uuid, model_cls.__name__
+        )
+        return decode(blob, model_cls)
+
+    def get_object_info(self, accession_id: str) -> list:
+        blob = self._fetch_one(
+            "SELECT data FROM object_infos WHERE accession_id = ?",
+            accession_id,
+            "Accession",
+        )
+        return [api_models.ObjectInfo.parse_obj(d) for d in decode(blob)]
+
+    def get_ome_zarr_metadata(self, uri: str) -> dict:
+        blob = self._fetch_one(
+            "SELECT data FROM ome_zarr_metadata WHERE uri = ?",
+            uri,
+            "OME Zarr metadata for",
+        )
+        return decode(blob)
+
+    def iter_objects(
+        self,
+        table: str,
+        model_cls: Type[BaseModel],
+        study_uuid: str | None = None,
+        start_uuid: str | None = None,
+    ) -> Iterator[BaseModel]:
+        """Yield the objects in table in UUID order, optionally only those of
+        one study, after start_uuid."""
+
+        clauses, params = [], []
+        if study_uuid is not None:
+            clauses.append("study_uuid = ?")
+            params.append(study_uuid)
+        if start_uuid is not None:
+            clauses.append("uuid > ?")
+            params.append(start_uuid)
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+
+        rows = self.connection.execute(
+            f"SELECT data FROM {table} {where} ORDER BY uuid", params
+        )
+        for (blob,) in rows:
+            yield decode(blob, model_cls)
+
+    def put_object(self, table: str, obj: BaseModel, study_uuid: str | None = None):
+        if study_uuid is None:
+            self.connection.execute(
+                f"INSERT OR REPLACE INTO {table} (uuid, data) VALUES (?, ?)",
+                (obj.uuid, encode(obj)),
+            )
+        else:
+            self.connection.execute(
+                f"INSERT OR REPLACE INTO {table} (uuid, study_uuid, data) "
+                "VALUES (?, ?, ?)",
+                (obj.uuid, study_uuid, encode(obj)),
+            )
+
+    def put_object_info(self, accession_id: str, object_info: list):
+        self.connection.execute(
+            "INSERT OR REPLACE INTO object_infos (accession_id, data) VALUES (?, ?)",
+            (accession_id, encode([o.dict(by_alias=True) for o in object_info])),
+        )
+
+    def put_ome_zarr_metadata(self, uri: str, metadata: dict):
+        self.connection.execute(
+            "INSERT OR REPLACE INTO ome_zarr_metadata (uri, data) VALUES (?, ?)",
+            (uri, encode(metadata)),
+        )
+
+    def set_info(self, key: str, value: str):
+        self.connection.execute(
+            "INSERT OR REPLACE INTO snapshot_info (key, value) VALUES (?, ?)",
+            (key, value),
+        )
+
+    def commit(self):
+        self.connection.commit()
+
+
+def _not_found(e: SnapshotMissError):
+    return api_exceptions.NotFoundException(status=404, reason=str(e))
+
+
+class SnapshotClient:
+    """Implements the read methods of the API client used by the exporters
+    from a snapshot. Annotations are always applied, since snapshots store
+    annotated objects. Objects missing from the snapshot raise
+    NotFoundException, as the API would."""
+
+    def __init__(self, snapshot: Snapshot):
+        self.snapshot = snapshot
+
+    def _get(self, table: str, uuid: str, model_cls: Type[BaseModel]):
+        try:
+            return self.snapshot.get_object(table, uuid, model_cls)
+        except SnapshotMissError as e:
+            raise _not_found(e) from e
+
+    def _list(
+        self,
+        table: str,
+        model_cls: Type[BaseModel],
+        study_uuid: str | None,
+        start_uuid: str | None,
+        limit: int | None,
+        predicate: Callable[[BaseModel], bool] | None = None,
+    ) -> list:
+        objs = []
+        for obj in self.snapshot.iter_objects(table, model_cls, study_uuid, start_uuid):
+            if limit is not None and len(objs) >= limit:
+                break
+            if predicate is None or predicate(obj):
+                objs.append(obj)
+        return objs
+
+    def get_object_info_by_accession(self, accession_ids: list[str]) -> list:
+        try:
+            return [
+                object_info
+                for accession_id in accession_ids
+                for object_info in self.snapshot.get_object_info(accession_id)
+            ]
+        except SnapshotMissError as e:
+            raise _not_found(e) from e
+
+    def get_study(self, uuid: str, apply_annotations=False) -> api_models.BIAStudy:
+        return self._get("studies", uuid, api_models.BIAStudy)
+
+    def get_image(self, uuid: str, apply_annotations=False) -> api_models.BIAImage:
+        return self._get("images", uuid, api_models.BIAImage)
+
+    def get_image_acquisition(self, uuid: str) -> api_models.ImageAcquisition:
+        return self._get("image_acquisitions", uuid, api_models.ImageAcquisition)
+
+    def get_specimen(self, uuid: str) -> api_models.Specimen:
+        return self._get("specimens", uuid, api_models.Specimen)
+
+    def get_biosample(self, uuid: str) -> api_models.Biosample:
+        return self._get("biosamples", uuid, api_models.Biosample)
+
+    def search_studies(self, start_uuid=None, limit=10, **kwargs) -> list:
+        return self._list("studies", api_models.BIAStudy, None, start_uuid, limit)
+
+    def get_study_images(
+        self, study_uuid: str, start_uuid=None, limit=10, apply_annotations=False
+    ) -> list:
+        return self._list("images", api_models.BIAImage, study_uuid, start_uuid, limit)
+
+    def get_study_file_references(
+        self, study_uuid: str, start_uuid=None, limit=10, apply_annotations=False
+    ) -> list:
+        return self._list(
+            "file_references", api_models.FileReference, study_uuid, start_uuid, limit
+        )
+
+    def search_images_exact_match(
+        self, search_filter: api_models.SearchImageFilter, apply_annotations=False
+    ) -> list:
+        rep_types = {rep.type for rep in search_filter.image_representations_any or []}
+
+        def matches(image: api_models.BIAImage) -> bool:
+            if (
+                search_filter.original_relpath is not None
+                and image.original_relpath != search_filter.original_relpath
+            ):
+                return False
+            if rep_types and not any(
+                rep.type in rep_types for rep in image.representations
+            ):
+                return False
+            return True
+
+        return self._list(
+            "images",
+            api_models.BIAImage,
+            search_filter.study_uuid,
+            getattr(search_filter, "start_uuid", None),
+            search_filter.limit,
+            predicate=matches,
+        )
+
+
+def use_snapshot(fpath: Path) -> Snapshot:
+    """Route all API calls and OME Zarr probes to the snapshot at fpath,
+    disabling bulk probing."""
+
+    snapshot = Snapshot(fpath)
+    rw_client.client = SnapshotClient(snapshot)
+    set_ome_zarr_metadata_reader(snapshot.get_ome_zarr_metadata)
+    if settings.bulk_probe:
+        # Bulk probes read the bucket, not the snapshot
+        logger.info("Bulk probing is disabled when reading from a snapshot")
+        settings.bulk_probe = False
+    logger.info(f"Reading upstream data from snapshot {fpath}")
+
+    return snapshot
+
+
+def _iter_study_pages(method: Callable[..., list], study_uuid: str):
+    """Page through a per-study listing method of the API client."""
+
+    start_uuid = None
+    while True:
+        page = method(
+            study_uuid, start_uuid=start_uuid, limit=PAGE_SIZE, apply_annotations=True
+        )
+        yield from page
+        if len(page) < PAGE_SIZE:
+            return
+        start_uuid = page[-1].uuid
+
+
+def fetch_study_snapshot(accession_id: str) -> list[tuple[str, tuple]]:
+    """Fetch everything the exporters read for one study from the API and
+    S3, as a list of (put method name, arguments) for a Snapshot."""
+
+    puts = []
+    object_info = rw_client.get_object_info_by_accession([accession_id])
+    puts.append(("put_object_info", (accession_id, object_info)))
+
+    study_uuid = object_info[0].uuid
+    study = rw_client.get_study(study_uuid, apply_annotations=True)
+    puts.append(("put_object", ("studies", study)))
+
+    for fileref in _iter_study_pages(rw_client.get_study_file_references, study_uuid):
+        puts.append(("put_object", ("file_references", fileref, study_uuid)))
+
+    acquisition_uuids, specimen_uuids, biosample_uuids = set(), set(), set()
+    for image in _iter_study_pages(rw_client.get_study_images, study_uuid):
+        puts.append(("put_object", ("images", image, study_uuid)))
+
+        for image_acquisition_uuid in image.image_acquisitions_uuid:
+            if image_acquisition_uuid in acquisition_uuids:
+                continue
+            acquisition_uuids.add(image_acquisition_uuid)
+            image_acquisition = rw_client.get_image_acquisition(image_acquisition_uuid)
+            puts.append(("put_object", ("image_acquisitions", image_acquisition)))
+
+            specimen_uuid = image_acquisition.specimen_uuid
+            if specimen_uuid in specimen_uuids:
+                continue
+            specimen_uuids.add(specimen_uuid)
+            specimen = rw_client.get_specimen(specimen_uuid)
+            puts.append(("put_object", ("specimens", specimen)))
+
+            if specimen.biosample_uuid in biosample_uuids:
+                continue
+            biosample_uuids.add(specimen.biosample_uuid)
+            biosample = rw_client.get_biosample(specimen.biosample_uuid)
+            puts.append(("put_object", ("biosamples", biosample)))
+
+        for rep in image.representations:
+            if rep.type != "ome_ngff":
+                continue
+            for uri in rep.uri:
+                try:
+                    metadata = zarr_limiter.call(read_ome_zarr_metadata, uri)
+                except Exception as e:
+                    logger.warning(f"Could not read OME Zarr metadata from {uri}: {e}")
+                    continue
+                puts.append(("put_ome_zarr_metadata", (uri, metadata)))
+
+    logger.info(f"Fetched {accession_id}: {len(puts)} objects")
+
+    return puts
+
+
+def take_snapshot(
+    accession_ids: Iterable[str], fpath: Path, workers: int | None = None
+) -> int:
+    """Snapshot the given studies into the database at fpath, adding to or
+    updating an existing snapshot. Returns the number of studies snapshotted.
+
+    Studies are fetched concurrently, a bounded number at a time so that lazy
+    accession_ids are consumed as they are needed, and written from the
+    calling thread as they complete."""
+
+    workers = workers or settings.export_workers
+    snapshot = Snapshot(fpath, readonly=False)
+    n_studies = 0
+
+    def write_done(pending: set, n_in_flight: int) -> set:
+        """Wait until at most n_in_flight of pending are not done, writing
+        those which are. Returns those still pending."""
+
+        nonlocal n_studies
+        while len(pending) > n_in_flight:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                for method_name, args in future.result():
+                    getattr(snapshot, method_name)(*args)
+                snapshot.commit()
+                n_studies += 1
+
+        return pending
+
+    # Twice the workers are in flight, so that workers are kept busy while
+    # finished studies are written
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        pending = set()
+        for accession_id in accession_ids:
+            pending = write_done(pending, 2 * workers - 1)
+            pending.add(executor.submit(fetch_study_snapshot, accession_id))
+        write_done(pending, 0)
+
+    snapshot.set_info("api_basepath", settings.bia_api_basepath)
+    snapshot.set_info("updated_at", datetime.now(timezone.utc).isoformat())
+    snapshot.commit()
+    snapshot.close()
+
+    return n_studies
@@ -0,0 +1,251 @@
+"""Validation and comparison of export files in bounded memory.
+
+Both stream through export files with jsonstream, so only the current
+entries (and, for verification, the UUIDs of images referenced by datasets)
+are held in memory, however large the export."""
+
+import hashlib
+import json
+from pathlib import Path
+from types import GeneratorType
+from typing import Iterator, NamedTuple, Type
+
+from pydantic import BaseModel, ValidationError
+
+from .jsonstream import iter_export_entries, iter_export_sections, read_export_value
+from .projection import (
+    common_image_fields,
+    parse_image_fields,
+    projected_image_model,
+)
+
+# Field of each entry which must equal its key
+KEY_FIELDS = {"images": "uuid", "datasets": "accession_id"}
+
+
+def format_validation_error(e: ValidationError) -> str:
+    return "; ".join(
+        ": ".join(
+            part
+            for part in (".".join(str(loc) for loc in error["loc"]), error["msg"])
+            if part
+        )
+        for error in e.errors()
+    )
+
+
+def verify_export(fpath: Path, exports_cls: Type[BaseModel]) -> list[str]:
+    """Validate each entry of the export at fpath against the models of
+    exports_cls, and check that every image referenced by a dataset is
+    present. Images of exports projected by --image-fields are validated
+    against those fields alone. Returns a list of problems."""
+
+    image_fields = read_export_value(fpath, "image_fields")
+    problems = []
+    image_model_cls = None
+    # Invalid types of image_fields are reported when validating it below
+    if isinstance(image_fields, list) and all(isinstance(f, str) for f in image_fields):
+        try:
+            image_model_cls = projected_image_model(
+                parse_image_fields(",".join(image_fields))
+            )
+        except ValueError as e:
+            problems.append(f"image_fields: {e}")
+    referenced_image_uuids = set()
+    n_images = 0
+    seen_sections = set()
+
+    for section, value in iter_export_sections(fpath):
+        seen_sections.add(section)
+        field = exports_cls.__fields__.get(section)
+        if field is None:
+            problems.append(f"Unexpected section {section!r}")
+            continue
+
+        if not isinstance(value, GeneratorType):
+            if value is not None:
+                _, errors = field.validate(value, {}, loc=())
+                if errors:
+                    e = ValidationError([errors], exports_cls)
+                    problems.append(f"{section}: {format_validation_error(e)}")
+            continue
+
+        model_cls = field.type_
+        if section == "images" and image_model_cls:
+            model_cls = image_model_cls
+        key_field = KEY_FIELDS.get(section)
+        if key_field not in model_cls.__fields__:
+            key_field = None
+        for key, entry in value:
+            try:
+                model_cls.parse_obj(entry)
+            except ValidationError as e:
+                problems.append(f"{section} {key}: {format_validation_error(e)}")
+                continue
+
+            if key_field and entry.get(key_field) != key:
+                problems.append(
+                    f"{section} {key}: {key_field} is {entry.get(key_field)!r}"
+                )
+            if section == "datasets":
+                referenced_image_uuids.update(entry.get("image_uuids", []))
+            elif section == "images":
+                referenced_image_uuids.discard(key)
+                n_images += 1
+
+    for name, field in exports_cls.__fields__.items():
+        if field.required and name not in seen_sections:
+            problems.append(f"Missing section {name!r}")
+
+    # Exports written by older versions have images before datasets, so
+    # recheck any remaining references against the images section
+    if referenced_image_uuids and n_images:
+        for key, _ in iter_export_entries(fpath, "images"):
+            referenced_image_uuids.discard(key)
+
+    problems.extend(
+        f"Image {uuid} is referenced by a dataset but missing"
+        for uuid in sorted(referenced_image_uuids)
+    )
+
+    return problems
+
+
+class Difference(NamedTuple):
+    section: str
+    key: str
+    change: str  # "added", "removed" or "changed"
+    fields: list[str] | None = None
+
+
+def entry_digest(entry) -> bytes:
+    return hashlib.sha1(json.dumps(entry, sort_keys=True).encode()).digest()
+
+
+def changed_fields(old_entry, new_entry) -> list[str] | None:
+    if not (isinstance(old_entry, dict) and isinstance(new_entry, dict)):
+        return None
+
+    return sorted(
+        name
+        for name in old_entry.keys() | new_entry.keys()
+        if old_entry.get(name) != new_entry.get(name)
+    )
+
+
+def entries_are_sorted(fpath: Path, section: str) -> bool:
+    previous_key = None
+    for key, _ in iter_export_entries(fpath, section):
+        if previous_key is not None and key <= previous_key:
+            return False
+        previous_key = key
+
+    return True
+
+
+def _iter_projected_entries(
+    fpath: Path, section: str, fields: frozenset[str] | None
+) -> Iterator[tuple[str, dict]]:
+    for key, entry in iter_export_entries(fpath, section):
+        if fields is not None and isinstance(entry, dict):
+            entry = {name: value for name, value in entry.items() if name in fields}
+        yield key, entry
+
+
+def _merge_join_section(
+    old_fpath: Path,
+    new_fpath: Path,
+    section: str,
+    fields: frozenset[str] | None = None,
+) -> Iterator[Difference]:
+    """Diff a section whose entries are sorted by key in both files, holding
+    one entry from each in memory. If fields is given, only those fields of
+    entries are compared."""
+
+    old_entries = _iter_projected_entries(old_fpath, section, fields)
+    new_entries = _iter_projected_entries(new_fpath, section, fields)
+    old = next(old_entries, None)
+    new = next(new_entries, None)
+    while old is not None or new is not None:
+        if new is None or (old is not None and old[0] < new[0]):
+            yield Difference(section, old[0], "removed")
+            old = next(old_entries, None)
+        elif old is None or new[0] < old[0]:
+            yield Difference(section, new[0], "added")
+            new = next(new_entries, None)
+        else:
+            if old[1] != new[1]:
+                fields = changed_fields(old[1], new[1])
+                yield Difference(section, old[0], "changed", fields)
+            old = next(old_entries, None)
+            new = next(new_entries, None)
+
+
+def _digest_section(
+    old_fpath: Path,
+    new_fpath: Path,
+    section: str,
+    fields: frozenset[str] | None = None,
+) -> Iterator[Difference]:
+    """Diff a section in any key order, holding a digest of each old entry in
+    memory rather than the entries themselves. If fields is given, only those
+    fields of entries are compared."""
+
+    old_digests = {
+        key: entry_digest(entry)
+        for key, entry in _iter_projected_entries(old_fpath, section, fields)
+    }
+    for key, entry in _iter_projected_entries(new_fpath, section, fields):
+        old_digest = old_digests.pop(key, None)
+        if old_digest is None:
+            yield Difference(section, key, "added")
+        elif old_digest != entry_digest(entry):
+            yield Difference(section, key, "changed")
+
+    for key in sorted(old_digests):
+        yield Difference(section, key, "removed")
+
+
+def _section_names(fpath: Path) -> dict[str, bool]:
+    """Top level keys of an export file, and whether each is object valued."""
+
+    return {
+        section: isinstance(value, GeneratorType)
+        for section, value in iter_export_sections(fpath)
+    }
+
+
+def diff_exports(old_fpath: Path, new_fpath: Path) -> Iterator[Difference]:
+    """Yield the entries added, removed and changed between two exports.
+
+    Sections sorted by key in both files (as written by this version) are
+    merge-joined; otherwise the old file's entries are reduced to digests.
+    Top level values other than sections (e.g. shard) are compared whole,
+    under the key "-". If either export was projected by --image-fields,
+    only the image fields which both have are compared."""
+
+    old_sections = _section_names(old_fpath)
+    new_sections = _section_names(new_fpath)
+    image_fields = common_image_fields(
+        read_export_value(old_fpath, "image_fields"),
+        read_export_value(new_fpath, "image_fields"),
+    )
+
+    for section in sorted(old_sections.keys() | new_sections.keys()):
+        fields = image_fields if section == "images" else None
+        if section not in new_sections:
+            yield Difference(section, "-", "removed")
+        elif section not in old_sections:
+            yield Difference(section, "-", "added")
+        elif old_sections[section] and new_sections[section]:
+            if entries_are_sorted(old_fpath, section) and entries_are_sorted(
+                new_fpath, section
+            ):
+                yield from _merge_join_section(old_fpath, new_fpath, section, fields)
+            else:
+                yield from _digest_section(old_fpath, new_fpath, section, fields)
+        else:
+            old_value = read_export_value(old_fpath, section)
+            new_value = read_export_value(new_fpath, section)
+            if old_value != new_value:
+                yield Difference(section, "-", "changed")
@@ -0,0 +1,42 @@
+from bia_export.aggregates import aggregate_images_by_dataset, voxel_count_decade
+from .utils import get_template_export_image
+
+
+def make_image(study_accession_id, sizeX, sizeC, PhysicalSizeX=None):
+    export_image = get_template_export_image(study_accession_id=study_accession_id)
+    export_image.sizeX = sizeX
+    export_image.sizeC = sizeC
+    export_image.PhysicalSizeX = PhysicalSizeX
+    return export_image
+
+
+def test_voxel_count_decade():
+    assert voxel_count_decade(0) == "1e0"
+    assert voxel_count_decade(999_999) == "1e5"
+    assert voxel_count_decade(1_000_000) == "1e6"
+    # log10 of this rounds to 16
+    assert voxel_count_decade(10**16 - 1) == "1e15"
+
+
+def test_aggregate_images_by_dataset():
+    export_images = [
+        make_image("S-BIAD1", 10, 1, PhysicalSizeX=0.5),
+        make_image("S-BIAD1", 2_000, 3),
+        make_image("S-BIAD1", 5_000, 3, PhysicalSizeX=2.0),
+        make_image("S-BIAD2", 1, 1),
+    ]
+
+    aggregates = aggregate_images_by_dataset(export_images)
+
+    assert set(aggregates) == {"S-BIAD1", "S-BIAD2"}
+    study_aggregates = aggregates["S-BIAD1"]
+    assert study_aggregates.n_images == 3
+    assert study_aggregates.total_voxels == 10 + 2_000 * 3 + 5_000 * 3
+    assert study_aggregates.voxel_count_distribution == {"1e1": 1, "1e3": 1, "1e4": 1}
+    assert study_aggregates.channel_counts == {"1": 1, "3": 2}
+    assert study_aggregates.size_ranges["sizeX"].min == 10
+    assert study_aggregates.size_ranges["sizeX"].max == 5_000
+    assert study_aggregates.physical_size_ranges["PhysicalSizeX"].max == 2.0
+    assert "PhysicalSizeY" not in study_aggregates.physical_size_ranges
+
+    assert aggregates["S-BIAD2"].physical_size_ranges == {}
@@ -0,0 +1,108 @@
+import http.server
+import json
+import threading
+from types import SimpleNamespace
+
+import requests
+
+from bia_export import concurrency
+from bia_export.bulkindex import BulkIndexWriter, post_batch, write_bulk_index
+from bia_export.config import settings
+
+
+class BulkHandler(http.server.BaseHTTPRequestHandler):
+    """Stand-in for a search engine _bulk endpoint, which rejects documents
+    with a "reject" field."""
+
+    documents = {}
+
+    def do_POST(self):
+        lines = self.rfile.read(int(self.headers["Content-Length"])).splitlines()
+        items = []
+        for action_line, document_line in zip(lines[::2], lines[1::2]):
+            action = json.loads(action_line)["index"]
+            document = json.loads(document_line)
+            status = 400 if "reject" in document else 201
+            if status == 201:
+                self.documents[(action["_index"], action["_id"])] = document
+            items.append({"index": {"_id": action["_id"], "status": status}})
+
+        errors = any(item["index"]["status"] >= 300 for item in items)
+        body = json.dumps({"errors": errors, "items": items}).encode()
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def test_bulk_index(tmp_path):
+    images = {f"image-{n:03d}": {"name": "x" * 100} for n in range(50)}
+    images["image-bad"] = {"reject": True}
+    export_fpath = tmp_path / "export.json"
+    export_fpath.write_text(
+        json.dumps({"datasets": {"S-TEST": {"title": "t"}}, "images": images})
+    )
+
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), BulkHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_port}/_bulk"
+
+    with BulkIndexWriter(
+        tmp_path / "bulk", url=url, workers=2, max_batch_bytes=1000
+    ) as writer:
+        write_bulk_index(export_fpath, writer)
+    server.shutdown()
+
+    assert writer.n_documents == 52
+    assert len(writer.batch_fpaths) > 1
+    assert all(fpath.stat().st_size <= 1000 for fpath in writer.batch_fpaths)
+    assert sum(result.n_errors for result in writer.post_results) == 1
+    assert len(BulkHandler.documents) == 51
+    assert BulkHandler.documents[("bia-datasets", "S-TEST")] == {"title": "t"}
+
+
+class FlakySession:
+    """Session whose posts fail with the given errors, then succeed."""
+
+    def __init__(self, errors):
+        self.errors = errors
+        self.timeouts = []
+
+    def post(self, url, data, headers, timeout):
+        self.timeouts.append(timeout)
+        if self.errors:
+            raise self.errors.pop(0)
+        return SimpleNamespace(
+            raise_for_status=lambda: None,
+            json=lambda: {"errors": False, "items": [{"index": {"status": 201}}]},
+        )
+
+
+def write_batch(tmp_path):
+    fpath = tmp_path / "batch-00000.ndjson"
+    fpath.write_text('{"index": {"_id": "a"}}\n{}\n{"index": {"_id": "b"}}\n{}\n')
+    return fpath
+
+
+def test_post_batch_retries_transient_errors(tmp_path, monkeypatch):
+    monkeypatch.setattr(concurrency.time, "sleep", lambda seconds: None)
+    session = FlakySession([requests.ConnectionError(), requests.Timeout()])
+
+    result = post_batch(session, "http://localhost/_bulk", write_batch(tmp_path))
+
+    assert result.n_errors == 0
+    assert session.timeouts == [settings.bulk_index_timeout] * 3
+
+
+def test_batch_which_cannot_be_posted_is_reported_failed(tmp_path, monkeypatch):
+    monkeypatch.setattr(concurrency.time, "sleep", lambda seconds: None)
+    monkeypatch.setattr(settings, "transient_retries", 2)
+    session = FlakySession([requests.ConnectionError()] * 3)
+
+    result = post_batch(session, "http://localhost/_bulk", write_batch(tmp_path))
+
+    assert (result.n_documents, result.n_errors) == (2, 2)
+    assert len(session.timeouts) == 3
@@ -0,0 +1,132 @@
+import shutil
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+
+import fsspec
+import numpy as np
+import requests
+import zarr
+
+from bia_export.bulkprobe import (
+    REQUEST_TIMEOUT,
+    FilesystemBucket,
+    S3Bucket,
+    parse_list_objects,
+    probe_study,
+    study_metadata_keys,
+)
+from bia_export.proxyimage import (
+    primed_metadata,
+    primed_ome_zarr_metadata,
+    read_ome_zarr_metadata,
+)
+from .test_proxyimage import get_template_ngff_metadata
+
+
+LIST_OBJECTS_RESPONSE = b"""<?xml version="1.0" encoding="UTF-8"?>
+<ListBucketResult xmlns="http://s3.amazonaws.com/doc/2006-03-01/">
+  <Name>bucket</Name>
+  <Prefix>S-TEST/</Prefix>
+  <IsTruncated>true</IsTruncated>
+  <NextContinuationToken>token</NextContinuationToken>
+  <Contents><Key>S-TEST/a.zarr/.zattrs</Key></Contents>
+  <Contents><Key>S-TEST/a.zarr/0/.zarray</Key></Contents>
+</ListBucketResult>"""
+
+
+def test_parse_list_objects():
+    assert parse_list_objects(LIST_OBJECTS_RESPONSE) == (
+        ["S-TEST/a.zarr/.zattrs", "S-TEST/a.zarr/0/.zarray"],
+        "token",
+    )
+
+
+def test_probe_study_matches_per_image_probes(tmp_path):
+    ngff_metadata = get_template_ngff_metadata(
+        axes=None, level_scales=[[1.0, 1.0, 2.0, 0.5, 0.5]]
+    )
+    uris = []
+    for name in ("a", "b"):
+        uri = str(tmp_path / "S-TEST" / f"{name}.zarr")
+        zgroup = zarr.open_group(uri, mode="w")
+        zgroup.attrs.put(ngff_metadata.dict())
+        zgroup.create_dataset("0", data=np.zeros((1, 2, 5, 20, 10), dtype="uint16"))
+        uris.append(uri)
+    shutil.rmtree(tmp_path / "S-TEST" / "b.zarr" / "0")
+
+    bucket = FilesystemBucket(fsspec.filesystem("file"), str(tmp_path))
+    metadata_by_uri = probe_study(bucket, "S-TEST", uris + ["elsewhere"])
+
+    # b has no array, so is left to a per-image probe, which reports that
+    assert list(metadata_by_uri) == [uris[0]]
+    assert metadata_by_uri[uris[0]] == read_ome_zarr_metadata(uris[0])
+
+
+def test_s3_requests_time_out():
+    requests_made = []
+
+    class Session:
+        def get(self, uri, **kwargs):
+            requests_made.append(kwargs)
+            return SimpleNamespace(
+                status_code=200,
+                content=LIST_OBJECTS_RESPONSE.replace(b"true", b"false"),
+                raise_for_status=lambda: None,
+            )
+
+    bucket = S3Bucket("https://s3.example.org", "bucket")
+    bucket.session = Session()
+    list(bucket.list("S-TEST/"))
+    bucket.get("S-TEST/a.zarr/.zattrs")
+
+    assert [kwargs["timeout"] for kwargs in requests_made] == [REQUEST_TIMEOUT] * 2
+
+
+def test_unused_primed_metadata_is_dropped():
+    with primed_ome_zarr_metadata({"used": {}, "unused": {}}):
+        assert set(primed_metadata) >= {"used", "unused"}
+        primed_metadata.pop("used")
+
+    assert "unused" not in primed_metadata
+
+
+def test_probe_study_falls_back_when_listing_fails():
+    class ForbiddenBucket:
+        base_uri = "https://s3.example.org/bucket/"
+
+        def list(self, prefix):
+            raise requests.HTTPError("403 Forbidden")
+
+    uris = [f"{ForbiddenBucket.base_uri}S-TEST/a.zarr"]
+    assert probe_study(ForbiddenBucket(), "S-TEST", uris) == {}
+
+
+def test_concurrent_listings_of_a_study_are_coalesced():
+    barrier = threading.Barrier(2, timeout=5)
+    listed = threading.Event()
+    n_listings = 0
+
+    class SlowBucket:
+        def list(self, prefix):
+            nonlocal n_listings
+            n_listings += 1
+            # Hold the listing until the other caller has asked for it
+            listed.wait(timeout=5)
+            yield f"{prefix}a.zarr/.zattrs"
+
+    bucket = SlowBucket()
+
+    def list_keys():
+        barrier.wait()
+        return study_metadata_keys(bucket, "S-TEST")
+
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        futures = [executor.submit(list_keys) for _ in range(2)]
+        time.sleep(0.1)
+        listed.set()
+        results = [future.result() for future in futures]
+
+    assert n_listings == 1
+    assert results == [frozenset(["S-TEST/a.zarr/.zattrs"])] * 2
@@ -0,0 +1,57 @@
+import os
+
+import pytest
+
+from bia_export.cachebundle import entry_fpath, pack_cache, unpack_cache
+
+
+def write(fpath, text, mtime):
+    fpath.parent.mkdir(exist_ok=True, parents=True)
+    fpath.write_text(text)
+    os.utime(fpath, (mtime, mtime))
+
+
+def test_pack_and_unpack(tmp_path):
+    source = tmp_path / "source"
+    write(source / "images" / "a.json", "{}", 1000)
+    write(source / "images" / "b.json", "{}", 1000)
+    write(source / "datasets" / "c.json", '{"c": 1}', 1000)
+    write(source / "datasets" / "d.json", '{"d": 1}', 1000)
+    write(source / "other" / "e.json", "{}", 1000)
+
+    bundle_fpath = tmp_path / "bundle.tar.gz"
+    index = pack_cache(source, bundle_fpath)
+    assert sorted(index.entries) == [
+        "datasets/c.json",
+        "datasets/d.json",
+        "images/a.json",
+        "images/b.json",
+    ]
+
+    # Packing the same cache again gives the same bundle
+    bundle = bundle_fpath.read_bytes()
+    pack_cache(source, bundle_fpath)
+    assert bundle_fpath.read_bytes() == bundle
+
+    # A newer entry is kept, an older one, or one in another format, replaced
+    destination = tmp_path / "destination"
+    write(destination / "datasets" / "c.json", "newer", 2000)
+    write(destination / "datasets" / "d.msgpack", "older", 500)
+
+    result = unpack_cache(bundle_fpath, destination)
+    assert result == (3, 1, 0)
+    assert (destination / "images" / "b.json").read_text() == "{}"
+    assert (destination / "images" / "b.json").stat().st_mtime == 1000
+    assert (destination / "datasets" / "c.json").read_text() == "newer"
+    assert (destination / "datasets" / "d.json").read_text() == '{"d": 1}'
+    assert not (destination / "datasets" / "d.msgpack").exists()
+
+    assert unpack_cache(bundle_fpath, destination) == (0, 4, 0)
+
+
+def test_bundle_entries_stay_in_the_cache(tmp_path):
+    assert entry_fpath(tmp_path, "images/a.json") == tmp_path / "images" / "a.json"
+
+    for name in ["../a.json", "images/../../a.json", "images/.a.json", "x/a.json"]:
+        with pytest.raises(ValueError):
+            entry_fpath(tmp_path, name)
@@ -0,0 +1,42 @@
+import pytest
+
+from bia_export.columnar import ParquetExportWriter
+from bia_export.models import ExportDataset, ExportImage
+from .utils import get_template_export_image
+
+pq = pytest.importorskip("pyarrow.parquet")
+
+
+def test_parquet_round_trip(tmp_path):
+    export_images = [
+        get_template_export_image(image_uuid=str(n), study_accession_id="S-BIAD1")
+        for n in range(5)
+    ]
+    export_images[0].attributes = {"key": "value"}
+
+    fpath = tmp_path / "images.parquet"
+    with ParquetExportWriter(fpath, ExportImage, row_group_size=2) as writer:
+        writer.add_all(export_images)
+
+    parquet_file = pq.ParquetFile(fpath)
+    assert parquet_file.num_row_groups == 3
+
+    rows = parquet_file.read().to_pylist()
+    assert [row["uuid"] for row in rows] == [str(n) for n in range(5)]
+    assert rows[0]["sizeX"] == 1
+    assert rows[0]["attributes"] == '{"key": "value"}'
+
+
+def test_parquet_keyed_records(tmp_path):
+    export_dataset = ExportDataset.construct(
+        **{name: None for name in ExportDataset.__fields__}
+    )
+    export_dataset.title = "A study"
+
+    fpath = tmp_path / "datasets.parquet"
+    with ParquetExportWriter(fpath, ExportDataset, key_column="key") as writer:
+        writer.add(export_dataset, key="S-BIAD1")
+
+    rows = pq.read_table(fpath).to_pylist()
+    assert rows[0]["key"] == "S-BIAD1"
+    assert rows[0]["title"] == "A study"
@@ -0,0 +1,114 @@
+import threading
+from types import SimpleNamespace
+
+import pytest
+from bia_integrator_api import exceptions as api_exceptions
+from bia_integrator_api import models as api_models
+
+from bia_export import cli, concurrency
+from bia_export.concurrency import AdaptiveLimiter, api_call_kind, api_congestion
+from bia_export.config import settings
+
+
+def run_calls(limiter, n, latency, congested=False, kind=""):
+    for _ in range(n):
+        limiter.acquire()
+        limiter.release(latency, congested, kind)
+
+
+def test_limit_increases_while_healthy_up_to_max():
+    limiter = AdaptiveLimiter("test", min_limit=1, max_limit=6)
+    start_limit = limiter.limit
+
+    run_calls(limiter, 20, latency=0.01)
+    assert limiter.limit > start_limit
+
+    run_calls(limiter, 200, latency=0.01)
+    assert limiter.limit == 6
+
+
+def test_limit_decreases_on_congestion_down_to_min():
+    limiter = AdaptiveLimiter("test", min_limit=2, max_limit=16)
+    run_calls(limiter, 200, latency=0.01)
+
+    run_calls(limiter, 1, latency=0.01, congested=True)
+    assert limiter.limit < 16
+
+    run_calls(limiter, 500, latency=0.01, congested=True)
+    assert limiter.limit == 2
+
+
+def test_limit_decreases_when_latency_rises():
+    limiter = AdaptiveLimiter("test", min_limit=1, max_limit=16)
+    run_calls(limiter, 200, latency=0.01)
+
+    run_calls(limiter, 20, latency=0.1)
+    assert limiter.limit < 16
+
+
+def test_slower_kinds_of_call_have_their_own_baseline():
+    limiter = AdaptiveLimiter("test", min_limit=1, max_limit=16)
+    for _ in range(100):
+        run_calls(limiter, 2, latency=0.01, kind="get_image")
+        run_calls(limiter, 1, latency=0.5, kind="search_images_exact_match[500]")
+
+    assert limiter.limit == 16
+
+
+def test_api_call_kind():
+    def search_images_exact_match(search_filter):
+        pass
+
+    def get_study_images(study_uuid, limit=10):
+        pass
+
+    search_filter = api_models.SearchImageFilter(study_uuid="uuid", limit=500)
+    assert (
+        api_call_kind(search_images_exact_match, (search_filter,), {})
+        == "search_images_exact_match[500]"
+    )
+    assert (
+        api_call_kind(get_study_images, ("uuid",), {"limit": 8})
+        == "get_study_images[8]"
+    )
+    assert api_call_kind(get_study_images, ("uuid",), {}) == "get_study_images"
+
+
+def test_api_congestion():
+    assert api_congestion(api_exceptions.ApiException(status=503))
+    assert not api_congestion(api_exceptions.ApiException(status=404))
+    assert api_congestion(TimeoutError())
+    assert not api_congestion(ValueError("invalid response"))
+
+
+def test_images_of_a_study_are_exported_concurrently(tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, "cache_root_dirpath", tmp_path)
+    monkeypatch.setattr(settings, "bulk_probe", False)
+    images = [SimpleNamespace(uuid=f"image-{n}", version=0) for n in range(4)]
+    study = SimpleNamespace(accession_id="S-TEST")
+
+    # Each image waits for all the others, so fails unless all run at once,
+    # though the study is exported by one thread
+    barrier = threading.Barrier(len(images), timeout=5)
+
+    def bia_image_to_export_image(image, study, sources):
+        barrier.wait()
+        return image.uuid
+
+    monkeypatch.setattr(cli, "bia_image_to_export_image", bia_image_to_export_image)
+    export_images = cli.study_uuid_to_export_images("uuid", study=study, images=images)
+
+    assert export_images == {image.uuid: image.uuid for image in images}
+
+
+def test_max_rate_spaces_out_call_starts(monkeypatch):
+    delays = []
+    monkeypatch.setattr(concurrency.time, "sleep", delays.append)
+
+    limiter = AdaptiveLimiter("test", min_limit=1, max_limit=16)
+    limiter.max_rate = 10.0
+    run_calls(limiter, 5, latency=0.01)
+
+    # The first call starts at once, the others at 0.1s intervals after it
+    assert len(delays) == 4
+    assert delays == pytest.approx([0.1, 0.2, 0.3, 0.4], abs=0.05)
@@ -0,0 +1,46 @@
+from types import SimpleNamespace
+
+from bia_export import discovery
+
+
+def test_discover_accession_ids(monkeypatch):
+    studies = [
+        SimpleNamespace(
+            uuid=f"uuid-{n}",
+            accession_id=f"S-TEST{n}",
+            images_count=n % 3,
+            attributes={"annotation_type": "masks"} if n % 2 else {},
+        )
+        for n in range(7)
+    ]
+    pages = []
+
+    def search_studies(start_uuid, limit):
+        pages.append(start_uuid)
+        start = 0 if start_uuid is None else int(start_uuid.split("-")[1]) + 1
+        return studies[start : start + limit]
+
+    monkeypatch.setattr(
+        discovery,
+        "rw_client",
+        SimpleNamespace(
+            search_studies=search_studies,
+            get_study=lambda uuid, apply_annotations: studies[int(uuid[5:])],
+        ),
+    )
+    # Study 5 has no OME-NGFF images
+    monkeypatch.setattr(
+        discovery, "study_has_rep_type", lambda uuid, rep_type: uuid != "uuid-5"
+    )
+
+    assert list(discovery.discover_accession_ids(page_size=3)) == [
+        "S-TEST1",
+        "S-TEST2",
+        "S-TEST4",
+    ]
+    assert pages == [None, "uuid-2", "uuid-5"]
+
+    ai_ids = discovery.discover_accession_ids(
+        any_of_attributes=discovery.AI_DATASET_ATTRIBUTES, page_size=3
+    )
+    assert list(ai_ids) == ["S-TEST1"]
@@ -0,0 +1,136 @@
+import threading
+from types import SimpleNamespace
+
+from bia_export import engine, scheduling
+from bia_export.config import settings
+
+
+def test_dataset_and_images_are_exported_concurrently(tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, "cache_root_dirpath", tmp_path)
+    study = SimpleNamespace(images_count=2, file_references_count=0)
+    get_study_calls = []
+
+    def get_study(study_uuid, apply_annotations=False):
+        get_study_calls.append(study_uuid)
+        return study
+
+    monkeypatch.setattr(engine, "get_study_uuid_by_accession_id", lambda a: "uuid")
+    monkeypatch.setattr(engine, "rw_client", SimpleNamespace(get_study=get_study))
+    monkeypatch.setattr(engine, "get_study_ome_ngff_images", lambda s: [])
+
+    # Each task waits for the other, so fails unless both run at once
+    barrier = threading.Barrier(2, timeout=5)
+
+    def dataset_builder(study_uuid, study, images):
+        barrier.wait()
+        return study
+
+    def images_exporter(study_uuid, image_filter, study, images):
+        barrier.wait()
+        return {"image": study}
+
+    export_engine = engine.ExportEngine(
+        images_exporter, dataset_builder=dataset_builder, workers=2
+    )
+    study_exports = list(export_engine.run(["S-TEST1"]))
+
+    assert get_study_calls == ["uuid"]
+    assert sorted(bool(study_export.dataset) for study_export in study_exports) == [
+        False,
+        True,
+    ]
+    assert {"image"} == {
+        key for study_export in study_exports for key in study_export.images
+    }
+
+
+def test_split_study_images_are_listed_once(tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, "cache_root_dirpath", tmp_path)
+    monkeypatch.setattr(settings, "schedule_unit_images_count", 2)
+    study = SimpleNamespace(images_count=6, file_references_count=0)
+    images = [SimpleNamespace(uuid=f"image-{n}") for n in range(6)]
+    listings = []
+
+    def list_images(study_uuid):
+        listings.append(study_uuid)
+        return images
+
+    monkeypatch.setattr(engine, "get_study_uuid_by_accession_id", lambda a: "uuid")
+    monkeypatch.setattr(
+        engine, "rw_client", SimpleNamespace(get_study=lambda *a, **k: study)
+    )
+    monkeypatch.setattr(engine, "get_study_ome_ngff_images", list_images)
+
+    def images_exporter(study_uuid, image_filter, study, images):
+        return {image.uuid: image for image in images if image_filter(image.uuid)}
+
+    # Datasets sample the same listing of images as is exported
+    def dataset_builder(study_uuid, study, images):
+        return images
+
+    export_engine = engine.ExportEngine(
+        images_exporter, dataset_builder=dataset_builder, workers=2
+    )
+    study_exports = list(export_engine.run(["S-TEST1"]))
+
+    assert listings == ["uuid"]
+    assert len(study_exports) == 4
+    assert [e.dataset for e in study_exports if e.dataset] == [images]
+    exported = [key for study_export in study_exports for key in study_export.images]
+    assert sorted(exported) == [image.uuid for image in images]
+
+
+def test_export_starts_before_accession_ids_are_exhausted(tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, "cache_root_dirpath", tmp_path)
+    study = SimpleNamespace(images_count=1, file_references_count=0)
+    monkeypatch.setattr(engine, "get_study_uuid_by_accession_id", lambda a: a)
+    monkeypatch.setattr(
+        engine, "rw_client", SimpleNamespace(get_study=lambda *a, **k: study)
+    )
+    monkeypatch.setattr(engine, "get_study_ome_ngff_images", lambda s: [])
+
+    first_exported = threading.Event()
+    exported_while_discovering = []
+
+    def discover():
+        # Like discovery, slow to produce the next ID
+        yield "S-TEST1"
+        exported_while_discovering.append(first_exported.wait(timeout=5))
+        yield "S-TEST2"
+
+    def images_exporter(study_uuid, image_filter, study, images):
+        first_exported.set()
+        return {study_uuid: study}
+
+    export_engine = engine.ExportEngine(images_exporter, workers=2)
+    study_exports = list(export_engine.run(discover()))
+
+    assert exported_while_discovering == [True]
+    assert sorted(key for e in study_exports for key in e.images) == [
+        "S-TEST1",
+        "S-TEST2",
+    ]
+
+
+def test_study_timings_are_only_recorded_if_asked(tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, "cache_root_dirpath", tmp_path)
+    study = SimpleNamespace(images_count=1, file_references_count=0)
+
+    monkeypatch.setattr(engine, "get_study_uuid_by_accession_id", lambda a: "uuid")
+    monkeypatch.setattr(
+        engine, "rw_client", SimpleNamespace(get_study=lambda *a, **k: study)
+    )
+    images = [SimpleNamespace(uuid="image")]
+    monkeypatch.setattr(engine, "get_study_ome_ngff_images", lambda s: images)
+
+    def images_exporter(study_uuid, image_filter, study, images):
+        return {}
+
+    def run(**kwargs):
+        list(engine.ExportEngine(images_exporter, **kwargs).run(["S-TEST1"]))
+        return scheduling.get_study_timing("S-TEST1")
+
+    assert run(record_timings=False) is None
+    # Exports from the image cache would understate the next cold export
+    assert run(image_is_cached=lambda uuid: True) is None
+    assert run(image_is_cached=lambda uuid: False) is not None
@@ -0,0 +1,92 @@
+from types import SimpleNamespace
+
+import aiohttp
+import pytest
+import requests
+from bia_integrator_api import exceptions as api_exceptions
+
+from bia_export import concurrency
+from bia_export.cli import drop_failed_image_uuids, sample_study_image_uuids
+from bia_export.concurrency import is_transient, retry_transient
+from bia_export.config import settings
+from bia_export.failure_cache import (
+    is_quarantined,
+    iter_failures,
+    record_failure,
+)
+from .utils import get_template_api_image
+
+
+def test_failures_are_quarantined_until_the_image_changes(
+    tmp_path, monkeypatch, bia_image, bia_study
+):
+    monkeypatch.setattr(settings, "cache_root_dirpath", tmp_path)
+    assert not is_quarantined(bia_image)
+
+    failure = record_failure(bia_image, bia_study, ValueError("no multiscales"))
+    assert failure.error_class == "ValueError"
+    assert is_quarantined(bia_image)
+    assert list(iter_failures()) == [failure]
+
+    changed_image = bia_image.copy(update={"version": bia_image.version + 1})
+    assert not is_quarantined(changed_image)
+    assert list(iter_failures()) == []
+
+
+@pytest.mark.parametrize(
+    "error, transient",
+    [
+        (api_exceptions.ApiException(status=503), True),
+        (api_exceptions.ApiException(status=429), True),
+        (api_exceptions.ApiException(status=404), False),
+        (requests.ConnectionError(), True),
+        (requests.HTTPError(response=SimpleNamespace(status_code=503)), True),
+        (requests.HTTPError(response=SimpleNamespace(status_code=413)), False),
+        (aiohttp.ClientResponseError(None, (), status=503), True),
+        (aiohttp.ClientResponseError(None, (), status=429), True),
+        (aiohttp.ClientResponseError(None, (), status=403), False),
+        (TimeoutError(), True),
+        (KeyError(".zattrs"), False),
+        (ValueError("no multiscales"), False),
+    ],
+)
+def test_is_transient(error, transient):
+    assert is_transient(error) == transient
+
+
+def test_retry_transient(monkeypatch):
+    monkeypatch.setattr(concurrency.time, "sleep", lambda s: None)
+    monkeypatch.setattr(settings, "transient_retries", 2)
+    calls = []
+
+    def flaky(errors):
+        calls.append(None)
+        if errors:
+            raise errors.pop(0)
+        return "ok"
+
+    assert retry_transient(flaky, [TimeoutError(), TimeoutError()]) == "ok"
+    assert len(calls) == 3
+
+    with pytest.raises(TimeoutError):
+        retry_transient(flaky, [TimeoutError()] * 3)
+
+    calls.clear()
+    with pytest.raises(KeyError):
+        retry_transient(flaky, [KeyError("missing")])
+    assert len(calls) == 1
+
+
+def test_quarantined_images_are_not_sampled_by_datasets(
+    tmp_path, monkeypatch, bia_study
+):
+    monkeypatch.setattr(settings, "cache_root_dirpath", tmp_path)
+    images = [get_template_api_image(image_uuid=f"image-{n}") for n in range(3)]
+    record_failure(images[0], bia_study, ValueError("no multiscales"))
+
+    assert sorted(sample_study_image_uuids(images, 3)) == ["image-1", "image-2"]
+
+    # Datasets built before the failure, or cached, drop it when exported
+    dataset = SimpleNamespace(image_uuids=["image-0", "image-1", "image-2"])
+    drop_failed_image_uuids({"S-TEST": dataset}, {"image-1": None})
+    assert dataset.image_uuids == ["image-1", "image-2"]
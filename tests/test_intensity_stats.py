@@ -0,0 +1,90 @@
+import json
+
+import numpy as np
+import pytest
+import zarr
+
+from bia_export import intensity_stats
+from bia_export.cli import unset_entry_fields
+from bia_export.intensity_stats import compute_channel_statistics, exact_histogram
+from bia_export.models import ExportChannelStatistics, Exports
+from .utils import get_template_export_image
+
+
+def write_test_ome_zarr(dirpath, data, chunks):
+    zgroup = zarr.open_group(str(dirpath), mode="w")
+    zgroup.create_dataset("0", data=data, chunks=chunks)
+    zgroup.attrs["multiscales"] = [
+        {
+            "datasets": [
+                {
+                    "path": "0",
+                    "coordinateTransformations": [
+                        {"type": "scale", "scale": [1.0, 1.0, 1.0, 1.0, 1.0]}
+                    ],
+                }
+            ],
+            "metadata": {"method": "test", "version": "0"},
+            "axes": None,
+            "version": "0.4",
+        }
+    ]
+    zgroup.attrs["omero"] = None
+
+
+def test_compute_channel_statistics(tmp_path):
+    data = np.random.default_rng(0).integers(0, 1000, size=(1, 2, 3, 100, 100))
+    write_test_ome_zarr(tmp_path, data.astype("uint16"), chunks=(1, 1, 1, 32, 32))
+
+    statistics = compute_channel_statistics(str(tmp_path), min_plane_pixels=1)
+
+    assert [s.channel for s in statistics] == [0, 1]
+    for s in statistics:
+        channel_data = data[:, s.channel]
+        assert s.min == channel_data.min()
+        assert s.max == channel_data.max()
+        assert np.isclose(s.mean, channel_data.mean())
+        assert s.percentiles["p50"] == np.percentile(
+            channel_data, 50, method="inverted_cdf"
+        )
+
+
+@pytest.mark.parametrize("dtype", ["uint8", "int8", "int16", ">i2"])
+def test_exact_histogram(monkeypatch, dtype):
+    monkeypatch.setattr(intensity_stats, "BINCOUNT_BATCH_VALUES", 7)
+    dtype_info = np.iinfo(dtype)
+    values = np.array(
+        [dtype_info.min, -1 if dtype_info.min else 1, 0, 0, dtype_info.max] * 3,
+        dtype=dtype,
+    )
+    n_bins = int(dtype_info.max) - int(dtype_info.min) + 1
+
+    histogram = exact_histogram(values, n_bins)
+
+    expected = np.bincount(values.astype(np.int64) - dtype_info.min, minlength=n_bins)
+    assert (histogram == expected).all()
+
+
+def test_levels_with_oversized_chunks_are_skipped(tmp_path):
+    data = np.zeros((1, 1, 1, 64, 64), dtype="uint16")
+    write_test_ome_zarr(tmp_path, data, chunks=(1, 1, 1, 64, 64))
+
+    with pytest.raises(ValueError):
+        compute_channel_statistics(
+            str(tmp_path), min_plane_pixels=1, max_chunk_bytes=1024
+        )
+
+
+def test_unset_channel_statistics_are_not_exported():
+    statistics = ExportChannelStatistics(channel=0, min=0, max=1, mean=0.5)
+    images = {
+        "a": get_template_export_image(image_uuid="a"),
+        "b": get_template_export_image(image_uuid="b"),
+    }
+    images["b"].channel_statistics = [statistics]
+
+    exclude = {"images": unset_entry_fields(images, ["channel_statistics"])}
+    exported = json.loads(Exports(images=images).json(exclude=exclude))
+
+    assert "channel_statistics" not in exported["images"]["a"]
+    assert exported["images"]["b"]["channel_statistics"] == [statistics.dict()]
@@ -0,0 +1,63 @@
+import json
+
+import pytest
+
+from bia_export import jsonstream
+from bia_export.jsonstream import (
+    ExportFileFormatError,
+    ExportFileWriter,
+    iter_export_entries,
+    read_export_value,
+)
+
+EXPORT = {
+    "collections": {},
+    "datasets": {"S-BIAD1": {"title": 'A "quoted" title', "n": 1.5e-3}},
+    "images": {
+        f"uuid-{n:02d}": {"name": f"image {n}", "sizes": [n, n * 10], "nested": {}}
+        for n in range(20)
+    },
+    "shard": {"count": 2, "index": 1},
+}
+
+
+def write_export(fpath, export):
+    with open(fpath, "w") as fh:
+        writer = ExportFileWriter(fh)
+        for section, value in export.items():
+            if section == "shard":
+                writer.write_value(section, value)
+                continue
+            writer.begin_section(section)
+            for key, entry in value.items():
+                writer.write_entry(key, entry)
+            writer.end_section()
+        writer.close()
+
+
+@pytest.mark.parametrize("read_size", [1, 7, 2**20])
+def test_round_trip(tmp_path, monkeypatch, read_size):
+    monkeypatch.setattr(jsonstream, "READ_SIZE", read_size)
+    fpath = tmp_path / "export.json"
+    write_export(fpath, EXPORT)
+
+    # The writer lays files out as json.dumps does
+    assert fpath.read_text() == json.dumps(EXPORT, indent=2, sort_keys=True)
+
+    for section in ["collections", "datasets", "images"]:
+        assert dict(iter_export_entries(fpath, section)) == EXPORT[section]
+    assert read_export_value(fpath, "shard") == EXPORT["shard"]
+    assert read_export_value(fpath, "missing") is None
+
+    # Compact files, as written by other tools, read the same
+    fpath.write_text(json.dumps(EXPORT))
+    assert dict(iter_export_entries(fpath, "images")) == EXPORT["images"]
+
+
+def test_truncated_file(tmp_path):
+    fpath = tmp_path / "export.json"
+    text = json.dumps(EXPORT)
+    fpath.write_text(text[: len(text) // 2])
+
+    with pytest.raises(ExportFileFormatError):
+        list(iter_export_entries(fpath, "images"))
@@ -0,0 +1,78 @@
+import functools
+import http.server
+import json
+import threading
+
+import fsspec
+import pytest
+
+from bia_export.bulkprobe import FilesystemBucket
+from bia_export.config import settings
+from bia_export.linkcheck import check_export_links, link_target
+
+
+@pytest.fixture
+def http_root(tmp_path):
+    """Serve tmp_path/www over HTTP, yielding its base URI."""
+
+    www = tmp_path / "www"
+    www.mkdir()
+    class QuietHandler(http.server.SimpleHTTPRequestHandler):
+        def log_message(self, *args):
+            pass
+
+    handler = functools.partial(QuietHandler, directory=str(www))
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield www, f"http://127.0.0.1:{server.server_port}"
+    server.shutdown()
+
+
+def test_link_target():
+    assert link_target("https://viewer/index.html?source=https://a/b.zarr/0") == (
+        "https://a/b.zarr/0"
+    )
+    assert link_target("https://a/thumbnail.png") == "https://a/thumbnail.png"
+
+
+def test_check_export_links(tmp_path, http_root, monkeypatch):
+    www, base_uri = http_root
+    (www / "thumbnail.png").write_bytes(b"png")
+    (www / "image.zarr").mkdir()
+    (www / "image.zarr" / ".zattrs").write_text("{}")
+
+    bucket_root = tmp_path / "bucket"
+    (bucket_root / "S-TEST").mkdir(parents=True)
+    (bucket_root / "S-TEST" / "listed.png").write_bytes(b"png")
+    bucket = FilesystemBucket(fsspec.filesystem("file"), str(bucket_root))
+    monkeypatch.setattr(settings, "link_check_list_min_uris", 1)
+
+    images = {
+        "a": {
+            "thumbnail_uri": f"{base_uri}/thumbnail.png",
+            "vizarr_uri": f"https://viewer/?source={base_uri}/image.zarr",
+            "overlay_image_uri": f"{bucket.base_uri}S-TEST/listed.png",
+        },
+        "b": {
+            "thumbnail_uri": f"{base_uri}/missing.png",
+            "vizarr_uri": f"https://viewer/?source={base_uri}/missing.zarr",
+            "overlay_image_uri": f"{bucket.base_uri}S-TEST/unlisted.png",
+        },
+    }
+    fpath = tmp_path / "export.json"
+    fpath.write_text(json.dumps({"datasets": {}, "images": images}))
+
+    n_references, missing_targets = check_export_links(fpath, bucket)
+
+    assert n_references == 6
+    assert {
+        target.target: (target.status, target.references)
+        for target in missing_targets
+    } == {
+        f"{base_uri}/missing.png": ("404", ["images/b/thumbnail_uri"]),
+        f"{base_uri}/missing.zarr": ("404", ["images/b/vizarr_uri"]),
+        f"{bucket.base_uri}S-TEST/unlisted.png": (
+            "not listed",
+            ["images/b/overlay_image_uri"],
+        ),
+    }
@@ -0,0 +1,107 @@
+import os
+
+import pytest
+
+from bia_export import outputs
+from bia_export.outputs import (
+    MANIFEST_FNAME,
+    OutputManifest,
+    atomic_output,
+    atomic_output_path,
+    hash_file,
+    write_manifest,
+)
+
+
+@pytest.fixture(autouse=True)
+def clear_recorded_outputs(monkeypatch):
+    monkeypatch.setattr(outputs, "recorded_outputs", {})
+
+
+def test_atomic_output_writes_and_records(tmp_path):
+    fpath = tmp_path / "out" / "export.json"
+    with atomic_output(fpath) as fh:
+        fh.write("{}")
+        assert not fpath.exists()
+
+    assert fpath.read_text() == "{}"
+    assert outputs.recorded_outputs[fpath].sha256 == hash_file(fpath)[0]
+    assert outputs.recorded_outputs[fpath].size == 2
+    assert os.listdir(fpath.parent) == ["export.json"]
+
+
+def test_unchanged_output_is_left_untouched(tmp_path):
+    fpath = tmp_path / "export.json"
+    fpath.write_text("{}")
+    os.utime(fpath, (0, 0))
+
+    with atomic_output(fpath) as fh:
+        fh.write("{}")
+    assert fpath.stat().st_mtime == 0
+
+    with atomic_output(fpath) as fh:
+        fh.write("[]")
+    assert fpath.read_text() == "[]"
+    assert fpath.stat().st_mtime > 0
+
+
+def test_failed_output_leaves_destination_alone(tmp_path):
+    fpath = tmp_path / "export.json"
+    fpath.write_text("{}")
+
+    with pytest.raises(RuntimeError):
+        with atomic_output(fpath) as fh:
+            fh.write("[")
+            raise RuntimeError("export failed")
+
+    assert fpath.read_text() == "{}"
+    assert os.listdir(tmp_path) == ["export.json"]
+    assert fpath not in outputs.recorded_outputs
+
+
+def test_commit(tmp_path):
+    fpath = tmp_path / "export.json"
+    tmp_fpath = tmp_path / ".export.json.tmp"
+    tmp_fpath.write_text("{}")
+
+    assert outputs._commit(tmp_fpath, fpath, *hash_file(tmp_fpath))
+    assert fpath.read_text() == "{}"
+    assert not tmp_fpath.exists()
+
+    tmp_fpath.write_text("{}")
+    assert not outputs._commit(tmp_fpath, fpath, *hash_file(tmp_fpath))
+
+
+def test_atomic_output_path(tmp_path):
+    fpath = tmp_path / "images.parquet"
+    with atomic_output_path(fpath) as tmp_fpath:
+        assert tmp_fpath.parent == tmp_path
+        tmp_fpath.write_bytes(b"PAR1")
+
+    assert fpath.read_bytes() == b"PAR1"
+    assert os.listdir(tmp_path) == ["images.parquet"]
+
+
+def test_write_manifest(tmp_path):
+    with atomic_output(tmp_path / "export.json") as fh:
+        fh.write("{}")
+    with atomic_output(tmp_path / "index" / "facets.json") as fh:
+        fh.write("[]")
+
+    manifest_fpath = write_manifest(tmp_path, shard="0/2")
+    assert manifest_fpath == tmp_path / MANIFEST_FNAME
+    assert outputs.recorded_outputs == {}
+
+    manifest = OutputManifest.parse_file(manifest_fpath)
+    assert list(manifest.outputs) == ["export.json", "index/facets.json"]
+    assert manifest.outputs["export.json"].size == 2
+    assert manifest.outputs["export.json"].shard == "0/2"
+
+    # Later runs add to the manifest
+    with atomic_output(tmp_path / "other.json") as fh:
+        fh.write("{}")
+    write_manifest(tmp_path)
+
+    manifest = OutputManifest.parse_file(manifest_fpath)
+    assert list(manifest.outputs) == ["export.json", "index/facets.json", "other.json"]
+    assert manifest.outputs["other.json"].shard is None
@@ -0,0 +1,38 @@
+from types import SimpleNamespace
+
+from typer.testing import CliRunner
+
+from bia_export import cli
+from bia_export.concurrency import api_limiter, zarr_limiter
+
+
+def test_prefetch_runs_studies_at_the_given_rate(monkeypatch):
+    monkeypatch.setattr(cli.os, "nice", lambda increment: None)
+    monkeypatch.setattr(api_limiter, "max_rate", None)
+    monkeypatch.setattr(zarr_limiter, "max_rate", None)
+
+    runs = []
+
+    class Engine:
+        def __init__(self, image_exporter, workers=None, record_timings=True):
+            self.workers = workers
+            # Rate limited runs would overstate export times
+            assert not record_timings
+
+        def run(self, accession_ids):
+            for accession_id in accession_ids:
+                runs.append((accession_id, self.workers))
+                yield SimpleNamespace(images={f"{accession_id}-image": None})
+
+    monkeypatch.setattr(cli, "ExportEngine", Engine)
+
+    result = CliRunner().invoke(cli.app, ["prefetch", "S-A", "S-B", "--rate", "2"])
+    assert result.exit_code == 0, result.output
+    assert runs == [("S-A", 1), ("S-B", 1)]
+    assert api_limiter.max_rate == 2.0
+    assert zarr_limiter.max_rate == 2.0
+
+
+def test_prefetch_needs_studies():
+    result = CliRunner().invoke(cli.app, ["prefetch"])
+    assert result.exit_code != 0
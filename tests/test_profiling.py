@@ -0,0 +1,50 @@
+import time
+import tracemalloc
+
+from bia_export.profiling import Profiler, collapse_stack
+
+
+def export_studies(profiler, accession_ids):
+    for accession_id in accession_ids:
+        with profiler.study(accession_id):
+            # Allocate and hold something per study
+            data = [bytearray(1024) for _ in range(100)]
+            time.sleep(0.02)
+            del data
+
+
+def test_collapse_stack():
+    def inner():
+        import sys
+
+        return collapse_stack(sys._getframe())
+
+    assert inner().endswith("tests.test_profiling:inner")
+
+
+def test_cpu_profiling_does_not_trace_allocations(tmp_path):
+    profiler = Profiler(interval=0.001)
+    profiler.start()
+    assert not tracemalloc.is_tracing()
+
+    export_studies(profiler, ["S-A", "S-B"])
+    profiler.stop()
+    profiler.write(tmp_path)
+
+    assert profiler.study_allocations == {}
+    assert (tmp_path / "stacks.collapsed").exists()
+    assert not (tmp_path / "allocations.txt").exists()
+
+
+def test_memory_profiling_samples_studies(tmp_path):
+    profiler = Profiler(interval=0.001, memory=True, memory_study_interval=2)
+    profiler.start()
+    assert tracemalloc.is_tracing()
+
+    export_studies(profiler, ["S-A", "S-B", "S-C"])
+    profiler.stop()
+    profiler.write(tmp_path)
+
+    assert not tracemalloc.is_tracing()
+    assert set(profiler.study_allocations) == {"S-A", "S-C"}
+    assert "while exporting S-C" in (tmp_path / "allocations.txt").read_text()
@@ -0,0 +1,41 @@
+import pytest
+
+from bia_export.projection import (
+    ALL_SOURCES,
+    IMAGE_FIELD_PROFILES,
+    common_image_fields,
+    parse_image_fields,
+    projected_image_model,
+    required_sources,
+)
+
+
+def test_parse_image_fields():
+    assert parse_image_fields("light") == frozenset(IMAGE_FIELD_PROFILES["light"])
+    assert parse_image_fields("uuid, name") == {"uuid", "name"}
+
+    with pytest.raises(ValueError):
+        parse_image_fields("uuid,no_such_field")
+
+
+def test_required_sources():
+    assert required_sources(None) == ALL_SOURCES
+    assert required_sources(parse_image_fields("listing")) == frozenset()
+    assert required_sources(parse_image_fields("light")) == {"ome_zarr"}
+
+    # Biosamples are only reached through acquisitions and specimens
+    assert required_sources(frozenset(["uuid", "biosample_title"])) == {
+        "image_acquisitions",
+        "specimens",
+        "biosamples",
+    }
+
+
+def test_projected_image_model():
+    model_cls = projected_image_model(frozenset(["uuid", "name"]))
+    assert model_cls.__fields__.keys() == {"uuid", "name"}
+    assert model_cls.__fields__["uuid"].required
+
+    assert common_image_fields(None, None) is None
+    assert common_image_fields(["uuid", "name"], None) == {"uuid", "name"}
+    assert common_image_fields(["uuid", "name"], ["uuid"]) == {"uuid"}
@@ -0,0 +1,165 @@
+import json
+
+import numpy as np
+import zarr
+
+from bia_export import proxyimage
+from bia_export.omezarrmeta import ZMeta
+from bia_export.proxyimage import (
+    calculate_voxel_to_physical_factors,
+    ome_zarr_image_from_metadata,
+    read_ome_zarr_metadata,
+    scales_from_ngff_metadata,
+)
+
+
+def get_template_ngff_metadata(axes, level_scales) -> ZMeta:
+    return ZMeta.parse_obj(
+        {
+            "omero": None,
+            "multiscales": [
+                {
+                    "datasets": [
+                        {
+                            "path": str(n),
+                            "coordinateTransformations": [
+                                {"type": "scale", "scale": scale}
+                            ],
+                        }
+                        for n, scale in enumerate(level_scales)
+                    ],
+                    "metadata": {"method": "test", "version": "0"},
+                    "axes": axes,
+                    "version": "0.4",
+                }
+            ],
+        }
+    )
+
+
+def test_axis_index_with_3d_axes():
+    ngff_metadata = get_template_ngff_metadata(
+        axes=[
+            {"name": "c", "type": "channel"},
+            {"name": "y", "type": "space", "unit": "micrometer"},
+            {"name": "x", "type": "space", "unit": "micrometer"},
+        ],
+        level_scales=[[1.0, 0.5, 0.5], [1.0, 1.0, 1.0]],
+    )
+    axis_index = ngff_metadata.axis_index
+
+    assert axis_index.position("x") == 2
+    assert axis_index.position("z") is None
+    assert axis_index.size("c", (3, 20, 10)) == 3
+    assert axis_index.size("t", (3, 20, 10)) == 1
+
+    assert calculate_voxel_to_physical_factors(ngff_metadata) == {
+        "PhysicalSizeX": 0.5e-6,
+        "PhysicalSizeY": 0.5e-6,
+    }
+    assert scales_from_ngff_metadata(ngff_metadata) == {
+        "n_scales": 2,
+        "xy_scaling": 2.0,
+        "z_scaling": 1.0,
+    }
+
+
+def test_axis_index_without_axes_assumes_tczyx():
+    ngff_metadata = get_template_ngff_metadata(
+        axes=None, level_scales=[[1.0, 1.0, 2.0, 0.5, 0.5]]
+    )
+
+    assert ngff_metadata.axis_index.positions == {
+        "t": 0,
+        "c": 1,
+        "z": 2,
+        "y": 3,
+        "x": 4,
+    }
+    assert ngff_metadata.axis_index.scale("z") == 2.0
+
+
+def test_ome_zarr_image_from_metadata():
+    ngff_metadata = get_template_ngff_metadata(
+        axes=None, level_scales=[[1.0, 1.0, 2.0, 0.5, 0.5]]
+    )
+    metadata = {
+        "attrs": ngff_metadata.dict(),
+        "arrays": {
+            "0": {"shape": [1, 2, 5, 20, 10], "chunks": [1, 1, 1, 20, 10]},
+        },
+    }
+
+    ome_zarr_image = ome_zarr_image_from_metadata(metadata)
+
+    assert (ome_zarr_image.sizeX, ome_zarr_image.sizeY) == (10, 20)
+    assert (ome_zarr_image.sizeZ, ome_zarr_image.sizeC) == (5, 2)
+    assert ome_zarr_image.PhysicalSizeZ == 2.0
+
+
+def test_read_zarr_v3_metadata_with_sharding(tmp_path):
+    ngff_metadata = get_template_ngff_metadata(
+        axes=None, level_scales=[[1.0, 1.0, 2.0, 0.5, 0.5]]
+    )
+    multiscale = ngff_metadata.dict()["multiscales"][0]
+    multiscale.pop("version")
+    (tmp_path / "zarr.json").write_text(
+        json.dumps(
+            {
+                "zarr_format": 3,
+                "node_type": "group",
+                "attributes": {"ome": {"version": "0.5", "multiscales": [multiscale]}},
+            }
+        )
+    )
+    (tmp_path / "0").mkdir()
+    (tmp_path / "0" / "zarr.json").write_text(
+        json.dumps(
+            {
+                "zarr_format": 3,
+                "node_type": "array",
+                "shape": [1, 2, 5, 200, 100],
+                "data_type": "uint16",
+                "chunk_grid": {
+                    "name": "regular",
+                    "configuration": {"chunk_shape": [1, 1, 5, 200, 100]},
+                },
+                "codecs": [
+                    {
+                        "name": "sharding_indexed",
+                        "configuration": {"chunk_shape": [1, 1, 1, 50, 50]},
+                    }
+                ],
+            }
+        )
+    )
+
+    ome_zarr_image = ome_zarr_image_from_metadata(read_ome_zarr_metadata(str(tmp_path)))
+
+    assert (ome_zarr_image.sizeX, ome_zarr_image.sizeY) == (100, 200)
+    assert (ome_zarr_image.sizeZ, ome_zarr_image.sizeC) == (5, 2)
+    assert ome_zarr_image.zarr_format == 3
+    assert ome_zarr_image.chunk_shape == [1, 1, 1, 50, 50]
+    assert ome_zarr_image.shard_shape == [1, 1, 5, 200, 100]
+    assert ome_zarr_image.ngff_metadata.multiscales[0].version == "0.5"
+
+
+def test_read_zarr_v2_metadata_when_zarr_json_is_forbidden(tmp_path, monkeypatch):
+    ngff_metadata = get_template_ngff_metadata(
+        axes=None, level_scales=[[1.0, 1.0, 2.0, 0.5, 0.5]]
+    )
+    zgroup = zarr.open_group(str(tmp_path), mode="w")
+    zgroup.attrs.put(ngff_metadata.dict())
+    zgroup.create_dataset("0", data=np.zeros((1, 2, 5, 20, 10), dtype="uint16"))
+
+    # Like S3 without list permission, which answers 403 for missing keys
+    class ForbiddingMapper(dict):
+        def __getitem__(self, key):
+            raise PermissionError(f"Forbidden: {key}")
+
+    monkeypatch.setattr(proxyimage.fsspec, "get_mapper", lambda uri: ForbiddingMapper())
+
+    ome_zarr_image = ome_zarr_image_from_metadata(read_ome_zarr_metadata(str(tmp_path)))
+
+    assert (ome_zarr_image.sizeX, ome_zarr_image.sizeY) == (10, 20)
+    assert ome_zarr_image.zarr_format == 2
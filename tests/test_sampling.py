@@ -0,0 +1,49 @@
+import random
+import uuid
+
+from bia_integrator_api import models as api_models
+
+from bia_export.sampling import (
+    allocate,
+    attribute_stratum,
+    sample_images,
+)
+
+
+def make_images(n: int, kind: str = "a") -> list[api_models.BIAImage]:
+    return [
+        api_models.BIAImage.construct(
+            uuid=str(uuid.UUID(int=random.getrandbits(128))),
+            attributes={"kind": kind},
+            representations=[],
+        )
+        for _ in range(n)
+    ]
+
+
+def test_sample_is_deterministic_and_independent_of_order():
+    random.seed(1)
+    images = make_images(100)
+
+    sample = sample_images(images, 8, seed=3)
+    assert len(sample) == 8
+    assert sample == sorted(sample, key=lambda image: image.uuid)
+    assert sample_images(reversed(images), 8, seed=3) == sample
+    assert sample_images(images, 8, seed=4) != sample
+    assert sample_images(images[:5], 8) == sorted(images[:5], key=lambda i: i.uuid)
+
+
+def test_stratified_sample_represents_every_stratum():
+    random.seed(2)
+    images = make_images(90, "common") + make_images(9, "rare") + make_images(1, "x")
+
+    sample = sample_images(images, 10, stratum=attribute_stratum("kind"))
+    kinds = [image.attributes["kind"] for image in sample]
+    assert len(sample) == 10
+    assert kinds.count("rare") == 1 and kinds.count("x") == 1
+
+
+def test_allocate():
+    assert allocate(10, {"a": 90, "b": 9, "c": 1}) == {"a": 8, "b": 1, "c": 1}
+    assert allocate(2, {"a": 5, "b": 3, "c": 1}) == {"a": 1, "b": 1, "c": 0}
+    assert allocate(10, {"a": 2, "b": 3}) == {"a": 2, "b": 3}
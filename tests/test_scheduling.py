@@ -0,0 +1,30 @@
+from bia_export import scheduling
+from bia_export.config import settings
+
+
+def test_estimated_cost_uses_recorded_timing(tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, "cache_root_dirpath", tmp_path)
+
+    unrecorded_cost = scheduling.estimate_study_cost("S-TEST1", 10, 0)
+    assert unrecorded_cost == (
+        settings.schedule_study_seconds + 10 * settings.schedule_image_seconds
+    )
+
+    scheduling.record_study_timing("S-TEST1", images_count=10, seconds=30.0)
+    assert scheduling.estimate_study_cost("S-TEST1", 20, 0) == 60.0
+
+
+def test_work_units_partition_images():
+    image_uuids = [f"image-{n}" for n in range(1000)]
+    n_parts = scheduling.study_work_unit_count(len(image_uuids))
+    assert n_parts == 1000 // settings.schedule_unit_images_count
+
+    owners = [
+        [
+            part
+            for part in range(n_parts)
+            if scheduling.work_unit_owns_image(part, n_parts, image_uuid)
+        ]
+        for image_uuid in image_uuids
+    ]
+    assert all(len(parts) == 1 for parts in owners)
@@ -0,0 +1,36 @@
+import json
+
+from bia_export.search_index import SearchIndexBuilder
+from .utils import get_template_export_image
+
+
+def test_search_index(tmp_path):
+    first = get_template_export_image(image_uuid="a", study_accession_id="S-BIAD1")
+    first.name = "Mouse kidney section"
+    second = get_template_export_image(image_uuid="b", study_accession_id="S-BIAD2")
+    second.name = "Mouse liver of the week"
+    second.biosample_organism_scientific_name = "Mus musculus"
+    second.sizeX = 1000
+
+    builder = SearchIndexBuilder()
+    builder.add_image(first)
+    builder.add_image(second)
+    builder.write(tmp_path)
+
+    facets = json.loads((tmp_path / "facets.json").read_text())
+    assert facets["images"]["study"] == {"S-BIAD1": ["a"], "S-BIAD2": ["b"]}
+    assert facets["images"]["organism"]["Mus musculus"] == ["b"]
+    assert facets["images"]["size"] == {"1e0": ["a"], "1e3": ["b"]}
+
+    tokens = json.loads((tmp_path / "tokens.json").read_text())
+    assert tokens["documents"] == [["image", "a"], ["image", "b"]]
+    assert tokens["postings"]["mouse"] == [0, 1]
+    assert tokens["postings"]["kidney"] == [0]
+    # Stopwords are not indexed
+    assert "the" not in tokens["postings"]
+
+    prefixes = json.loads((tmp_path / "prefixes.json").read_text())
+    assert prefixes["kid"] == ["kidney"]
+    assert prefixes["mou"] == ["mouse"]
+    assert "we" not in prefixes
+    assert prefixes["wee"] == ["week"]
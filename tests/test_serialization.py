@@ -0,0 +1,64 @@
+import pytest
+
+from bia_export.config import settings
+from bia_export.models import ExportImage
+from bia_export.serialization import (
+    SERIALIZERS,
+    JSONSerializer,
+    Serializer,
+    read_cache_entry,
+    write_cache_entry,
+)
+from .utils import get_template_export_image
+
+
+@pytest.mark.parametrize("name", SERIALIZERS)
+def test_serializer_round_trip(name):
+    try:
+        serializer = SERIALIZERS[name]()
+    except ImportError:
+        pytest.skip(f"{name} is not installed")
+
+    export_image = get_template_export_image()
+    data = serializer.dumps(export_image)
+
+    assert serializer.loads(data, ExportImage) == export_image
+
+
+def test_cache_entries_survive_a_change_of_serializer(tmp_path, monkeypatch):
+    export_image = get_template_export_image()
+    write_cache_entry(tmp_path, "key", export_image)
+
+    for name in SERIALIZERS:
+        monkeypatch.setattr(settings, "cache_serializer", name)
+        assert read_cache_entry(tmp_path, "key", ExportImage) == export_image
+
+    assert read_cache_entry(tmp_path, "missing", ExportImage) is None
+
+
+def test_serializers_must_implement_dumps_and_loads():
+    class PartialSerializer(Serializer):
+        name = "partial"
+        suffix = ".partial"
+
+        def dumps(self, obj):
+            return b""
+
+    with pytest.raises(TypeError):
+        PartialSerializer()
+
+
+def test_cache_entries_are_written_atomically(tmp_path, monkeypatch):
+    export_image = get_template_export_image()
+    write_cache_entry(tmp_path, "key", export_image)
+
+    def failing_dumps(self, obj):
+        raise RuntimeError("serialization failed")
+
+    monkeypatch.setattr(JSONSerializer, "dumps", failing_dumps)
+    with pytest.raises(RuntimeError):
+        write_cache_entry(tmp_path, "key", export_image)
+
+    # The earlier entry survives, and no temporary file is left
+    assert read_cache_entry(tmp_path, "key", ExportImage) == export_image
+    assert [fpath.name for fpath in tmp_path.iterdir()] == ["key.json"]
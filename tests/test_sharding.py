@@ -0,0 +1,106 @@
+import json
+
+import pytest
+
+from bia_export.jsonstream import iter_export_entries
+from bia_export.sharding import merge_shards, parse_shard, shard_index_for
+from .utils import get_template_export_image
+
+
+def write_shard(fpath, index, count, datasets, images, image_fields=None):
+    export = {
+        "collections": {},
+        "datasets": datasets,
+        "images": {image.uuid: json.loads(image.json()) for image in images},
+        "shard": {"index": index, "count": count},
+    }
+    if image_fields:
+        export["image_fields"] = image_fields
+    fpath.write_text(json.dumps(export, indent=2, sort_keys=True))
+
+
+def make_image(image_uuid, sizeX):
+    export_image = get_template_export_image(
+        image_uuid=image_uuid, study_accession_id="S-BIAD1"
+    )
+    export_image.sizeX = sizeX
+    return export_image
+
+
+def test_parse_shard():
+    assert parse_shard("1/4").index == 1
+    for spec in ["4/4", "1", "a/b"]:
+        with pytest.raises(ValueError):
+            parse_shard(spec)
+
+    assert shard_index_for("S-BIAD1", 4) == shard_index_for("S-BIAD1", 4)
+
+
+def test_merge_shards(tmp_path):
+    # The study's images are split across shards, its dataset is in shard 0,
+    # with aggregates over only that shard's images
+    dataset = {"title": "A study", "image_uuids": ["a", "c"], "image_aggregates": {}}
+    write_shard(
+        tmp_path / "0.json",
+        0,
+        2,
+        {"S-BIAD1": dataset},
+        [make_image("a", 10), make_image("c", 1000)],
+    )
+    write_shard(tmp_path / "1.json", 1, 2, {}, [make_image("b", 100)])
+
+    output_fpath = tmp_path / "merged.json"
+    problems = merge_shards([tmp_path / "0.json", tmp_path / "1.json"], output_fpath)
+
+    assert problems == []
+    assert [key for key, _ in iter_export_entries(output_fpath, "images")] == [
+        "a",
+        "b",
+        "c",
+    ]
+    merged = json.loads(output_fpath.read_text())
+    assert "shard" not in merged
+    aggregates = merged["datasets"]["S-BIAD1"]["image_aggregates"]
+    assert aggregates["n_images"] == 3
+    assert aggregates["size_ranges"]["sizeX"] == {"min": 10.0, "max": 1000.0}
+    assert aggregates["voxel_count_distribution"] == {"1e1": 1, "1e2": 1, "1e3": 1}
+
+
+def test_merge_reports_missing_shards_and_images(tmp_path):
+    dataset = {"title": "A study", "image_uuids": ["a", "z"], "image_aggregates": None}
+    write_shard(tmp_path / "0.json", 0, 2, {"S-BIAD1": dataset}, [make_image("a", 1)])
+
+    problems = merge_shards([tmp_path / "0.json"], tmp_path / "merged.json")
+
+    assert problems == [
+        "Shard 1 is missing",
+        "Image z is referenced by a dataset but missing",
+    ]
+
+
+def test_merge_leaves_out_unset_aggregates(tmp_path):
+    dataset = {"title": "A study", "image_uuids": [], "image_aggregates": None}
+    write_shard(tmp_path / "0.json", 0, 1, {"S-BIAD1": dataset}, [])
+
+    output_fpath = tmp_path / "merged.json"
+    assert merge_shards([tmp_path / "0.json"], output_fpath) == []
+    assert json.loads(output_fpath.read_text())["datasets"]["S-BIAD1"] == {
+        "title": "A study",
+        "image_uuids": [],
+    }
+
+
+def test_merge_keeps_image_fields(tmp_path):
+    for index, image_fields in enumerate([["name", "uuid"], ["name", "uuid"]]):
+        write_shard(tmp_path / f"{index}.json", index, 2, {}, [], image_fields)
+    shard_fpaths = [tmp_path / "0.json", tmp_path / "1.json"]
+
+    output_fpath = tmp_path / "merged.json"
+    assert merge_shards(shard_fpaths, output_fpath) == []
+    assert json.loads(output_fpath.read_text())["image_fields"] == ["name", "uuid"]
+
+    write_shard(tmp_path / "1.json", 1, 2, {}, [], ["uuid"])
+    problems = merge_shards(shard_fpaths, output_fpath)
+    assert problems == [
+        f"{tmp_path / '1.json'} has image fields ['uuid'], expected ['name', 'uuid']"
+    ]
@@ -0,0 +1,35 @@
+import threading
+import time
+
+from bia_export.singleflight import SingleFlight
+
+
+def test_concurrent_calls_share_one_execution():
+    single_flight = SingleFlight()
+    n_executions = 0
+
+    def slow_fetch():
+        nonlocal n_executions
+        n_executions += 1
+        time.sleep(0.1)
+        return object()
+
+    results = []
+    threads = [
+        threading.Thread(
+            target=lambda: results.append(single_flight.do("key", slow_fetch))
+        )
+        for _ in range(8)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert n_executions == 1
+    assert len(results) == 8
+    assert all(result is results[0] for result in results)
+
+    # Completed calls are not cached
+    single_flight.do("key", slow_fetch)
+    assert n_executions == 2
@@ -0,0 +1,155 @@
+import pytest
+from bia_integrator_api import exceptions as api_exceptions, models as api_models
+
+from bia_export import proxyimage, snapshot as snapshot_module
+from bia_export.bia_client_utils import rw_client
+from bia_export.config import settings
+from bia_export.snapshot import (
+    Snapshot,
+    SnapshotClient,
+    SnapshotMissError,
+    take_snapshot,
+    use_snapshot,
+)
+from .utils import (
+    add_image_representation,
+    get_template_api_image,
+    get_template_api_study,
+)
+
+STUDY_UUID = "10000000-0000-0000-0000-000000000000"
+OTHER_STUDY_UUID = "20000000-0000-0000-0000-000000000000"
+URI = "https://placeder.uri/file.zarr/0"
+
+
+def get_images(study_uuid, n, start=0):
+    images = []
+    for i in range(start, start + n):
+        image = get_template_api_image(
+            image_uuid=f"{study_uuid[:8]}-0000-0000-0000-{i:012d}",
+            study_uuid=study_uuid,
+        )
+        # Every other image has an OME-NGFF representation
+        if i % 2 == 0:
+            image = add_image_representation(image)
+        images.append(image)
+
+    return images
+
+
+def write_snapshot(fpath, images):
+    snapshot = Snapshot(fpath, readonly=False)
+    snapshot.put_object("studies", get_template_api_study(study_uuid=STUDY_UUID))
+    for image in images:
+        snapshot.put_object("images", image, image.study_uuid)
+    snapshot.put_ome_zarr_metadata(URI, {"multiscales": []})
+    snapshot.commit()
+    snapshot.close()
+
+
+def test_put_and_get(tmp_path):
+    fpath = tmp_path / "snapshot.db"
+    images = get_images(STUDY_UUID, 3)
+    write_snapshot(fpath, images)
+
+    snapshot = Snapshot(fpath)
+    client = SnapshotClient(snapshot)
+    assert client.get_study(STUDY_UUID).uuid == STUDY_UUID
+    image = client.get_image(images[0].uuid)
+    assert image.dict(exclude_none=True) == images[0].dict(exclude_none=True)
+    assert snapshot.get_ome_zarr_metadata(URI) == {"multiscales": []}
+
+    with pytest.raises(api_exceptions.NotFoundException):
+        client.get_image(OTHER_STUDY_UUID)
+    with pytest.raises(SnapshotMissError):
+        snapshot.get_ome_zarr_metadata("https://missing.uri/file.zarr/0")
+
+    with pytest.raises(FileNotFoundError):
+        Snapshot(tmp_path / "missing.db")
+
+
+def test_search_images_exact_match_pages_and_filters(tmp_path, monkeypatch):
+    # use_snapshot replaces the client and OME Zarr reader, restore them after
+    monkeypatch.setattr(rw_client, "client", rw_client.client)
+    monkeypatch.setattr(
+        proxyimage, "ome_zarr_metadata_reader", proxyimage.ome_zarr_metadata_reader
+    )
+
+    monkeypatch.setattr(settings, "bulk_probe", True)
+
+    fpath = tmp_path / "snapshot.db"
+    images = get_images(STUDY_UUID, 9) + get_images(OTHER_STUDY_UUID, 4)
+    write_snapshot(fpath, images)
+    use_snapshot(fpath)
+    assert not settings.bulk_probe
+
+    expected = [
+        image.uuid
+        for image in images
+        if image.study_uuid == STUDY_UUID and image.representations
+    ]
+    listed, start_uuid = [], None
+    while True:
+        page = rw_client.search_images_exact_match(
+            api_models.SearchImageFilter(
+                image_representations_any=[
+                    api_models.SearchFileRepresentation(type="ome_ngff")
+                ],
+                study_uuid=STUDY_UUID,
+                start_uuid=start_uuid,
+                limit=2,
+            )
+        )
+        listed.extend(image.uuid for image in page)
+        if len(page) < 2:
+            break
+        start_uuid = page[-1].uuid
+    assert listed == expected
+    assert proxyimage.ome_zarr_metadata_reader(URI) == {"multiscales": []}
+
+
+def test_take_snapshot(tmp_path, monkeypatch):
+    images = {"S-A": get_images(STUDY_UUID, 2), "S-B": get_images(OTHER_STUDY_UUID, 2)}
+
+    def fetch_study_snapshot(accession_id):
+        return [
+            ("put_object", ("images", image, image.study_uuid))
+            for image in images[accession_id]
+        ]
+
+    monkeypatch.setattr(snapshot_module, "fetch_study_snapshot", fetch_study_snapshot)
+
+    fpath = tmp_path / "snapshot.db"
+    assert take_snapshot(["S-A", "S-B"], fpath, workers=2) == 2
+
+    snapshot = Snapshot(fpath)
+    snapshotted = snapshot.iter_objects("images", api_models.BIAImage)
+    assert [image.uuid for image in snapshotted] == [
+        image.uuid for image in images["S-A"] + images["S-B"]
+    ]
+    assert (
+        snapshot.connection.execute(
+            "SELECT count(*) FROM snapshot_info WHERE key = 'updated_at'"
+        ).fetchone()[0]
+        == 1
+    )
+
+
+def test_take_snapshot_pulls_accession_ids_as_needed(tmp_path, monkeypatch):
+    n_fetched = 0
+
+    def fetch_study_snapshot(accession_id):
+        nonlocal n_fetched
+        n_fetched += 1
+        return []
+
+    monkeypatch.setattr(snapshot_module, "fetch_study_snapshot", fetch_study_snapshot)
+
+    def iter_accession_ids():
+        for n in range(20):
+            # At most twice the workers are fetched ahead of those finished
+            assert n - n_fetched <= 2
+            yield f"S-{n}"
+
+    fpath = tmp_path / "snapshot.db"
+    assert take_snapshot(iter_accession_ids(), fpath, workers=1) == 20
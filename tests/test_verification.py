@@ -0,0 +1,97 @@
+import json
+
+from typer.testing import CliRunner
+
+from bia_export import cli
+from bia_export.models import Exports
+from bia_export.verification import Difference, diff_exports, verify_export
+from .utils import get_template_export_image
+
+
+def write_export(
+    fpath,
+    images: dict,
+    datasets: dict | None = None,
+    image_fields: list[str] | None = None,
+):
+    exports = {"collections": {}, "datasets": datasets or {}, "images": images}
+    if image_fields:
+        exports["image_fields"] = image_fields
+    fpath.write_text(json.dumps(exports, indent=2, sort_keys=True))
+
+
+def test_verify_export(tmp_path):
+    export_image = get_template_export_image().dict()
+    fpath = tmp_path / "export.json"
+
+    write_export(fpath, {export_image["uuid"]: export_image})
+    assert verify_export(fpath, Exports) == []
+
+    write_export(fpath, {"other-uuid": export_image, "broken": {"uuid": "broken"}})
+    problems = verify_export(fpath, Exports)
+    assert len(problems) == 2
+    assert problems[0].startswith("images broken:")
+    assert problems[1] == f"images other-uuid: uuid is {export_image['uuid']!r}"
+
+
+def test_verify_projected_export(tmp_path):
+    export_image = get_template_export_image().dict()
+    image_fields = ["name", "uuid"]
+    projected_image = {field: export_image[field] for field in image_fields}
+    fpath = tmp_path / "export.json"
+
+    write_export(fpath, {"a": projected_image}, image_fields=image_fields)
+    problems = verify_export(fpath, Exports)
+    assert problems == [f"images a: uuid is {export_image['uuid']!r}"]
+
+    write_export(fpath, {"a": {"name": "a"}}, image_fields=image_fields)
+    problems = verify_export(fpath, Exports)
+    assert len(problems) == 1
+    assert problems[0].startswith("images a:")
+
+
+def test_diff_exports(tmp_path):
+    export_image = get_template_export_image().dict()
+    renamed_image = dict(export_image, name="renamed")
+    old_fpath, new_fpath = tmp_path / "old.json", tmp_path / "new.json"
+
+    write_export(old_fpath, {"a": export_image, "b": export_image})
+    write_export(new_fpath, {"b": renamed_image, "c": export_image})
+
+    assert list(diff_exports(old_fpath, new_fpath)) == [
+        Difference("images", "a", "removed"),
+        Difference("images", "b", "changed", ["name"]),
+        Difference("images", "c", "added"),
+    ]
+    assert list(diff_exports(old_fpath, old_fpath)) == []
+
+
+def test_diff_projected_export(tmp_path):
+    export_image = get_template_export_image().dict()
+    image_fields = ["name", "uuid"]
+    projected_image = {field: export_image[field] for field in image_fields}
+    old_fpath, new_fpath = tmp_path / "old.json", tmp_path / "new.json"
+
+    write_export(old_fpath, {"a": export_image, "b": export_image})
+    write_export(
+        new_fpath,
+        {"a": projected_image, "b": dict(projected_image, name="renamed")},
+        image_fields=image_fields,
+    )
+
+    # Only the fields both exports have are compared
+    assert list(diff_exports(old_fpath, new_fpath)) == [
+        Difference("image_fields", "-", "added"),
+        Difference("images", "b", "changed", ["name"]),
+    ]
+
+
+def test_diff_command_echoes_differences(tmp_path):
+    export_image = get_template_export_image().dict()
+    old_fpath, new_fpath = tmp_path / "old.json", tmp_path / "new.json"
+    write_export(old_fpath, {"a": export_image})
+    write_export(new_fpath, {"a": dict(export_image, name="renamed")})
+
+    result = CliRunner().invoke(cli.app, ["diff", str(old_fpath), str(new_fpath)])
+    assert result.exit_code == 1
+    assert result.stdout == "~ images a (name)\n"